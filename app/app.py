@@ -1,5 +1,5 @@
 '''
-Streamlit app for visualising district and street data in Aarhus.
+Streamlit app for visualising district and street data in Aarhus (and other municipalities configured in data/municipalities.json).
 Link to app: https://aarhus-rentmap.streamlit.app/.
 
 To run app locally, type:
@@ -11,6 +11,8 @@ Spatial Analytics, Cultural Data Science (F2023)
 
 # utils 
 import pathlib
+import time
+import importlib
 
 # web app
 import streamlit as st
@@ -18,13 +20,15 @@ import streamlit as st
 # add logo 
 from PIL import Image
 
+# request latency and cache telemetry
+import telemetry
+
 # sys append to make street view work with custom modules
 import sys
 sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
+from config import get_municipality, list_municipalities
 
-# import district and street view functions
-from district_view import district_view
-from street_view import street_view
+# NB. district and street view are imported lazily in main() so that only the modules of the selected view are loaded (see load_view)
 
 def add_logo(path: pathlib.Path):
     '''
@@ -59,6 +63,7 @@ def add_sidebar(path: pathlib.Path):
 
     Returns:
         view: View selected in "view selector"
+        municipality: key of municipality selected in "city selector" (default municipality if only one is configured)
     '''
     with st.sidebar:
         
@@ -89,7 +94,64 @@ def add_sidebar(path: pathlib.Path):
             </style>
             """, unsafe_allow_html=True)
 
-        return view
+        # add city selector if several municipalities are configured
+        municipalities = list_municipalities()
+
+        if len(municipalities) > 1:
+            municipality = st.selectbox("Select city", options=list(municipalities), format_func=lambda key: municipalities[key])
+        else:
+            municipality = next(iter(municipalities))
+
+        return view, municipality
+
+
+def load_view(view:str):
+    '''
+    Function for lazily importing the view function selected in the "view selector".
+    Heavy dependencies (e.g., plotly, esda and libpysal) are thereby only imported once the view that needs them is opened.
+
+    Args:
+        view: View selected in "view selector" ("District" or "Street")
+
+    Returns:
+        view_function: function creating the selected view page
+        import_time: time in seconds spent importing the view module (0 if already imported)
+    '''
+    # define module name from view
+    module_name = f"{view.lower()}_view"
+
+    # check if module has already been imported in this process
+    already_imported = module_name in sys.modules
+
+    # import module and time it
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    import_time = 0 if already_imported else time.perf_counter() - start
+
+    # get view function (named the same as the module)
+    view_function = getattr(module, module_name)
+
+    return view_function, import_time
+
+
+def startup_report(view:str, import_time:float, render_time:float):
+    '''
+    Function for printing a startup timing report to the terminal running the app.
+    The report is only printed the first time a view is imported in the process (i.e., on cold start of the view).
+
+    Args:
+        view: View selected in "view selector"
+        import_time: time in seconds spent importing the view module
+        render_time: time in seconds spent rendering the view (including import)
+    '''
+    # only report on cold start of the view
+    if import_time == 0:
+        return
+
+    # time since process start (recorded in telemetry, as app.py itself is run again on every rerun)
+    since_start = time.perf_counter() - telemetry.PROCESS_START
+
+    print(f"[INFO:] Startup timing ({view} view): import {import_time:.2f}s, render {render_time:.2f}s, {since_start:.2f}s since process start", flush=True)
 
 
 def main():
@@ -103,15 +165,20 @@ def main():
     # add logo
     add_logo(path)
     
-    # add sidebar and obtain view selection
-    view = add_sidebar(path)
+    # add sidebar and obtain view and city selection
+    view, municipality = add_sidebar(path)
 
-    # run view based on selection in "view selector"
-    if view == "District":
-        district_view(path)
-    
-    if view == 'Street':
-        street_view(path)
+    # start recording timings of this rerun
+    telemetry.start_rerun(view)
+
+    # lazily import view based on selection in "view selector" and run it. Only the results of the selected city are loaded
+    start = time.perf_counter()
+    view_function, import_time = load_view(view)
+    telemetry.record_timing("view_import", import_time)
+    view_function(path, get_municipality(municipality))
+
+    # report startup timings in terminal
+    startup_report(view, import_time, time.perf_counter() - start)
     
     with st.sidebar:
         # add white space
@@ -120,6 +187,9 @@ def main():
         # add github usernames
         st.markdown('<p style="color:white; font-weight:bold; text-decoration:none; text-align:center;"><a style="color:white; text-decoration:none;" href="https://github.com/MinaAlmasi">@MinaAlmasi</a> & <a style="color:white; text-decoration:none;" href="https://github.com/drasbaek">@drasbaek</a></p>', unsafe_allow_html=True)
 
+    # record total time of rerun, write metrics and show diagnostics panel (if ?diagnostics=1)
+    telemetry.finish_rerun()
+
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
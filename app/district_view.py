@@ -14,27 +14,38 @@ Spatial Analytics, Cultural Data Science (F2023)
 
 # utils 
 import pathlib
-from ast import literal_eval
 
 # web app
 import streamlit as st
 
-# geospatial mapping
-import folium
-from streamlit_folium import folium_static
-from folium.features import GeoJsonTooltip
-
-# visualisations
-import plotly.express as px
+# embedding of map html
+import streamlit.components.v1 as components
 
 # data wrangling 
 import pandas as pd
 import geopandas as gpd
 
+# tile server url (used if tile server is configured)
+from vector_tiles import get_tile_url
+
+# data loading, map building and prerendered maps (shared with prerender_maps.py)
+from maps import load_district_data, load_grid_data, add_zoom_level, create_district_map, render_map, read_prerendered_map, MAP_HEIGHT, MAP_WIDTH
+
+# request latency and cache telemetry
+from telemetry import timer, tracked_cache, record_timing
+
 # custom module for adding missing districts
 import sys
 sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
 from utils import add_missing_districts 
+from listing_store import load_listing_store, filter_listings, aggregate_by_district
+from feature_store import open_feature_store
+from adjacency import load_adjacency, neighbor_ids
+from rent_surface import load_rent_surface
+from results_db import list_names, get_district, get_district_neighbors
+
+# time for timing filter queries and map build
+import time
 
 def plot_neighbor_stats(neighbor_data, y_col, y_title):
     '''
@@ -48,6 +59,9 @@ def plot_neighbor_stats(neighbor_data, y_col, y_title):
     Returns 
         fig: plotly figure
     '''
+    # import plotly lazily as it is only needed once the plot is drawn
+    import plotly.express as px
+
     # define color
     colors = ["lightslategray",] * len(neighbor_data)
         
@@ -75,31 +89,170 @@ def plot_neighbor_stats(neighbor_data, y_col, y_title):
 
     return fig
 
-def district_view(path): 
+@tracked_cache("listing_store", cache=st.cache_resource(max_entries=4)) # keep stores of at most 4 cities in memory
+def load_listings(store_path:pathlib.Path):
     '''
-    Function to create district view page of Aarhus in streamlit app
+    Function to load the columnar listing store once per process (shared across sessions).
 
-    Args:
-        path: path to script
+    Args
+        store_path: path to listing_store.npz
+
+    Returns
+        store: columnar store (see src/listing_store.py)
     '''
+    return load_listing_store(store_path)
 
-    # read in data
-    data = pd.read_csv(path.parents[1] / "results" / "district_aggregates.csv")
+@tracked_cache("district_features", cache=st.cache_resource(max_entries=4)) # keep stores of at most 4 cities open
+def load_district_features(store_path:pathlib.Path):
+    '''
+    Function to open the memory-mapped feature store of district aggregates once per process (pages are shared between processes by the OS).
 
-    # change wkt to geometry
-    data["geometry"] = gpd.GeoSeries.from_wkt(data["geometry"])
+    Args
+        store_path: path to feature store folder (results/features/districts)
+
+    Returns
+        store: feature store (see src/feature_store.py)
+    '''
+    return open_feature_store(store_path)
 
-    # convert to geodataframe
-    data = gpd.GeoDataFrame(data, geometry="geometry")
+@tracked_cache("district_data", cache=st.cache_resource(max_entries=4)) # keep aggregates of at most 4 cities in memory
+def load_districts(municipality:dict):
+    '''
+    Function to decode the district aggregates from the feature store once per process (shared across sessions, so the view must not modify them).
 
-    # add zoom level to dataframe manually. Each value corresponds to a district in the same order as in the dataframe
-    data["zoom_level"] = [11,13,11,13,13,14,13,13,11,12,12,12,12,14,14,12,12,11,14,14,14,13,11,12,14,12,12,11,12,14,12,12,11,13,13,12,13,12,14,13,14,14]
+    Args
+        municipality: configuration of municipality (see src/config.py)
 
-    # set epsg to 25832
-    data = data.set_crs("epsg:25832")
+    Returns
+        data: geodataframe with district aggregates (see maps.load_district_data)
+    '''
+    return load_district_data(municipality, open_store=load_district_features)
 
-    # add missing districts to dataframe
-    missing_districts = add_missing_districts(path)
+@tracked_cache("district_adjacency", cache=st.cache_resource(max_entries=4)) # keep adjacency of at most 4 cities in memory
+def load_district_adjacency(adjacency_path:pathlib.Path):
+    '''
+    Function to load the adjacency of districts once per process (shared across sessions).
+
+    Args
+        adjacency_path: path to district_adjacency.npz
+
+    Returns
+        adjacency: adjacency of districts (see src/adjacency.py)
+    '''
+    return load_adjacency(adjacency_path)
+
+@tracked_cache("grid_aggregates", cache=st.cache_resource(max_entries=4)) # keep grids of at most 4 cities in memory
+def load_grid(grid_path:pathlib.Path, crs:int):
+    '''
+    Function to load the grid aggregates once per process (shared across sessions).
+
+    Args
+        grid_path: path to grid_aggregates.csv
+        crs: crs of the geometry
+
+    Returns
+        grid_data: grid aggregates (None if they do not exist, see src/grid_aggregates.py)
+    '''
+    return load_grid_data(grid_path, crs)
+
+@tracked_cache("rent_surface", cache=st.cache_resource(max_entries=4)) # keep surfaces of at most 4 cities in memory
+def load_surface(surface_path:pathlib.Path):
+    '''
+    Function to load the rent surface once per process (shared across sessions).
+
+    Args
+        surface_path: path to rent_surface.npz
+
+    Returns
+        raster: rent surface (see src/rent_surface.py)
+    '''
+    return load_rent_surface(surface_path)
+
+def add_listing_filters(store:dict):
+    '''
+    Function for adding filter controls (rental type, rooms, size and price) to the sidebar.
+
+    Args
+        store: columnar listing store
+
+    Returns
+        filters: dict with filters that differ from their default (None if no filters are set)
+    '''
+    # define options and ranges from the listings
+    rental_type_options = store["rental_type_categories"].tolist()
+    rooms_options = store["rooms_categories"].tolist()
+    size_bounds = (int(store["square_meters"].min()), int(store["square_meters"].max()))
+    price_bounds = (int(store["rent_without_expenses"].min()), int(store["rent_without_expenses"].max()))
+
+    with st.expander("Filter listings"):
+        rental_types = st.multiselect("Rental type", options=rental_type_options, default=rental_type_options)
+        rooms = st.multiselect("Rooms", options=rooms_options, default=rooms_options)
+        size_range = st.slider("Size (m2)", min_value=size_bounds[0], max_value=size_bounds[1], value=size_bounds)
+        price_range = st.slider("Rent (DKK)", min_value=price_bounds[0], max_value=price_bounds[1], value=price_bounds, step=250)
+
+    # only keep filters that differ from their default
+    filters = {
+        "rental_types": rental_types if rental_types != rental_type_options else None,
+        "rooms": rooms if rooms != rooms_options else None,
+        "size_range": size_range if size_range != size_bounds else None,
+        "price_range": price_range if price_range != price_bounds else None,
+    }
+    filters = {key: value for key, value in filters.items() if value is not None}
+
+    if len(filters) == 0:
+        return None
+
+    return filters
+
+def apply_listing_filters(data:gpd.GeoDataFrame, store:dict, filters:dict):
+    '''
+    Function for replacing the precomputed district aggregates with aggregates recomputed from the filtered listings.
+
+    Args
+        data: geodataframe with district aggregates
+        store: columnar listing store
+        filters: filters from add_listing_filters
+
+    Returns
+        data: geodataframe with recomputed aggregates
+    '''
+    # filter and aggregate listings (timed to show query time)
+    start = time.perf_counter()
+    mask = filter_listings(store, **filters)
+    filtered_data = aggregate_by_district(store, mask)
+    query_time = (time.perf_counter() - start) * 1000
+
+    st.caption(f"{mask.sum()} listings match filters ({query_time:.0f} ms)")
+
+    # replace precomputed aggregates
+    cols = ["apartment_rent_sqm_now", "apartment_rent_sqm_then", "room_rent_now", "room_rent_then", "apartment_rent_change", "room_rent_change"]
+    data = data.drop(columns=cols).merge(filtered_data[["district"] + cols], on="district", how="left")
+
+    return data
+
+def district_view(path, municipality:dict): 
+    '''
+    Function to create district view page of Aarhus in streamlit app
+
+    Args:
+        path: path to script
+        municipality: configuration of selected municipality (see src/config.py)
+    '''
+    # define results folder of municipality
+    results_path = municipality["paths"]["results"]
+
+    with timer("data_load"):
+        # query single districts from the results database if it exists (the full aggregates are then only loaded to build the map or apply filters)
+        db_path = results_path / "results.sqlite"
+
+        if db_path.exists():
+            data = None
+            district_names = list_names(db_path, "districts")
+
+        else:
+            # read in district aggregates (from memory-mapped feature store if it exists)
+            data = load_districts(municipality)
+            district_names = data['district']
 
     # create columns for map and statistics
     left_col, right_col, = st.columns(2, gap = "large")
@@ -108,7 +261,7 @@ def district_view(path):
     with st.sidebar:
 
         # create select box
-        selected_district = st.selectbox('Select district', data['district'])
+        selected_district = st.selectbox('Select district', district_names)
 
         # set correct spacing
         st.markdown(
@@ -118,78 +271,94 @@ def district_view(path):
             </style>
             """, unsafe_allow_html=True)
 
-        # identify selected district
-        selected_data = data[data['district'] == selected_district]
+        # add filters and recompute aggregates from listings if any filters are set
+        store_path = results_path / "listing_store.npz"
+        filters = None
 
-        # write district count
-        st.write(f"{len(data)} districts in total") 
+        if store_path.exists():
+            store = load_listings(store_path)
+            filters = add_listing_filters(store)
 
-        # convert to epsg 4326
-        selected_data = selected_data.to_crs("epsg:4326")
+            if filters is not None:
+                if data is None:
+                    with timer("data_load"):
+                        data = load_districts(municipality)
+
+                with timer("listing_filters"):
+                    data = apply_listing_filters(data, store, filters)
+
+        # identify selected district (from the database if the full aggregates are not loaded)
+        if data is None:
+            with timer("db_query"):
+                selected_data = add_zoom_level(get_district(db_path, selected_district), municipality)
+        else:
+            selected_data = data[data['district'] == selected_district]
+
+        # add options to show grid cells or smoothed rents instead (only in the aggregates, not recomputed with filters)
+        smoothed, grid_data = False, None
+
+        if filters is None:
+            grid_data = load_grid(results_path / "grid_aggregates.csv", municipality["crs"])
+
+        if grid_data is not None:
+            map_layer = st.radio("Map layer", ["Districts", "Grid"], horizontal=True, help="Grid shows rents in equally sized cells, with smaller cells when zoomed in")
+
+            if map_layer == "Districts":
+                grid_data = None
 
-        # extract zoom level
-        selected_zoom_level = selected_data['zoom_level'].astype(int)
+        if filters is None and grid_data is None and "apartment_rent_sqm_now_smoothed" in selected_data.columns:
+            smoothed = st.checkbox("Smooth districts with few listings", value=False, help="Shrinks the rents of districts with few listings towards their neighbor districts and fills districts without listings")
 
-        # extract location coordinates
-        selected_location = [selected_data['geometry'].centroid.y, selected_data['geometry'].centroid.x]
+        # add option to show the rent surface on top of the map
+        rent_surface = None
+        surface_path = results_path / "rent_surface.npz"
+
+        if surface_path.exists() and st.checkbox("Show rent surface", value=False, help="Apartment rent per m2 smoothed across streets (areas with few listings are left out)"):
+            rent_surface = load_surface(surface_path)
+
+        # write district count
+        st.write(f"{len(district_names)} districts in total") 
+
+        # convert to epsg 4326
+        with timer("reprojection"):
+            selected_data = selected_data.to_crs("epsg:4326")
 
     # create embedded map in right column
     with right_col:
         # add spacing
         st.write("")
-    
-        # update center of map to selected district
-        folium_map = folium.Map(location=selected_location,
-                                zoom_start=int(selected_zoom_level),
-                                min_zoom=10)
-
-        # create map
-        folium.Choropleth(
-            geo_data=data,
-            name='choropleth',
-            data=data,
-            columns=['district', 'apartment_rent_sqm_now'],
-            key_on='feature.properties.district',
-            fill_color='Blues',
-            fill_opacity=0.8,
-            line_opacity=0.2,
-            legend_name='Apartment Rent per sqm Now',
-            highlight=True
-        ).add_to(folium_map)
-
-        # define tooltip, but unclickable
-        tooltip = GeoJsonTooltip(
-            fields=['district'], 
-            aliases=['District: '],
-            labels=True,
-            permanent=False
-        )
-        
-        folium.GeoJson(data, 
-            tooltip=tooltip,
-            style_function=lambda x: {"color": "transparent", "weight": 0, "opacity": 0, "fillOpacity": 0},
-        ).add_to(folium_map)     
-
-        # draw missing districts on map, make them grey, make hover effect, write custom text in tooltip
-        tooltip_missing = GeoJsonTooltip(
-            fields=['district'], 
-            aliases=['District: '],
-            labels=True,
-            permanent=False, 
-        )
-
-        folium.GeoJson(missing_districts,
-            tooltip=tooltip_missing,
-        style_function=lambda x: {"color": "grey", "weight": 1, "opacity": 0.7, "fillOpacity": 0.7},
-        ).add_to(folium_map)
-
-        # add selected district to map
-        folium.GeoJson(selected_data, 
-        style_function=lambda x: {"color": "#FF595A", "weight": 4, "opacity": 1, "fillOpacity": 0},
-        ).add_to(folium_map)
-         
+
+        # get tile server url (None if tile mode is off)
+        tile_url = get_tile_url(municipality["key"])
+
+        # use prerendered map of selected district (only rendered without filters)
+        html = None
+
+        if filters is None and not smoothed and grid_data is None and rent_surface is None:
+            with timer("map_prerendered"):
+                html = read_prerendered_map(results_path / "maps" / "districts", selected_district, results_path / "district_aggregates.csv", tile_url)
+
+        if html is None:
+            # time building of map (until serialization)
+            map_start = time.perf_counter()
+
+            # load full district aggregates for the map (if only the selected district is queried from the database)
+            if data is None:
+                with timer("data_load"):
+                    data = load_districts(municipality)
+
+            # add missing districts (layer is cached per process, projected for folium)
+            missing_districts = add_missing_districts(municipality, to_crs="epsg:4326")
+
+            folium_map = create_district_map(data, selected_data, missing_districts, tile_url, column="apartment_rent_sqm_now_smoothed" if smoothed else "apartment_rent_sqm_now", grid_data=grid_data, rent_surface=rent_surface)
+
+            record_timing("map_build", time.perf_counter() - map_start)
+
+            with timer("map_serialization"):
+                html = render_map(folium_map)
+
         # define width and height of map
-        folium_static(folium_map, height=630, width=482)
+        components.html(html, height=MAP_HEIGHT + 10, width=MAP_WIDTH)
     
     # create statistics in left column
     with left_col:
@@ -201,14 +370,24 @@ def district_view(path):
 
         # initialize columns for displaying rents
         apart_col, room_col = st.columns(2)
+
+        # get rents and changes (computed from the smoothed rents if selected)
+        suffix = "_smoothed" if smoothed else ""
+        rents = {col: selected_data[f"{col}{suffix}"].values[0] for col in ["apartment_rent_sqm_now", "apartment_rent_sqm_then", "room_rent_now", "room_rent_then"]}
+
+        if smoothed:
+            apartment_change = round((rents["apartment_rent_sqm_now"] - rents["apartment_rent_sqm_then"]) / rents["apartment_rent_sqm_then"] * 100, 1)
+            room_change = round((rents["room_rent_now"] - rents["room_rent_then"]) / rents["room_rent_then"] * 100, 1)
+        else:
+            apartment_change, room_change = selected_data['apartment_rent_change'].values[0], selected_data['room_rent_change'].values[0]
         
         # add apartment rent
         with apart_col:
-            st.metric(label="Apartment (per m2)", value=f"{selected_data['apartment_rent_sqm_now'].values[0]} DKK", delta=f"{selected_data['apartment_rent_change'].values[0]} % since 2014-16", delta_color="inverse")
+            st.metric(label="Apartment (per m2)", value=f"{rents['apartment_rent_sqm_now']} DKK", delta=f"{apartment_change} % since 2014-16", delta_color="inverse")
         
         # add room rent
         with room_col:
-            st.metric(label="Room", value=f"{selected_data['room_rent_now'].values[0]} DKK", delta=f"{selected_data['room_rent_change'].values[0]} % since 2014-16", delta_color="inverse")
+            st.metric(label="Room", value=f"{rents['room_rent_now']} DKK", delta=f"{room_change} % since 2014-16", delta_color="inverse")
         
         # add spacing
         st.write("")
@@ -216,15 +395,24 @@ def district_view(path):
         # start plot with neighbor districts
         st.markdown("<p style='margin-top: 5px; margin-bottom: 0; font-weight: bold;'>Compared to Neighbor Districts</p>", unsafe_allow_html=True)
 
-        # create list of neighbor districts
-        neighbors = selected_data["neighbors"].tolist()[0]
-        neighbors = literal_eval(neighbors)
+        if filters is None and db_path.exists():
+            # query neighbor districts from the database
+            with timer("db_query"):
+                neighbor_data = get_district_neighbors(db_path, selected_district)
+
+        else:
+            # get ids of neighbor districts (ids are the positions of districts in the aggregates, so also the rows of data)
+            adjacency = load_district_adjacency(results_path / "district_adjacency.npz")
+            neighbor_rows = neighbor_ids(adjacency, selected_district)
 
-        # extract neighbor data from dataframe
-        neighbor_data = data[data["district"].isin(neighbors)]
+            # extract neighbor data from dataframe
+            neighbor_data = data.iloc[neighbor_rows]
+
+        neighbors = neighbor_data["district"].tolist()
 
         # convert neighbor data to epsg 4326
-        neighbor_data = neighbor_data.to_crs("epsg:4326")
+        with timer("reprojection"):
+            neighbor_data = neighbor_data.to_crs("epsg:4326")
 
         # concat with selected district
         neighbor_data = pd.concat([selected_data, neighbor_data])
@@ -250,6 +438,3 @@ def district_view(path):
             else:
                 room_fig = plot_neighbor_stats(neighbor_data, "room_rent_now", "Room Rent")
                 st.plotly_chart(room_fig, use_container_width=True)
-    
-    # layer control for street view
-    folium.LayerControl().add_to(folium_map)
\ No newline at end of file
@@ -0,0 +1,622 @@
+'''
+Functions for loading the data of the district and street view, building their folium maps and reading maps prerendered with prerender_maps.py.
+
+The maps only depend on the selected district/street (and on the tile server), so they are built by the same functions
+in the app (district_view.py, street_view.py) and when prerendering the map of every selection.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import gzip
+import json
+import pathlib
+
+# geospatial mapping
+import folium
+from folium.features import GeoJsonTooltip
+from folium.plugins import FastMarkerCluster
+from branca.colormap import StepColormap
+from branca.utilities import color_brewer
+from branca.element import MacroElement
+from jinja2 import Template
+
+# data wrangling
+import pandas as pd
+import geopandas as gpd
+import numpy as np
+
+# vector tile layer (used if tile server is configured)
+from vector_tiles import VectorTileLayer
+
+# custom module for reading the memory-mapped feature store of aggregates
+import sys
+sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
+from feature_store import open_feature_store, to_geodataframe
+
+# size of the maps in the app (in pixels)
+MAP_HEIGHT = 630
+MAP_WIDTH = 482
+
+# color of the selected district/street
+SELECTED_COLOR = "#FF595A"
+
+# columns of the street aggregates used in the street view
+STREET_COLS = ["street", "district", "rent_per_square_meter", "count"]
+
+# confidence intervals of the street rents (used if in the aggregates)
+STREET_CI_COLS = ["rent_per_square_meter_ci_low", "rent_per_square_meter_ci_high"]
+
+def load_district_data(municipality:dict, open_store=open_feature_store):
+    '''
+    Function for loading the district aggregates of a municipality (from the feature store if it exists, otherwise from csv).
+
+    Args
+        municipality: configuration of municipality (see src/config.py)
+        open_store: function opening the feature store (e.g. a cached version in the app)
+
+    Returns
+        data: geodataframe with district aggregates and "zoom_level"
+    '''
+    results_path = municipality["paths"]["results"]
+    features_path = results_path / "features" / "districts"
+
+    if (features_path / "manifest.json").exists():
+        # decode districts from memory-mapped feature store
+        data = to_geodataframe(open_store(features_path))
+
+    else:
+        # read in data
+        data = pd.read_csv(results_path / "district_aggregates.csv")
+
+        # change wkt to geometry
+        data["geometry"] = gpd.GeoSeries.from_wkt(data["geometry"])
+
+        # convert to geodataframe
+        data = gpd.GeoDataFrame(data, geometry="geometry")
+
+    # add zoom level to dataframe from configuration. Each value corresponds to a district in the same order as in the dataframe (12 if not configured)
+    data["zoom_level"] = municipality.get("district_zoom_levels", 12)
+
+    # set epsg of municipality (25832 for Denmark)
+    data = data.set_crs(epsg=municipality["crs"], allow_override=True)
+
+    return data
+
+def add_zoom_level(data, municipality:dict):
+    '''
+    Function for adding the zoom level of districts queried from the results database (see src/results_db.py), looked up by their "id".
+
+    Args
+        data: geodataframe with district aggregates and "id" (position of the district in the aggregates)
+        municipality: configuration of municipality (see src/config.py)
+
+    Returns
+        data: geodataframe with "zoom_level"
+    '''
+    zoom_levels = municipality.get("district_zoom_levels", 12)
+
+    data["zoom_level"] = np.asarray(zoom_levels)[data["id"].to_numpy()] if np.ndim(zoom_levels) > 0 else zoom_levels
+
+    return data
+
+def load_street_data(municipality:dict, open_store=open_feature_store):
+    '''
+    Function for loading the street aggregates of a municipality (from the feature store if it exists, otherwise from csv).
+
+    Args
+        municipality: configuration of municipality (see src/config.py)
+        open_store: function opening the feature store (e.g. a cached version in the app)
+
+    Returns
+        street_data: geodataframe with street aggregates
+    '''
+    results_path = municipality["paths"]["results"]
+    features_path = results_path / "features" / "streets"
+
+    if (features_path / "manifest.json").exists():
+        # decode only the columns used in the view from memory-mapped feature store (not the similar streets columns)
+        store = open_store(features_path)
+        columns = STREET_COLS + [col for col in STREET_CI_COLS if col in store["manifest"]["columns"]]
+        street_data = to_geodataframe(store, columns=columns)
+
+    else:
+        # read in data
+        street_data = pd.read_csv(results_path / "street_aggregates.csv")
+
+        # change wkt to geometry
+        street_data["geometry"] = gpd.GeoSeries.from_wkt(street_data["geometry_street"])
+
+        # convert to geodataframe
+        street_data = gpd.GeoDataFrame(street_data, geometry="geometry")
+
+    # set epsg of municipality (25832 for Denmark)
+    street_data = street_data.set_crs(epsg=municipality["crs"], allow_override=True)
+
+    return street_data
+
+def load_grid_data(grid_path:pathlib.Path, crs=25832):
+    '''
+    Function for loading the grid aggregates of a municipality (see src/grid_aggregates.py).
+
+    Args
+        grid_path: path to grid_aggregates.csv
+        crs: crs of the geometry (defaults to 25832 as this is the crs for Denmark)
+
+    Returns
+        grid_data: geodataframe with one row per cell and level (None if the grid aggregates do not exist)
+    '''
+    if not grid_path.exists():
+        return None
+
+    grid_data = pd.read_csv(grid_path)
+
+    # change wkt to geometry
+    grid_data = gpd.GeoDataFrame(grid_data, geometry=gpd.GeoSeries.from_wkt(grid_data["geometry"]), crs=crs)
+
+    return grid_data
+
+class ZoomLevels(MacroElement):
+    '''
+    Element showing each layer only within its range of zoom levels (below the lowest range the coarsest layer is shown, above the highest the finest).
+
+    Args
+        layers: list of (layer, min_zoom, max_zoom)
+    '''
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_levels = [
+                {%- for layer, min_zoom, max_zoom in this.layers %}
+                {layer: {{ layer.get_name() }}, min: {{ min_zoom }}, max: {{ max_zoom }}},
+                {%- endfor %}
+            ];
+
+            var {{ this.get_name() }}_update = function() {
+                var levels = {{ this.get_name() }}_levels;
+                var zoom = Math.min(Math.max({{ this._parent.get_name() }}.getZoom(), {{ this.min_zoom }}), {{ this.max_zoom }});
+
+                levels.forEach(function(level) {
+                    if (zoom >= level.min && zoom <= level.max) {
+                        // keep the cells below the outline of the selected district
+                        level.layer.addTo({{ this._parent.get_name() }}).bringToBack();
+                    } else {
+                        {{ this._parent.get_name() }}.removeLayer(level.layer);
+                    }
+                });
+            };
+
+            {{ this._parent.get_name() }}.on("zoomend", {{ this.get_name() }}_update);
+            {{ this.get_name() }}_update();
+        {% endmacro %}
+        """)
+
+    def __init__(self, layers:list):
+        super().__init__()
+        self._name = "ZoomLevels"
+
+        self.layers = layers
+        self.min_zoom = min(min_zoom for _, min_zoom, _ in layers)
+        self.max_zoom = max(max_zoom for _, _, max_zoom in layers)
+
+def add_grid_layer(folium_map, grid_data, tile_url:str=None, column:str="apartment_rent_sqm_now", n_bins:int=6):
+    '''
+    Function for drawing the grid aggregates as a choropleth with finer cells when zoomed in.
+    From vector tiles, each zoom level only contains the cells of its resolution. From inline GeoJSON, each resolution is a layer
+    which is only shown at its zoom levels (ZoomLevels).
+
+    Args
+        folium_map: folium map to add the layer to
+        grid_data: geodataframe with grid aggregates (from load_grid_data)
+        tile_url: URL of the tile server (None to draw cells from inline GeoJSON)
+        column: column to color cells by
+        n_bins: number of color bins
+    '''
+    bins, colors, colormap = district_colormap(grid_data, column, n_bins)
+    style = {"fillOpacity": 0.7, "color": "black", "weight": 0.5, "opacity": 0.3}
+
+    if tile_url is not None:
+        VectorTileLayer(
+            url=f"{tile_url}/grid/{{z}}/{{x}}/{{y}}.pbf",
+            layer_name="grid",
+            style={"fill": True, **style},
+            color_field=column,
+            thresholds=bins[1:-1],
+            colors=colors,
+            missing_color="grey",
+            tooltip_field="count",
+            tooltip_alias="Listings: ",
+            max_native_zoom=int(grid_data["max_zoom"].max()),
+        ).add_to(folium_map)
+
+    else:
+        def style_function(feature):
+            value = feature["properties"][column]
+
+            # find color of bin (cells without listings of the rental type are grey)
+            fill_color = "grey" if value is None else colors[min(np.digitize(value, bins) - 1, n_bins - 1)]
+
+            return {"fillColor": fill_color, **style}
+
+        tooltip = GeoJsonTooltip(fields=["count", column], aliases=["Listings: ", "Rent per sqm: "], labels=True, permanent=False)
+
+        # one layer per resolution
+        layers = []
+
+        for (cell_size, min_zoom, max_zoom), level in grid_data.groupby(["cell_size", "min_zoom", "max_zoom"], sort=False):
+            features = json.loads(level[["count", column, "geometry"]].to_crs("epsg:4326").to_json(na="null", drop_id=True))
+
+            layer = folium.GeoJson(features, name=f"grid_{cell_size}", style_function=style_function, tooltip=tooltip).add_to(folium_map)
+            layers.append((layer, int(min_zoom), int(max_zoom)))
+
+        # show each resolution only at its zoom levels
+        folium_map.add_child(ZoomLevels(layers))
+
+    # add legend
+    colormap.add_to(folium_map)
+
+def add_rent_surface(folium_map, raster:dict, n_bins:int=6, opacity:float=0.7):
+    '''
+    Function for drawing the rent surface (see src/rent_surface.py) as an image overlay. The overlay is colored with vectorized binning,
+    so the cost only depends on the size of the raster.
+
+    Args
+        folium_map: folium map to add the overlay to
+        raster: rent surface from load_rent_surface (with "overlay" and "overlay_bounds")
+        n_bins: number of color bins
+        opacity: opacity of the overlay
+    '''
+    overlay = raster["overlay"]
+    finite = np.isfinite(overlay)
+
+    # compute equally sized bins of the values (cells without rent are transparent)
+    _, bins = np.histogram(overlay[finite], bins=n_bins)
+    colors = color_brewer("Blues", n=n_bins)
+
+    palette = np.array([[int(color[i:i + 2], 16) for i in (1, 3, 5)] + [255] for color in colors], dtype=np.uint8)
+    codes = np.clip(np.digitize(np.nan_to_num(overlay, nan=bins[0]), bins) - 1, 0, n_bins - 1)
+
+    image = palette[codes]
+    image[~finite] = 0
+
+    folium.raster_layers.ImageOverlay(image, bounds=raster["overlay_bounds"].tolist(), opacity=opacity, mercator_project=False, name="rent_surface").add_to(folium_map)
+
+    # add legend
+    StepColormap(colors, index=bins, vmin=bins[0], vmax=bins[-1], caption="Apartment Rent per sqm (Smoothed Surface)").add_to(folium_map)
+
+def district_colormap(data, column:str="apartment_rent_sqm_now", n_bins:int=6):
+    '''
+    Function for binning the districts by a column as folium.Choropleth does (equally sized bins in the Blues palette).
+
+    Args
+        data: dataframe with district data
+        column: column to color districts by
+        n_bins: number of color bins
+
+    Returns
+        bins: bin edges
+        colors: color of each bin
+        colormap: stepped colormap (used as legend)
+    '''
+    # compute equally sized bins of the values (missing values are drawn in black)
+    _, bins = np.histogram(data[column].dropna(), bins=n_bins)
+
+    colors = color_brewer("Blues", n=n_bins)
+    caption = "Apartment Rent per sqm Now (Smoothed)" if column.endswith("_smoothed") else "Apartment Rent per sqm Now"
+    colormap = StepColormap(colors, index=bins, vmin=bins[0], vmax=bins[-1], caption=caption)
+
+    return bins, colors, colormap
+
+def add_district_tiles(folium_map, data, tile_url:str, column:str="apartment_rent_sqm_now", n_bins:int=6):
+    '''
+    Function for drawing the districts as a choropleth from vector tiles instead of inline GeoJSON.
+
+    Args
+        folium_map: folium map to add the layer to
+        data: dataframe with district data (only used to compute color bins)
+        tile_url: URL of the tile server
+        column: column to color districts by
+        n_bins: number of color bins
+    '''
+    bins, colors, colormap = district_colormap(data, column, n_bins)
+
+    # add vector tile layer
+    VectorTileLayer(
+        url=f"{tile_url}/districts/{{z}}/{{x}}/{{y}}.pbf",
+        layer_name="districts",
+        style={"fill": True, "fillOpacity": 0.8, "color": "black", "opacity": 0.2, "weight": 1},
+        color_field=column,
+        thresholds=bins[1:-1],
+        colors=colors,
+        missing_color="black",
+        tooltip_field="district",
+        tooltip_alias="District: ",
+        max_native_zoom=14,
+    ).add_to(folium_map)
+
+    # add legend
+    colormap.add_to(folium_map)
+
+def district_features(data, selected_district:str, column:str="apartment_rent_sqm_now"):
+    '''
+    Function for exporting the districts as slim GeoJSON features, with only the geometry, the district and the plotted column
+    (instead of every aggregate and the lists of neighbors).
+
+    Args
+        data: geodataframe with district data
+        selected_district: selected district (placed last, so its outline is drawn on top)
+        column: plotted column
+
+    Returns
+        features: GeoJSON feature collection (dict) in epsg 4326
+    '''
+    features = data[["district", column, "geometry"]].to_crs("epsg:4326")
+
+    # draw selected district last
+    features = features.iloc[np.argsort(features["district"].to_numpy() == selected_district, kind="stable")]
+
+    return json.loads(features.to_json(na="null", drop_id=True))
+
+def add_district_choropleth(folium_map, data, selected_district:str, column:str="apartment_rent_sqm_now", n_bins:int=6):
+    '''
+    Function for drawing the districts as a choropleth with tooltips and the selected district highlighted in one GeoJSON layer.
+
+    Args
+        folium_map: folium map to add the layer to
+        data: geodataframe with district data
+        selected_district: selected district
+        column: column to color districts by
+        n_bins: number of color bins
+    '''
+    bins, colors, colormap = district_colormap(data, column, n_bins)
+
+    def style_function(feature):
+        value = feature["properties"][column]
+
+        # find color of bin (as folium.Choropleth, the last bin includes its upper edge)
+        if value is None:
+            fill_color = "black"
+        else:
+            fill_color = colors[min(np.digitize(value, bins) - 1, n_bins - 1)]
+
+        style = {"fillColor": fill_color, "fillOpacity": 0.8, "color": "black", "weight": 1, "opacity": 0.2}
+
+        # outline selected district
+        if feature["properties"]["district"] == selected_district:
+            style.update({"color": SELECTED_COLOR, "weight": 4, "opacity": 1})
+
+        return style
+
+    # define tooltip, but unclickable
+    tooltip = GeoJsonTooltip(
+        fields=['district'],
+        aliases=['District: '],
+        labels=True,
+        permanent=False
+    )
+
+    folium.GeoJson(district_features(data, selected_district, column),
+        name="choropleth",
+        tooltip=tooltip,
+        style_function=style_function,
+        highlight_function=lambda x: {"weight": 3, "fillOpacity": 1},
+    ).add_to(folium_map)
+
+    # add legend
+    colormap.add_to(folium_map)
+
+def create_district_map(data, selected_data, missing_districts, tile_url:str=None, column:str="apartment_rent_sqm_now", grid_data=None, rent_surface:dict=None):
+    '''
+    Function for building the map of the district view.
+
+    Args
+        data: geodataframe with district aggregates (with "zoom_level")
+        selected_data: geodataframe with the selected district in epsg 4326
+        missing_districts: geodataframe with districts without data (drawn in grey)
+        tile_url: URL of the tile server (None to draw districts from inline GeoJSON)
+        column: column to color districts by (the vector tiles only carry "apartment_rent_sqm_now", other columns are drawn from inline GeoJSON)
+        grid_data: geodataframe with grid aggregates (from load_grid_data) to draw instead of the districts (None to draw the districts)
+        rent_surface: rent surface (from src/rent_surface.py) to draw on top of the districts (None to leave it out)
+
+    Returns
+        folium_map: folium map centered on the selected district
+    '''
+    # extract zoom level and location of selected district
+    selected_zoom_level = int(selected_data['zoom_level'].iloc[0])
+    selected_location = [selected_data['geometry'].centroid.y.iloc[0], selected_data['geometry'].centroid.x.iloc[0]]
+
+    # update center of map to selected district
+    folium_map = folium.Map(location=selected_location,
+                            zoom_start=selected_zoom_level,
+                            min_zoom=10)
+
+    if grid_data is None and (tile_url is None or column != "apartment_rent_sqm_now"):
+        # draw districts, tooltips and selected district in one layer
+        add_district_choropleth(folium_map, data, selected_data["district"].iloc[0], column)
+
+    else:
+        if grid_data is not None:
+            # draw grid cells instead of districts (finer cells when zoomed in)
+            add_grid_layer(folium_map, grid_data, tile_url)
+        else:
+            # draw districts from vector tiles
+            add_district_tiles(folium_map, data, tile_url)
+
+        # add selected district to map (vector tiles and grid are not styled per selection)
+        folium.GeoJson(selected_data[["district", "geometry"]],
+        style_function=lambda x: {"color": SELECTED_COLOR, "weight": 4, "opacity": 1, "fillOpacity": 0},
+        ).add_to(folium_map)
+
+    # draw missing districts on map (if any are configured), make them grey, make hover effect, write custom text in tooltip
+    if len(missing_districts) > 0:
+        tooltip_missing = GeoJsonTooltip(
+            fields=['district'],
+            aliases=['District: '],
+            labels=True,
+            permanent=False,
+        )
+
+        folium.GeoJson(missing_districts,
+            tooltip=tooltip_missing,
+        style_function=lambda x: {"color": "grey", "weight": 1, "opacity": 0.7, "fillOpacity": 0.7},
+        ).add_to(folium_map)
+
+    # draw rent surface on top (not interactive, so tooltips of the districts are kept)
+    if rent_surface is not None:
+        add_rent_surface(folium_map, rent_surface)
+
+    return folium_map
+
+class ListingCluster(FastMarkerCluster):
+    '''
+    FastMarkerCluster for many points. The rows are passed on as they are (folium otherwise validates every row in Python),
+    and the markers are added to the cluster in one call with chunked loading (instead of one at a time), so the browser stays responsive.
+
+    Args
+        data: list of rows [lat, lon, ...] (e.g. from listing_store.listing_points)
+        callback: javascript function creating the marker of a row
+    '''
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.callback }}
+
+                var data = {{ this.data|tojson }};
+                var cluster = L.markerClusterGroup({{ this.options|tojson }});
+                cluster.addLayers(data.map(callback));
+
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, data:list, callback:str, **kwargs):
+        super().__init__([], callback=callback, chunkedLoading=True, **kwargs)
+
+        self.data = data
+
+def add_listing_layer(folium_map, points:list):
+    '''
+    Function for drawing the listings as circles clustered in the browser, with the rent and size of a listing shown on click.
+
+    Args
+        folium_map: folium map to add the listings to
+        points: rows [lat, lon, rent without expenses, square meters, is room] from listing_store.listing_points
+    '''
+    # circles instead of icons (much cheaper to draw), rooms in the color of the selection
+    callback = f"""function (row) {{
+        var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {{radius: 5, weight: 1, color: "#FFFFFF", fillColor: row[4] ? "{SELECTED_COLOR}" : "#001233", fillOpacity: 0.9}});
+        marker.bindPopup((row[4] ? "Room" : "Apartment") + "<br>" + row[2].toLocaleString() + " DKK per month<br>" + row[3] + " m2");
+        return marker;
+    }}"""
+
+    ListingCluster(points, callback=callback, name="listings", disableClusteringAtZoom=18, maxClusterRadius=50).add_to(folium_map)
+
+def create_street_map(street_data, selected_data, tile_url:str=None, listing_points:list=None):
+    '''
+    Function for building the map of the street view.
+
+    Args
+        street_data: geodataframe with street aggregates
+        selected_data: geodataframe with the selected street in epsg 4326
+        tile_url: URL of the tile server (None to draw streets from inline GeoJSON)
+        listing_points: rows of listings to draw as clusters (see add_listing_layer). None to not draw listings
+
+    Returns
+        folium_map: folium map centered on the selected street
+    '''
+    # extract location of selected street
+    selected_location = [selected_data['geometry'].centroid.y.iloc[0], selected_data['geometry'].centroid.x.iloc[0]]
+
+    # update center of map to selected street
+    folium_map = folium.Map(location=selected_location,
+                            zoom_start=15,
+                            min_zoom=10)
+
+    if tile_url is not None:
+        # draw all streets from vector tiles
+        VectorTileLayer(
+            url=f"{tile_url}/streets/{{z}}/{{x}}/{{y}}.pbf",
+            layer_name="streets",
+            style={"color": "#001233", "weight": 3, "opacity": 1, "fillOpacity": 0},
+            tooltip_field="street",
+            tooltip_alias="Street: ",
+            max_native_zoom=16,
+        ).add_to(folium_map)
+
+    else:
+        # define tooltip, but unclickable
+        tooltip = GeoJsonTooltip(
+            fields=['street'],
+            aliases=['Street: '],
+            labels=True,
+            permanent=False
+        )
+
+        # create map with location being selected_location, but all strets highlighted
+        folium.GeoJson(street_data,
+            tooltip=tooltip,
+            style_function=lambda x: {"color": "#001233", "weight": 3, "opacity": 1, "fillOpacity": 0},
+        ).add_to(folium_map)
+
+    # add selected street to map
+    folium.GeoJson(selected_data,
+    style_function=lambda x: {"color": SELECTED_COLOR, "weight": 5, "opacity": 1, "fillOpacity": 0},
+    ).add_to(folium_map)
+
+    # add listings on top of streets
+    if listing_points is not None:
+        add_listing_layer(folium_map, listing_points)
+
+    return folium_map
+
+def render_map(folium_map):
+    '''
+    Function for rendering a folium map to standalone HTML (as streamlit_folium.folium_static does).
+
+    Args
+        folium_map: folium map
+
+    Returns
+        html: HTML of the map
+    '''
+    return folium.Figure().add_child(folium_map).render()
+
+def source_version(source_path:pathlib.Path):
+    '''
+    Function to get the version of the data a map is rendered from (modification time of the file in nanoseconds).
+    '''
+    return source_path.stat().st_mtime_ns
+
+def read_prerendered_map(maps_path:pathlib.Path, name:str, source_path:pathlib.Path, tile_url:str=None):
+    '''
+    Function for reading a prerendered map (see prerender_maps.py).
+
+    Args
+        maps_path: folder of prerendered maps of a layer (e.g. results/maps/districts)
+        name: selected district or street
+        source_path: file the maps were rendered from. Maps rendered from another version of the file are not used
+        tile_url: URL of the tile server used in the app. Maps rendered with another tile server are not used
+
+    Returns
+        html: HTML of the map (None if no up-to-date map is prerendered for the selection)
+    '''
+    manifest_path = maps_path / "manifest.json"
+
+    if not manifest_path.exists():
+        return None
+
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    # only use maps of the current data and tile server
+    if manifest["source_version"] != source_version(source_path) or manifest["tile_url"] != tile_url:
+        return None
+
+    filename = manifest["files"].get(name)
+
+    if filename is None:
+        return None
+
+    return gzip.decompress((maps_path / filename).read_bytes()).decode("utf-8")
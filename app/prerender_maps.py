@@ -0,0 +1,146 @@
+'''
+Script to prerender the folium map of every district and street selection of the app in parallel.
+
+The maps only change when the pipeline is rerun, so the HTML of each map is rendered once after aggregation and stored gzip-compressed
+in results/maps/districts and results/maps/streets (with a manifest.json mapping each district/street to its file).
+The app then serves the prerendered map of a selection instead of building and serializing the map on every rerun.
+Maps are only served if they were rendered from the current aggregates and with the tile server the app uses (see maps.py).
+
+To prerender the maps of the default municipality, type:
+    python app/prerender_maps.py
+
+To prerender maps for the tile server used by the app, set RENTMAPPER_TILE_URL as when running the app.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import os
+import argparse
+import gzip
+import json
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# tile server url (used if tile server is configured)
+from vector_tiles import get_tile_url
+
+# data loading and map building (shared with the app)
+from maps import load_district_data, load_street_data, create_district_map, create_street_map, render_map, source_version
+
+# custom modules for configuration and missing districts
+import sys
+sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
+from config import get_municipality
+from utils import add_missing_districts
+
+# data of the worker process (loaded once per worker in load_worker_data)
+WORKER_DATA = {}
+
+def input_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--municipality", type=str, default=None, help="key of municipality in data/municipalities.json (defaults to the default municipality)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (defaults to the number of CPUs)")
+
+    return parser.parse_args()
+
+def load_worker_data(key:str):
+    '''
+    Function to load the district and street data once per worker process (initializer of the process pool).
+
+    Args
+        key: key of municipality
+    '''
+    municipality = get_municipality(key)
+
+    WORKER_DATA["districts"] = load_district_data(municipality)
+    WORKER_DATA["streets"] = load_street_data(municipality)
+    WORKER_DATA["missing_districts"] = add_missing_districts(municipality, to_crs="epsg:4326")
+    WORKER_DATA["tile_url"] = get_tile_url(key)
+
+def render_selection(layer:str, name:str, save_path:pathlib.Path):
+    '''
+    Function to render and save the map of one selection (run in a worker process).
+
+    Args
+        layer: "districts" or "streets"
+        name: selected district or street
+        save_path: path to save the gzip-compressed HTML to
+
+    Returns
+        name: selected district or street
+        size: size of the compressed HTML in bytes
+    '''
+    tile_url = WORKER_DATA["tile_url"]
+
+    # get selection in epsg 4326 (as in the app)
+    name_col = "district" if layer == "districts" else "street"
+    selected_data = WORKER_DATA[layer][WORKER_DATA[layer][name_col] == name].to_crs("epsg:4326")
+
+    if layer == "districts":
+        folium_map = create_district_map(WORKER_DATA["districts"], selected_data, WORKER_DATA["missing_districts"], tile_url)
+    else:
+        folium_map = create_street_map(WORKER_DATA["streets"], selected_data, tile_url)
+
+    html = gzip.compress(render_map(folium_map).encode("utf-8"), compresslevel=6)
+
+    # write to temporary file and replace, so the app never reads a partial map
+    tmp_path = save_path.with_suffix(".tmp")
+    tmp_path.write_bytes(html)
+    os.replace(tmp_path, save_path)
+
+    return name, len(html)
+
+def prerender_maps(key:str=None, workers:int=None):
+    '''
+    Function to prerender the maps of all districts and streets of a municipality.
+
+    Args
+        key: key of municipality (defaults to the default municipality)
+        workers: number of worker processes (defaults to the number of CPUs)
+
+    Outputs
+        results/maps/{districts,streets}/{i}.html.gz: compressed HTML per selection
+        results/maps/{districts,streets}/manifest.json: file of each selection, version of the source data and tile server url
+    '''
+    municipality = get_municipality(key)
+    results_path = municipality["paths"]["results"]
+
+    # load names of selections in the main process
+    load_worker_data(municipality["key"])
+
+    layers = {
+        "districts": (WORKER_DATA["districts"]["district"].tolist(), results_path / "district_aggregates.csv"),
+        "streets": (WORKER_DATA["streets"]["street"].drop_duplicates().tolist(), results_path / "street_aggregates.csv"),
+    }
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=load_worker_data, initargs=(municipality["key"],)) as executor:
+        for layer, (names, source_path) in layers.items():
+            start = time.perf_counter()
+
+            maps_path = results_path / "maps" / layer
+            maps_path.mkdir(parents=True, exist_ok=True)
+
+            # render all selections of the layer in parallel
+            files = {name: f"{i}.html.gz" for i, name in enumerate(names)}
+            results = list(executor.map(render_selection, [layer] * len(names), names, [maps_path / files[name] for name in names]))
+
+            # write manifest last, so the maps are only served once all are rendered
+            manifest = {"source_version": source_version(source_path), "tile_url": WORKER_DATA["tile_url"], "files": files}
+
+            with open(maps_path / "manifest.json", "w", encoding="utf-8") as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+            size_mb = sum(size for _, size in results) / 1e6
+            print(f"[INFO:] Prerendered {len(results)} {layer} maps ({size_mb:.1f} MB compressed) in {time.perf_counter() - start:.1f}s")
+
+def main():
+    args = input_parse()
+
+    prerender_maps(args.municipality, args.workers)
+
+
+if __name__ == "__main__":
+    main()
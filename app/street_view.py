@@ -2,6 +2,7 @@
 Script containing functions for creating street view page of Aarhus in streamlit app (app.py)
 
 Helper functions:
+- "add_fair_rent" for adding the fair rent estimate of the hedonic rent model
 - "create_street_table" for creating table of most similar streets in streamlit app
 
 Main function:
@@ -13,77 +14,172 @@ Spatial Analytics, Cultural Data Science (F2023)
 
 # utils 
 import pathlib
+import time
 
 # web app
 import streamlit as st
 
-# geospatial mapping
-import folium
-from streamlit_folium import folium_static
-from folium.features import GeoJsonTooltip
+# embedding of map html
+import streamlit.components.v1 as components
 
-# visualisations
-import plotly.graph_objects as go
+# tile server url (used if tile server is configured)
+from vector_tiles import get_tile_url
 
-# data wrangling 
-import pandas as pd
-import geopandas as gpd
+# data loading, map building and prerendered maps (shared with prerender_maps.py)
+from maps import load_street_data, create_street_map, render_map, read_prerendered_map, MAP_HEIGHT, MAP_WIDTH
 
-# moran's I (local) in APP
-from esda.moran import Moran_Local
+# request latency and cache telemetry
+from telemetry import timer, tracked_cache, record_timing
+
+# NB. plotly, esda and libpysal are imported lazily within the functions that need them to speed up app startup
 import numpy as np
-import libpysal as lps
 
 # custom module for filtering midtbyen for local moran
 import sys
 sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
 from utils import filter_midtbyen 
+from street_index import load_street_index, query_similar_streets
+from feature_store import open_feature_store
+from hedonic_model import load_hedonic_model, predict
+from results_db import list_names, get_street, get_district_streets
+from listing_store import load_listing_store, listing_points
+
+@tracked_cache("street_index", cache=st.cache_resource(max_entries=4)) # keep indices of at most 4 cities in memory
+def load_similar_street_index(index_path:pathlib.Path):
+    '''
+    Function to load the nearest-neighbor index of streets once per process (shared across sessions).
+
+    Args:
+        index_path: path to street_index.npz
+
+    Returns:
+        index: street index (see src/street_index.py)
+    '''
+    return load_street_index(index_path)
+
+@tracked_cache("street_features", cache=st.cache_resource(max_entries=4)) # keep stores of at most 4 cities open
+def load_street_features(store_path:pathlib.Path):
+    '''
+    Function to open the memory-mapped feature store of street aggregates once per process (pages are shared between processes by the OS).
+
+    Args:
+        store_path: path to feature store folder (results/features/streets)
+
+    Returns:
+        store: feature store (see src/feature_store.py)
+    '''
+    return open_feature_store(store_path)
+
+@tracked_cache("street_data", cache=st.cache_resource(max_entries=4)) # keep aggregates of at most 4 cities in memory
+def load_streets(municipality:dict):
+    '''
+    Function to decode the street aggregates from the feature store once per process (shared across sessions, so the view must not modify them).
+
+    Args:
+        municipality: configuration of municipality (see src/config.py)
+
+    Returns:
+        street_data: geodataframe with street aggregates (see maps.load_street_data)
+    '''
+    return load_street_data(municipality, open_store=load_street_features)
+
+@tracked_cache("hedonic_model", cache=st.cache_resource(max_entries=4)) # keep models of at most 4 cities in memory
+def load_rent_model(model_path:pathlib.Path):
+    '''
+    Function to load the coefficients of the hedonic rent model once per process (shared across sessions).
+
+    Args:
+        model_path: path to hedonic_model.npz
+
+    Returns:
+        model: hedonic rent model (see src/hedonic_model.py)
+    '''
+    return load_hedonic_model(model_path)
+
+@tracked_cache("listing_points", cache=st.cache_resource(max_entries=4)) # keep listings of at most 4 cities in memory
+def load_listing_points(store_path:pathlib.Path):
+    '''
+    Function to load the current listings with a position as compact rows for the listing layer once per process (shared across sessions).
+
+    Args:
+        store_path: path to listing_store.npz
+
+    Returns:
+        points: rows [lat, lon, rent, square meters, is room] (None if the store has no positions)
+    '''
+    store = load_listing_store(store_path)
+
+    if "lat" not in store:
+        return None
+
+    return listing_points(store)
 
-def create_street_table(selected_data): 
+def add_fair_rent(model:dict, street:str, district:str):
+    '''
+    Function to add an estimate of the fair monthly rent of an apartment of a given size and number of rooms on a street.
+
+    Args:
+        model: hedonic rent model
+        street: name of street
+        district: name of district of the street
+    '''
+    st.write("__Fair Rent Estimate__")
+
+    # initialize columns for apartment and estimate
+    size_col, rooms_col, fair_col = st.columns(3)
+
+    with size_col:
+        square_meters = st.number_input("Size (m2)", min_value=10, max_value=300, value=70, step=5)
+
+    with rooms_col:
+        rooms_options = model["rooms_levels"].tolist()
+        rooms = st.selectbox("Rooms", options=rooms_options, index=min(1, len(rooms_options) - 1))
+
+    # predict rent of apartment in the latest year of the data
+    listing = {"square_meters": [square_meters], "rooms": [rooms], "rental_type": ["apartment"], "year": [model["year_levels"].astype(int).max()],
+               "district": [district], "street": [street]}
+
+    with timer("fair_rent"):
+        fair_rent = predict(model, listing)[0]
+
+    with fair_col:
+        st.metric(label="per month", value=f"{fair_rent:,.0f} DKK")
+
+def create_street_table(similar_streets): 
     '''
     Function to create table of most similar streets in streamlit app
 
     Args:
-        selected_data: dataframe with most similar streets
+        similar_streets: dataframe with most similar streets (street, district, rent_per_square_meter, distance_km)
 
     Returns:
         fig: table of most similar streets
     '''
-
-    # add DKK to rent in selected data in most_similar cols 
-    for i in range(1, 6):
-        selected_data[f"most_similar_rent_{i}"] = selected_data[f"most_similar_rent_{i}"].astype(str) + " DKK"
+    # import plotly lazily as it is only needed for the table
+    import plotly.graph_objects as go
 
     # define headers and row values for table
-    header = ["<b>Street</b>", "<b>District</b>", "<b>Rent (per m2)</b>"]
-
-    # define row values
-    values = [          # streetname 
-                        [selected_data["most_similar_1"], selected_data["most_similar_2"], 
-                        selected_data["most_similar_3"], selected_data["most_similar_4"],
-                        selected_data["most_similar_5"]],
-                        # district
-                        [selected_data["most_similar_district_1"], selected_data["most_similar_district_2"],
-                        selected_data["most_similar_district_3"], selected_data["most_similar_district_4"],
-                        selected_data["most_similar_district_5"]],
-                        # rent
-                        [selected_data["most_similar_rent_1"], selected_data["most_similar_rent_2"],
-                        selected_data["most_similar_rent_3"], selected_data["most_similar_rent_4"],
-                        selected_data["most_similar_rent_5"]]]
+    header = ["<b>Street</b>", "<b>District</b>", "<b>Rent (per m2)</b>", "<b>Distance</b>"]
+
+    # define row values (add DKK to rent and km to distance)
+    values = [similar_streets["street"],
+              similar_streets["district"],
+              similar_streets["rent_per_square_meter"].astype(str) + " DKK",
+              similar_streets["distance_km"].astype(str) + " km"]
         
     # create table
     fig = go.Figure(data=[go.Table(
                                     header=dict(values=header, 
                                                 fill_color="#FF595A", 
                                                 line_color="#FF595A", 
-                                                align=["left", "left", "center"],
+                                                align=["left", "left", "center", "center"],
                                                 height=30, 
                                                 font = dict(size=16, family="Serif")), 
                                     cells=dict(values=values, 
                                                 fill_color="#001233", 
                                                 line_color="#001233", 
                                                 font = dict(size=14, family="Serif"), 
-                                                align=["left", "left", "center"], 
+                                                align=["left", "left", "center", "center"], 
                                                 height=30)
                                         )
                         ])
@@ -95,24 +191,30 @@ def create_street_table(selected_data):
     
     return fig 
 
-def calculate_local_moran_midtbyen(street_data):
+def calculate_local_moran_midtbyen(street_data, central_districts:list=None, excluded_streets:list=None):
     '''
     Function to calculate local moran's I for midtbyen
 
     Args:
         street_data: dataframe with street data
+        central_districts: districts of the city center (defaults to Midtbyen in Aarhus)
+        excluded_streets: streets left out (e.g. streets running outside of the district map). Defaults to none
     
     Returns: 
         sig_true: dataframe with significant streets
     '''
+    # import spatial statistics lazily as they are only needed for local moran's I
+    import libpysal as lps
+    from esda.moran import Moran_Local
+
     # set seed for reproducibility
     np.random.seed(1999)
 
     # filter midtbyen
-    street_data_midtbyen = filter_midtbyen(street_data)
+    street_data_midtbyen = filter_midtbyen(street_data, central_districts=central_districts)
 
-    # filter out "strandvejen" and "stadion alle" as they run outside of bounds of the district map
-    street_data_midtbyen = street_data_midtbyen[~street_data_midtbyen["street"].isin(["Strandvejen", "Stadion Alle"])]
+    # filter out excluded streets (e.g., streets running outside of bounds of the district map)
+    street_data_midtbyen = street_data_midtbyen[~street_data_midtbyen["street"].isin(excluded_streets or [])]
 
     # get spatial weights
     w_midtbyen = lps.weights.KNN.from_dataframe(street_data_midtbyen, k = 3)
@@ -132,35 +234,42 @@ def calculate_local_moran_midtbyen(street_data):
     return sig_true
 
 
-def street_view(path:pathlib.Path):
+def street_view(path:pathlib.Path, municipality:dict):
     '''
     Function to create street view page of Aarhus in streamlit app
 
     Args: 
         path: path to script
+        municipality: configuration of selected municipality (see src/config.py)
     '''
+    # define results folder of municipality
+    results_path = municipality["paths"]["results"]
 
-    # read in data
-    street_data = pd.read_csv(path.parents[1] / "results" / "street_aggregates.csv")
+    with timer("data_load"):
+        # query single streets and the streets of the city center from the results database if it exists (the full aggregates are then only loaded to build the map)
+        db_path = results_path / "results.sqlite"
 
-    # change wkt to geometry
-    street_data["geometry"] = gpd.GeoSeries.from_wkt(street_data["geometry_street"])
+        if db_path.exists():
+            street_data = None
+            street_names = list_names(db_path, "streets")
+            central_streets = get_district_streets(db_path, municipality["central_districts"])
 
-    # convert to geodataframe
-    street_data = gpd.GeoDataFrame(street_data, geometry="geometry")
-
-    # set epsg to 25832
-    street_data = street_data.set_crs("epsg:25832")
+        else:
+            # read in street aggregates (from memory-mapped feature store if it exists)
+            street_data = load_streets(municipality)
+            street_names = street_data['street']
+            central_streets = street_data
 
     # create columns for map and statistics
     left_col, right_col, = st.columns(2, gap = "large")
 
     # calculate local moran's I
-    sig_true = calculate_local_moran_midtbyen(street_data)
+    with timer("local_moran"):
+        sig_true = calculate_local_moran_midtbyen(central_streets, municipality["central_districts"], municipality.get("excluded_streets"))
 
     with st.sidebar:
         # initialize selectbox with all streets
-        selected_street = st.selectbox('Select street', street_data['street'])
+        selected_street = st.selectbox('Select street', street_names)
 
         # set bigger font
         st.markdown(
@@ -169,48 +278,66 @@ def street_view(path:pathlib.Path):
             font-size: 25px;
             </style>
             """, unsafe_allow_html=True)
-        selected_data = street_data[street_data['street'] == selected_street]
+        # identify selected street (from the database if the full aggregates are not loaded)
+        if street_data is None:
+            with timer("db_query"):
+                selected_data = get_street(db_path, selected_street)
+        else:
+            selected_data = street_data[street_data['street'] == selected_street]
         
         # indicate number of streets found
-        st.write(f"{len(street_data)} streets found")
+        st.write(f"{len(street_names)} streets found")
 
-        # convert seleced data to epsg 4326
-        selected_data = selected_data.to_crs("epsg:4326")
+        # select radius for similar priced streets
+        radius_km = st.slider("Similar streets within (km)", min_value=0.5, max_value=30.0, value=30.0, step=0.5)
+
+        # load positions of listings (if in the listing store)
+        store_path = results_path / "listing_store.npz"
+        points = None
+
+        if store_path.exists():
+            with timer("listing_points"):
+                points = load_listing_points(store_path)
 
-        # extract location coordinates
-        selected_location = [selected_data['geometry'].centroid.y, selected_data['geometry'].centroid.x]
+        # show listings on map (clustered in the browser)
+        show_listings = points is not None and st.checkbox(f"Show current listings ({len(points):,})")
+
+        # convert seleced data to epsg 4326
+        with timer("reprojection"):
+            selected_data = selected_data.to_crs("epsg:4326")
 
     # add map to right column
     with right_col:
         # add spacing
         st.write("")
-    
-        # update center of map to selected district
-        folium_map = folium.Map(location=selected_location,
-                                zoom_start=15,
-                                min_zoom=10)
-        
-        # define tooltip, but unclickable
-        tooltip = GeoJsonTooltip(
-            fields=['street'], 
-            aliases=['Street: '],
-            labels=True,
-            permanent=False
-        )
-        
-        # create map with location being selected_location, but all strets highlighted
-        folium.GeoJson(street_data,
-            tooltip=tooltip,
-            style_function=lambda x: {"color": "#001233", "weight": 3, "opacity": 1, "fillOpacity": 0},
-        ).add_to(folium_map)
 
-        # add selected district to map
-        folium.GeoJson(selected_data, 
-        style_function=lambda x: {"color": "#FF595A", "weight": 5, "opacity": 1, "fillOpacity": 0},
-        ).add_to(folium_map)
+        # get tile server url (None if tile mode is off)
+        tile_url = get_tile_url(municipality["key"])
+
+        # use prerendered map of selected street (prerendered maps have no listings)
+        html = None
+
+        if not show_listings:
+            with timer("map_prerendered"):
+                html = read_prerendered_map(results_path / "maps" / "streets", selected_street, results_path / "street_aggregates.csv", tile_url)
+
+        if html is None:
+            # time building of map (until serialization)
+            map_start = time.perf_counter()
+
+            # load full street aggregates for the map (if only the selected street is queried from the database)
+            if street_data is None:
+                street_data = load_streets(municipality)
+
+            folium_map = create_street_map(street_data, selected_data, tile_url, listing_points=points if show_listings else None)
+
+            record_timing("map_build", time.perf_counter() - map_start)
+
+            with timer("map_serialization"):
+                html = render_map(folium_map)
 
         # set map height and width
-        folium_static(folium_map, height=630, width=482) 
+        components.html(html, height=MAP_HEIGHT + 10, width=MAP_WIDTH)
     
     # add statistics to left column
     with left_col:
@@ -233,6 +360,15 @@ def street_view(path:pathlib.Path):
         # add rent statistics
         with rent_col:
             st.metric(label="in 2023", value=f"{selected_data['rent_per_square_meter'].values[0]} DKK")
+
+            # add 95% confidence interval of the average (if in the aggregates)
+            if "rent_per_square_meter_ci_low" in selected_data:
+                ci_low, ci_high = selected_data["rent_per_square_meter_ci_low"].values[0], selected_data["rent_per_square_meter_ci_high"].values[0]
+
+                if np.isnan(ci_low):
+                    st.caption("Too few apartments for a confidence interval")
+                else:
+                    st.caption(f"95% CI: {ci_low} - {ci_high} DKK")
         
         # add count
         with count_col:
@@ -242,12 +378,26 @@ def street_view(path:pathlib.Path):
         st.write("")
         st.write("")
 
+        # add fair rent estimate (if the hedonic rent model is fitted)
+        model_path = results_path / "hedonic_model.npz"
+
+        if model_path.exists():
+            add_fair_rent(load_rent_model(model_path), selected_street, selected_data["district"].values[0])
+
+            # add spacing
+            st.write("")
+            st.write("")
+
         # initialize container for table
         with st.container():
             st.write("__Similar Priced Streets__")
 
+            # query streets with most similar rent within radius
+            street_index = load_similar_street_index(results_path / "street_index.npz")
+            similar_streets = query_similar_streets(street_index, selected_street, k=5, radius_km=radius_km)
+
             # create table 
-            fig = create_street_table(selected_data)
+            fig = create_street_table(similar_streets)
 
             # display table in streamlit
             st.write(fig)
@@ -0,0 +1,209 @@
+'''
+Script containing request latency and cache telemetry for the streamlit app (app.py).
+
+Timings of each step of a rerun (e.g., data load, reprojection, map build and map serialization) are recorded with the "timer" context manager,
+and hits/misses of streamlit caches are counted with the "tracked_cache" decorator.
+
+The timings of the latest rerun and the cache counters are shown in a hidden diagnostics panel in the sidebar (open the app with ?diagnostics=1).
+If the environment variable RENTMAPPER_METRICS_FILE is set, process-level totals are written to that file in Prometheus text format after every rerun.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import os
+import time
+import pathlib
+import threading
+import functools
+import contextlib
+from collections import defaultdict
+
+# web app
+import streamlit as st
+
+# time of process start (first import of this module, imported modules are not run again on reruns unlike app.py), used for startup timing report
+PROCESS_START = time.perf_counter()
+
+# process-level totals shared by all sessions (streamlit runs sessions in threads of the same process)
+_lock = threading.Lock()
+_step_seconds = defaultdict(float)
+_step_counts = defaultdict(int)
+_cache_calls = defaultdict(int)
+_cache_misses = defaultdict(int)
+_reruns = defaultdict(int)
+
+def start_rerun(view:str):
+    '''
+    Function to start recording a rerun. Must be called at the start of every rerun before any timers.
+
+    Args:
+        view: name of the view being rendered
+    '''
+    st.session_state["telemetry_view"] = view
+    st.session_state["telemetry_timings"] = {}
+    st.session_state["telemetry_start"] = time.perf_counter()
+
+def record_timing(step:str, seconds:float):
+    '''
+    Function to record the time spent in a step of the current rerun.
+
+    Args:
+        step: name of the step (e.g. "data_load")
+        seconds: time spent in step
+    '''
+    view = st.session_state.get("telemetry_view", "unknown")
+
+    # add to timings of current rerun (steps may run several times per rerun)
+    timings = st.session_state.setdefault("telemetry_timings", {})
+    timings[step] = timings.get(step, 0) + seconds
+
+    # add to process totals
+    with _lock:
+        _step_seconds[(view, step)] += seconds
+        _step_counts[(view, step)] += 1
+
+@contextlib.contextmanager
+def timer(step:str):
+    '''
+    Context manager timing a step of the current rerun.
+
+    Args:
+        step: name of the step (e.g. "data_load", "reprojection", "map_build", "map_serialization")
+    '''
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record_timing(step, time.perf_counter() - start)
+
+def tracked_cache(name:str, cache=st.cache_resource):
+    '''
+    Decorator caching a function with a streamlit cache decorator while counting cache hits and misses.
+    Misses are counted when the function body runs, all other calls are hits.
+
+    Args:
+        name: name of the cache in telemetry
+        cache: streamlit cache decorator (defaults to st.cache_resource)
+    '''
+    def decorator(func):
+        @functools.wraps(func)
+        def on_miss(*args, **kwargs):
+            with _lock:
+                _cache_misses[name] += 1
+
+            return func(*args, **kwargs)
+
+        cached_func = cache(on_miss)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _lock:
+                _cache_calls[name] += 1
+
+            return cached_func(*args, **kwargs)
+
+        # keep clear() of streamlit cache available
+        wrapper.clear = cached_func.clear
+
+        return wrapper
+
+    return decorator
+
+def get_cache_stats():
+    '''
+    Function to get hits and misses of all tracked caches in the process.
+
+    Returns:
+        cache_stats: dict with cache name as key and dict with hits and misses as value
+    '''
+    with _lock:
+        return {name: {"hits": calls - _cache_misses[name], "misses": _cache_misses[name]} for name, calls in _cache_calls.items()}
+
+def diagnostics_enabled():
+    '''
+    Function to check whether the diagnostics panel is requested with the query parameter ?diagnostics=1.
+    '''
+    # st.query_params replaces st.experimental_get_query_params in newer versions of streamlit
+    if hasattr(st, "query_params"):
+        value = st.query_params.get("diagnostics")
+    else:
+        value = st.experimental_get_query_params().get("diagnostics", [None])[0]
+
+    return value not in (None, "", "0", "false")
+
+def write_prometheus(metrics_path:pathlib.Path):
+    '''
+    Function to write process-level totals in Prometheus text format.
+    The file is replaced atomically, such that it can be scraped (e.g., by the node exporter textfile collector) at any time.
+
+    Args:
+        metrics_path: path to write metrics to
+    '''
+    lines = []
+
+    with _lock:
+        lines.append("# HELP rentmapper_step_seconds Time spent in each step of a rerun.")
+        lines.append("# TYPE rentmapper_step_seconds summary")
+        for (view, step), seconds in sorted(_step_seconds.items()):
+            lines.append(f'rentmapper_step_seconds_sum{{view="{view}",step="{step}"}} {seconds:.6f}')
+            lines.append(f'rentmapper_step_seconds_count{{view="{view}",step="{step}"}} {_step_counts[(view, step)]}')
+
+        lines.append("# HELP rentmapper_reruns_total Number of reruns per view.")
+        lines.append("# TYPE rentmapper_reruns_total counter")
+        for view, count in sorted(_reruns.items()):
+            lines.append(f'rentmapper_reruns_total{{view="{view}"}} {count}')
+
+        lines.append("# HELP rentmapper_cache_calls_total Number of calls to cached functions.")
+        lines.append("# TYPE rentmapper_cache_calls_total counter")
+        for name, count in sorted(_cache_calls.items()):
+            lines.append(f'rentmapper_cache_calls_total{{cache="{name}"}} {count}')
+
+        lines.append("# HELP rentmapper_cache_misses_total Number of cache misses of cached functions.")
+        lines.append("# TYPE rentmapper_cache_misses_total counter")
+        for name, count in sorted(_cache_misses.items()):
+            lines.append(f'rentmapper_cache_misses_total{{cache="{name}"}} {count}')
+
+    # write to temporary file and replace
+    tmp_path = metrics_path.with_suffix(metrics_path.suffix + ".tmp")
+    tmp_path.write_text("\n".join(lines) + "\n")
+    os.replace(tmp_path, metrics_path)
+
+def add_diagnostics_panel():
+    '''
+    Function for adding the diagnostics panel with timings of the latest rerun and cache counters to the sidebar.
+    '''
+    timings = st.session_state.get("telemetry_timings", {})
+
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        st.write("__Latest rerun (ms)__")
+        st.table({"step": list(timings.keys()), "ms": [round(seconds * 1000, 1) for seconds in timings.values()]})
+
+        st.write("__Caches__")
+        cache_stats = get_cache_stats()
+        st.table({"cache": list(cache_stats.keys()), "hits": [stats["hits"] for stats in cache_stats.values()], "misses": [stats["misses"] for stats in cache_stats.values()]})
+
+def finish_rerun():
+    '''
+    Function to finish recording a rerun. Records the total time of the rerun, writes Prometheus metrics (if RENTMAPPER_METRICS_FILE is set)
+    and shows the diagnostics panel (if requested with ?diagnostics=1).
+    '''
+    view = st.session_state.get("telemetry_view", "unknown")
+
+    # record total time of rerun
+    record_timing("total", time.perf_counter() - st.session_state.get("telemetry_start", time.perf_counter()))
+
+    with _lock:
+        _reruns[view] += 1
+
+    # write metrics file
+    metrics_file = os.environ.get("RENTMAPPER_METRICS_FILE")
+
+    if metrics_file:
+        write_prometheus(pathlib.Path(metrics_file))
+
+    # show diagnostics panel
+    if diagnostics_enabled():
+        add_diagnostics_panel()
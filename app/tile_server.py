@@ -0,0 +1,75 @@
+'''
+Small local tile endpoint serving the vector tiles generated by src/make_tiles.py.
+
+To run the tile server, type:
+    python app/tile_server.py --port 8081
+
+and run the app with the environment variable RENTMAPPER_TILE_URL pointing to the server:
+    RENTMAPPER_TILE_URL=http://localhost:8081 streamlit run app/app.py
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+import argparse
+import re
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# only requests of the form /{layer}/{z}/{x}/{y}.pbf or /{layer}/metadata.json are served
+TILE_PATTERN = re.compile(r"^/[\w-]+/(\d+/\d+/\d+\.pbf|metadata\.json)$")
+
+class TileHandler(SimpleHTTPRequestHandler):
+    '''
+    Request handler serving vector tiles from the tile folder.
+    Missing tiles (areas without streets/districts) are answered with an empty response (204) rather than 404.
+    '''
+    extensions_map = {".pbf": "application/x-protobuf", ".json": "application/json"}
+
+    def end_headers(self):
+        # allow the app (served on another port) to fetch tiles, tiles are static between pipeline runs
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "public, max-age=3600")
+        super().end_headers()
+
+    def do_GET(self):
+        # reject everything that is not a tile or metadata
+        if not TILE_PATTERN.match(self.path):
+            self.send_error(404)
+            return
+
+        # answer empty tiles with no content
+        if not pathlib.Path(self.translate_path(self.path)).exists():
+            self.send_response(204)
+            self.end_headers()
+            return
+
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        # silence logging of every single tile request
+        pass
+
+def input_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081, help="port to serve tiles on")
+    parser.add_argument("--tile_dir", type=pathlib.Path, default=pathlib.Path(__file__).parents[1] / "results" / "tiles", help="folder with tiles generated by src/make_tiles.py")
+
+    return parser.parse_args()
+
+
+def main():
+    args = input_parse()
+
+    # serve tiles from tile folder
+    handler = partial(TileHandler, directory=str(args.tile_dir))
+    server = ThreadingHTTPServer(("", args.port), handler)
+
+    print(f"[INFO:] Serving tiles from {args.tile_dir} on http://localhost:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+'''
+Script containing a folium layer for drawing the vector tiles generated by src/make_tiles.py (served by app/tile_server.py).
+
+Tile mode is switched on by setting the environment variable RENTMAPPER_TILE_URL to the URL of the tile server.
+When it is not set, the views fall back to drawing the full GeoJSON layers. The URL may contain "{municipality}", which is replaced by the key of the selected city.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import os
+
+# geospatial mapping
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from jinja2 import Template
+
+def get_tile_url(municipality:str=None):
+    '''
+    Function to get the URL of the tile server from the environment variable RENTMAPPER_TILE_URL.
+
+    Args:
+        municipality: key of selected municipality, replaces "{municipality}" in the URL (e.g. "http://localhost:8081/{municipality}")
+
+    Returns:
+        tile_url: URL of tile server without trailing slash (None if tile mode is off)
+    '''
+    tile_url = os.environ.get("RENTMAPPER_TILE_URL")
+
+    if not tile_url:
+        return None
+
+    # insert municipality for partitioned tiles
+    if municipality is not None:
+        tile_url = tile_url.replace("{municipality}", municipality)
+
+    return tile_url.rstrip("/")
+
+class VectorTileLayer(JSCSSMixin, Layer):
+    '''
+    Folium layer drawing Mapbox Vector Tiles with Leaflet.VectorGrid.
+
+    Args:
+        url: tile url template, e.g. "http://localhost:8081/streets/{z}/{x}/{y}.pbf"
+        layer_name: name of the layer within the tiles
+        style: leaflet path style applied to all features (e.g. {"color": "#001233", "weight": 3})
+        color_field: property to color features by (optional). If given, thresholds and colors must be given too
+        thresholds: upper bounds of the color bins of color_field
+        colors: fill colors of each bin (one more than thresholds), features without color_field are drawn in missing_color
+        missing_color: fill color of features without color_field
+        tooltip_field: property to show in tooltip on hover (optional)
+        tooltip_alias: text in front of the tooltip_field value
+        max_native_zoom: highest zoom level tiles exist for, higher zoom levels are overzoomed
+        name: name of layer in layer control
+    '''
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }}_style = function(properties, zoom) {
+                var style = Object.assign({}, {{ this.style|tojson }});
+                {%- if this.color_field %}
+                var value = properties[{{ this.color_field|tojson }}];
+                var thresholds = {{ this.thresholds|tojson }};
+                var colors = {{ this.colors|tojson }};
+                style.fillColor = {{ this.missing_color|tojson }};
+                if (value !== undefined && value !== null) {
+                    var i = 0;
+                    while (i < thresholds.length && value > thresholds[i]) { i++; }
+                    style.fillColor = colors[i];
+                }
+                {%- endif %}
+                return style;
+            };
+
+            var {{ this.get_name() }} = L.vectorGrid.protobuf(
+                {{ this.url|tojson }},
+                {
+                    rendererFactory: L.canvas.tile,
+                    interactive: {{ this.interactive|tojson }},
+                    maxNativeZoom: {{ this.max_native_zoom }},
+                    vectorTileLayerStyles: { {{ this.layer_name|tojson }}: {{ this.get_name() }}_style }
+                }
+            ).addTo({{ this._parent.get_name() }});
+
+            {%- if this.tooltip_field %}
+            {{ this.get_name() }}.on("mouseover", function(e) {
+                var value = e.layer.properties[{{ this.tooltip_field|tojson }}];
+                L.tooltip({sticky: true})
+                    .setContent("<b>" + {{ this.tooltip_alias|tojson }} + "</b>" + value)
+                    .setLatLng(e.latlng)
+                    .openOn({{ this._parent.get_name() }});
+            });
+            {{ this.get_name() }}.on("mouseout", function(e) {
+                {{ this._parent.get_name() }}.closeTooltip();
+            });
+            {%- endif %}
+        {% endmacro %}
+        """)
+
+    default_js = [
+        ("vectorgrid", "https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.js"),
+    ]
+
+    def __init__(self, url:str, layer_name:str, style:dict, color_field:str=None, thresholds:list=None, colors:list=None,
+                 missing_color:str="grey", tooltip_field:str=None, tooltip_alias:str="", max_native_zoom:int=16, name:str=None):
+        super().__init__(name=name or layer_name)
+        self._name = "VectorTileLayer"
+
+        self.url = url
+        self.layer_name = layer_name
+        self.style = style
+        self.color_field = color_field
+        self.thresholds = [float(threshold) for threshold in thresholds] if thresholds is not None else []
+        self.colors = colors if colors is not None else []
+        self.missing_color = missing_color
+        self.tooltip_field = tooltip_field
+        self.tooltip_alias = tooltip_alias
+        self.interactive = tooltip_field is not None
+        self.max_native_zoom = max_native_zoom
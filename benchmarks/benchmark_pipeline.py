@@ -0,0 +1,230 @@
+'''
+Benchmark of the offline pipeline on synthetic data of configurable size.
+
+Times each stage (clean_all_data, build_street_lookup, add_geodata, get_district_aggregates, get_neighbor_districts, bootstrap_means, get_grid_aggregates, compute_rent_surface, listing_positions and similar_rent_prices),
+records its peak memory (tracemalloc) and writes a JSON report which can be compared across commits.
+
+To run the benchmark, type:
+    python benchmarks/benchmark_pipeline.py --n_listings 1000 10000 --grid_sizes 5 10
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+import argparse
+import json
+import time
+import tracemalloc
+import tempfile
+import subprocess
+import platform
+import logging
+from datetime import datetime
+
+# data wrangling
+import pandas as pd
+import geopandas as gpd
+
+# custom modules from src
+import sys
+sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
+from clean_data import clean_all_data
+from add_geodata import build_street_lookup, add_geodata
+from aggregate_data import get_district_aggregates, get_neighbor_districts, similar_rent_prices
+from bootstrap import bootstrap_means
+from grid_aggregates import get_grid_aggregates
+from rent_surface import compute_rent_surface
+from listing_store import listing_positions
+
+# synthetic data generators
+from synthetic_data import write_scrape_data, generate_geo_data
+
+def input_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_listings", type=int, nargs="+", default=[1000, 5000], help="total number of synthetic listings (one run per value)")
+    parser.add_argument("--grid_sizes", type=int, nargs="+", default=[5, 10], help="number of synthetic districts along each side of the grid (one run per value)")
+    parser.add_argument("--n_streets", type=int, default=500, help="number of synthetic streets")
+    parser.add_argument("--repeats", type=int, default=1, help="number of repeats of each stage (fastest is reported)")
+    parser.add_argument("--outdir", type=pathlib.Path, default=pathlib.Path(__file__).parent / "reports", help="folder to write JSON report to")
+
+    return parser.parse_args()
+
+def time_stage(func, *args, repeats:int=1, **kwargs):
+    '''
+    Function to time a pipeline stage and record its peak memory.
+    Timing and memory are measured in separate runs as tracemalloc slows down execution.
+
+    Args:
+        func: function to benchmark
+        args, kwargs: arguments passed to func. Dataframes are copied for every run as some stages modify their input.
+        repeats: number of timed runs (the fastest is reported)
+
+    Returns:
+        result: output of func (from the last run)
+        timings: dict with seconds (fastest run) and peak_memory_mb
+    '''
+    def copy_args():
+        return [arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in args]
+
+    # time runs
+    seconds = []
+    for _ in range(repeats):
+        run_args = copy_args()
+        start = time.perf_counter()
+        result = func(*run_args, **kwargs)
+        seconds.append(time.perf_counter() - start)
+
+    # measure peak memory in a separate run
+    run_args = copy_args()
+    tracemalloc.start()
+    func(*run_args, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = {"seconds": round(min(seconds), 4), "peak_memory_mb": round(peak / 1024 ** 2, 2)}
+
+    return result, timings
+
+def roundtrip_csv(data:pd.DataFrame, csv_path:pathlib.Path):
+    '''
+    Function to write data to csv and read it back in, as done between the stages of the pipeline (e.g., geometries become wkt and numbers are parsed).
+
+    Args:
+        data: output of a pipeline stage
+        csv_path: path to write the csv to
+
+    Returns:
+        data: pandas DataFrame as read by the next stage
+    '''
+    data.to_csv(csv_path, index=False)
+
+    return pd.read_csv(csv_path)
+
+def run_benchmark(n_listings:int, grid_size:int, n_streets:int, repeats:int, zip_codes:pd.DataFrame):
+    '''
+    Function to run all pipeline stages on synthetic data of one size.
+
+    Args:
+        n_listings: total number of synthetic listings
+        grid_size: number of synthetic districts along each side of the grid
+        n_streets: number of synthetic streets
+        repeats: number of timed runs per stage
+        zip_codes: dataframe with zip codes
+
+    Returns:
+        results: list of dicts with stage, sizes, rows in/out, seconds and peak memory
+    '''
+    results = []
+
+    def record(stage, rows_in, rows_out, timings):
+        results.append({"stage": stage, "n_listings": n_listings, "grid_size": grid_size, "n_streets": n_streets, "rows_in": rows_in, "rows_out": rows_out, **timings})
+        print(f"[INFO:] {stage:<25} listings={n_listings:<7} grid={grid_size:<4} {timings['seconds']:>8.3f}s {timings['peak_memory_mb']:>8.1f} MB")
+
+    # generate geodata
+    geo_districts, geo_society, geo_streets, districts = generate_geo_data(grid_size, n_streets)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = pathlib.Path(tmpdir)
+
+        # write synthetic scrape files
+        write_scrape_data(n_listings, geo_streets["vejnavne"].tolist(), zip_codes, tmpdir)
+
+        # clean data
+        apartments, timings = time_stage(clean_all_data, tmpdir, zip_codes, repeats=repeats)
+        record("clean_all_data", n_listings, len(apartments), timings)
+
+        apartments = roundtrip_csv(apartments, tmpdir / "cleaned_data.csv")
+
+        # compile street to district lookup (built once and persisted in the pipeline)
+        street_lookup, timings = time_stage(build_street_lookup, districts, {}, repeats=repeats)
+        record("build_street_lookup", len(districts), len(street_lookup), timings)
+
+        # add geodata
+        complete_data, timings = time_stage(add_geodata, apartments, street_lookup, geo_streets, geo_districts, geo_society, repeats=repeats)
+        record("add_geodata", len(apartments), len(complete_data), timings)
+
+        complete_data = roundtrip_csv(complete_data, tmpdir / "complete_data.csv")
+
+        # district aggregates (includes neighbor districts)
+        district_data, timings = time_stage(get_district_aggregates, complete_data, tmpdir, repeats=repeats)
+        record("get_district_aggregates", len(complete_data), len(district_data), timings)
+
+        # neighbor districts on their own
+        district_wkt = roundtrip_csv(district_data, tmpdir / "district_aggregates.csv")
+        _, timings = time_stage(get_neighbor_districts, district_wkt, repeats=repeats)
+        record("get_neighbor_districts", len(district_wkt), len(district_wkt), timings)
+
+        # confidence intervals of street means (1000 resamples per street)
+        intervals, timings = time_stage(bootstrap_means, complete_data, ["street", "district"], "rent_per_square_meter", repeats=repeats)
+        record("bootstrap_means", len(complete_data), len(intervals), timings)
+
+        # grid pyramid (all resolutions in one groupby)
+        grid_data, timings = time_stage(get_grid_aggregates, complete_data, repeats=repeats)
+        record("get_grid_aggregates", len(complete_data), len(grid_data), timings)
+
+        # rent surface from streets weighted by listings (FFT convolution on a 50 m grid)
+        street_geo = complete_data.groupby(["street", "geometry_street"]).agg(rent_per_square_meter=("rent_per_square_meter", "mean"), count=("rent_per_square_meter", "size")).reset_index()
+        street_geo = gpd.GeoDataFrame(street_geo, geometry=gpd.GeoSeries.from_wkt(street_geo["geometry_street"]), crs=25832)
+        (surface, _), timings = time_stage(compute_rent_surface, street_geo, repeats=repeats)
+        record("compute_rent_surface", len(street_geo), surface.size, timings)
+
+        # positions of listings along their streets (for the listing layer of the app)
+        (lat, _), timings = time_stage(listing_positions, complete_data["geometry_street"], complete_data["year"], repeats=repeats)
+        record("listing_positions", len(complete_data), len(lat), timings)
+
+        # similar rent prices for street aggregates
+        street_data = complete_data.groupby(["street", "district"]).agg({"rent_per_square_meter": "mean"}).reset_index()
+        _, timings = time_stage(similar_rent_prices, street_data, 5, repeats=repeats)
+        record("similar_rent_prices", len(street_data), len(street_data), timings)
+
+    return results
+
+def get_commit():
+    '''
+    Function to get the current git commit (None if not in a git repository).
+    '''
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, cwd=pathlib.Path(__file__).parent).stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def main():
+    args = input_parse()
+
+    # silence structured stage logs of the pipeline (see src/instrument.py) to only time the stages
+    logging.getLogger("rentmapper").setLevel(logging.WARNING)
+
+    # read in zip codes
+    zip_codes = pd.read_csv(pathlib.Path(__file__).parents[1] / "data" / "geo_data" / "zipcode_lookup.csv")
+
+    # run benchmark for all combinations of sizes
+    results = []
+    for n_listings in args.n_listings:
+        for grid_size in args.grid_sizes:
+            results += run_benchmark(n_listings, grid_size, args.n_streets, args.repeats, zip_codes)
+
+    # write report
+    commit = get_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "repeats": args.repeats,
+        "results": results,
+    }
+
+    args.outdir.mkdir(parents=True, exist_ok=True)
+    report_path = args.outdir / f"benchmark_{commit or 'nogit'}.json"
+
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"[INFO:] Benchmark report written to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
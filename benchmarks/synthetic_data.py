@@ -0,0 +1,224 @@
+'''
+Functions to generate synthetic data for benchmarking the offline pipeline (see benchmark_pipeline.py).
+
+Scrape files are written in the raw format of each rental site (A-D) together with historical files, such that they can be cleaned with src/clean_data.py.
+Geodata (statistics districts, local communities, streets and the street to district lookup) is generated as a grid of square polygons with streets running through them.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+
+# geometry
+from shapely.geometry import box, LineString
+
+def format_thousands(values:np.ndarray):
+    '''
+    Function to format integers with "." as thousands separator (e.g. 8900 -> "8.900") as on the rental sites.
+
+    Args:
+        values: array of integers
+
+    Returns:
+        formatted: list of formatted strings
+    '''
+    return [f"{value:,}".replace(",", ".") for value in values]
+
+def street_name(i:int):
+    '''
+    Function to create a unique street name without digits (site C addresses are cut at the first digit during cleaning).
+
+    Args:
+        i: street number
+
+    Returns:
+        name: street name, e.g. "Syntetisk Gade Ab"
+    '''
+    letters = ""
+
+    # write i in base 26 with letters
+    while True:
+        i, remainder = divmod(i, 26)
+        letters = chr(ord("a") + remainder) + letters
+
+        if i == 0:
+            break
+
+    return f"Syntetisk Gade {letters.capitalize()}"
+
+def generate_listings(n_listings:int, streets:list, zip_codes:pd.DataFrame, rng:np.random.Generator):
+    '''
+    Function to generate the underlying listing values shared by all sites.
+
+    Args:
+        n_listings: number of listings
+        streets: street names to draw from
+        zip_codes: dataframe with zip codes and areas
+        rng: numpy random generator
+
+    Returns:
+        listings: dataframe with rental_type, rooms, square_meters, rent, street and area
+    '''
+    # draw areas from zip code lookup so that all listings are in Aarhus kommune
+    areas = zip_codes["area"].to_numpy()
+
+    listings = pd.DataFrame({
+        "rental_type": rng.choice(["apartment", "room"], size=n_listings, p=[0.8, 0.2]),
+        "rooms": rng.integers(1, 7, size=n_listings),
+        "square_meters": rng.integers(15, 160, size=n_listings),
+        "street": rng.choice(streets, size=n_listings),
+        "area": rng.choice(areas, size=n_listings),
+    })
+
+    # rent scales with size with noise
+    listings["rent"] = (listings["square_meters"] * rng.normal(120, 20, size=n_listings)).clip(1500).astype(int)
+
+    return listings
+
+def write_scrape_data(n_listings:int, streets:list, zip_codes:pd.DataFrame, data_path:pathlib.Path, seed:int=1999):
+    '''
+    Function to write synthetic scrape files in the raw format of each site (A-D) and two historical files.
+    The listings are split evenly between the six files.
+
+    Args:
+        n_listings: total number of listings
+        streets: street names to draw from
+        zip_codes: dataframe with zip codes and areas
+        data_path: folder to write files to
+        seed: random seed
+
+    Outputs:
+        rental_scrape_A.csv, ..., rental_scrape_D.csv, historical-data-anton.csv, historical-data-mina.csv
+    '''
+    rng = np.random.default_rng(seed)
+
+    # generate listings, split into files
+    listings = generate_listings(n_listings, streets, zip_codes, rng)
+    site_A, site_B, site_C, site_D, historical_1, historical_2 = np.array_split(listings, 6)
+
+    # translate rental type to danish as on the sites
+    danish_type = {"apartment": "Lejlighed", "room": "Værelse"}
+
+    # site A
+    pd.DataFrame({
+        "web-scraper-order": [f"1681720076-{i}" for i in range(len(site_A))],
+        "pagination": "",
+        "price": [f"{price} kr." for price in format_thousands(site_A["rent"])],
+        "address": site_A["area"] + ", " + site_A["street"],
+        "rooms_type_kvm": site_A["rooms"].astype(str) + " vær. · " + site_A["rental_type"].map(danish_type) + " · " + site_A["square_meters"].astype(str) + " m²",
+    }).to_csv(data_path / "rental_scrape_A.csv", index=False)
+
+    # site B
+    pd.DataFrame({
+        "web-scraper-order": [f"1684829035-{i}" for i in range(len(site_B))],
+        "price": format_thousands(site_B["rent"]),
+        "address": site_B["street"] + ", " + site_B["area"],
+        "type_rooms_kvm": site_B["rental_type"].map(danish_type) + " / " + site_B["rooms"].astype(str) + " vær. / " + site_B["square_meters"].astype(str) + " m2",
+    }).to_csv(data_path / "rental_scrape_B.csv", index=False)
+
+    # site C (only apartments)
+    zip_lookup = zip_codes.set_index("area")["zip_code"]
+    site_C = pd.DataFrame({
+        "web-scraper-order": [f"1684830206-{i}" for i in range(len(site_C))],
+        "pagination": "",
+        "prices": [f"{price} kr./md." for price in format_thousands(site_C["rent"])],
+        "address": site_C["street"] + " " + rng.integers(1, 100, size=len(site_C)).astype(str) + ", 1. th",
+        "zip_code": site_C["area"].map(zip_lookup).astype(str) + " " + site_C["area"],
+        "rooms_kvm": site_C["rooms"].astype(str) + " rum, " + site_C["square_meters"].astype(str) + " m²",
+    })
+    site_C.to_csv(data_path / "rental_scrape_C.csv", index=False)
+
+    # site D (only apartments, uses "Århus" instead of "Aarhus")
+    pd.DataFrame({
+        "web-scraper-order": [f"1684834100-{i}" for i in range(len(site_D))],
+        "price": [f"{price},- pr. mdr." for price in format_thousands(site_D["rent"])],
+        "address": site_D["street"] + ", " + site_D["area"].str.replace("Aarhus", "Århus", regex=False),
+        "kvm": site_D["square_meters"].astype(str) + " m²",
+        "rooms": site_D["rooms"].astype(str) + " vær.",
+    }).to_csv(data_path / "rental_scrape_D.csv", index=False)
+
+    # historical data (already in clean format)
+    for historical, filename in [(historical_1, "historical-data-anton.csv"), (historical_2, "historical-data-mina.csv")]:
+        pd.DataFrame({
+            "website": "Site A",
+            "year": rng.choice([2014, 2015, 2016], size=len(historical)),
+            "rental_type": historical["rental_type"],
+            "rent_without_expenses": historical["rent"],
+            "square_meters": historical["square_meters"],
+            "zip_code": historical["area"].map(zip_lookup),
+            "street": historical["street"],
+            "area": historical["area"],
+            "rooms": historical["rooms"],
+        }).to_csv(data_path / filename, index=False)
+
+def generate_geo_data(grid_size:int, n_streets:int, cell_size:float=1000, community_size:int=3, seed:int=1999, crs=25832):
+    '''
+    Function to generate synthetic geodata as a grid of square statistics districts grouped into larger local communities.
+    The first row of the grid is named as districts of Midtbyen, so that both branches of add_geodata.merge_districts are used.
+
+    Args:
+        grid_size: number of statistics districts along each side of the grid (grid_size**2 districts in total)
+        n_streets: number of streets
+        cell_size: side length of each statistics district in metres
+        community_size: number of statistics districts along each side of a local community
+        seed: random seed
+        crs: crs of the geodata
+
+    Returns:
+        geo_districts: GeoDataFrame with statistics districts ("noegle", "prog_distrikt_navn", geometry)
+        geo_society: GeoDataFrame with local communities ("distrikt", geometry)
+        geo_streets: GeoDataFrame with streets ("vejnavne", geometry)
+        districts: pandas DataFrame with street to district lookup ("Vejnavn", "StatistikdistriktNavn")
+    '''
+    rng = np.random.default_rng(seed)
+
+    # place the grid around Aarhus
+    x0, y0 = 570000, 6220000
+
+    # midtbyen names for first row of districts (to keep them as statistics districts in merge_districts)
+    midtbyen = ["Trøjborg", "Nørregade", "Latinerkvarteret", "Mølleparken", "TelefonTorvet", "Fredens Torv", "Frederiksbjerg Vest", "Frederiksbjerg Øst"]
+
+    # statistics districts
+    rows, cols = np.divmod(np.arange(grid_size ** 2), grid_size)
+    geo_districts = gpd.GeoDataFrame({
+        "noegle": [f"{row:02d}.{col:02d}" for row, col in zip(rows, cols)],
+        "prog_distrikt_navn": [midtbyen[col] if row == 0 and col < len(midtbyen) else f"District {row}-{col}" for row, col in zip(rows, cols)],
+        "geometry": [box(x0 + col * cell_size, y0 + row * cell_size, x0 + (col + 1) * cell_size, y0 + (row + 1) * cell_size) for row, col in zip(rows, cols)],
+    }, crs=crs)
+
+    # local communities (coarser grid covering the districts)
+    n_communities = int(np.ceil(grid_size / community_size))
+    community_cell = cell_size * community_size
+    rows, cols = np.divmod(np.arange(n_communities ** 2), n_communities)
+    geo_society = gpd.GeoDataFrame({
+        "distrikt": [f"Community {row}-{col}" for row, col in zip(rows, cols)],
+        "geometry": [box(x0 + col * community_cell, y0 + row * community_cell, x0 + (col + 1) * community_cell, y0 + (row + 1) * community_cell) for row, col in zip(rows, cols)],
+    }, crs=crs)
+
+    # streets as short line segments within a random district
+    street_names = [street_name(i) for i in range(n_streets)]
+    street_district = rng.integers(0, grid_size ** 2, size=n_streets)
+    bounds = geo_districts.geometry.bounds.to_numpy()[street_district]
+
+    start = bounds[:, :2] + rng.uniform(0.1, 0.5, size=(n_streets, 2)) * cell_size
+    end = start + rng.uniform(0.1, 0.4, size=(n_streets, 2)) * cell_size
+
+    geo_streets = gpd.GeoDataFrame({
+        "vejnavne": street_names,
+        "geometry": [LineString([tuple(a), tuple(b)]) for a, b in zip(start, end)],
+    }, crs=crs)
+
+    # street to district lookup
+    districts = pd.DataFrame({
+        "Vejnavn": street_names,
+        "StatistikdistriktNavn": "Stat dist: " + geo_districts["noegle"].to_numpy()[street_district],
+    })
+
+    return geo_districts, geo_society, geo_streets, districts
@@ -7,6 +7,10 @@ source ./env/bin/activate
 echo -e "[INFO:] Cleaning Rental Data ..." # user msg 
 python3 src/clean_data.py
 
+# add scrapes to snapshot store (one partition per scrape date and site)
+echo -e "[INFO:] Adding Scrapes to Snapshot Store ..." # user msg 
+python3 src/snapshot_store.py
+
 # add geo spatial data to cleaned data
 echo -e "[INFO:] Adding Geo Spatial Data to Rentals..." # user msg
 python3 src/add_geodata.py
@@ -15,6 +19,26 @@ python3 src/add_geodata.py
 echo -e "[INFO:] Extracting Aggregates from Data ..." # user msg
 python3 src/aggregate_data.py
 
+# aggregate listings on a multi-resolution grid (grid layer in the app)
+echo -e "[INFO:] Aggregating Rentals on Grid ..." # user msg
+python3 src/grid_aggregates.py
+
+# compute smoothed rent surface from street aggregates (raster for plots and app overlay)
+echo -e "[INFO:] Computing Rent Surface ..." # user msg
+python3 src/rent_surface.py
+
+# fit hedonic rent model (fair rent estimates in the app)
+echo -e "[INFO:] Fitting Hedonic Rent Model ..." # user msg
+python3 src/hedonic_model.py
+
+# generate vector tiles for the app
+echo -e "[INFO:] Generating Vector Tiles for App ..." # user msg
+python3 src/make_tiles.py
+
+# prerender maps of every district and street for the app
+echo -e "[INFO:] Prerendering Maps for App ..." # user msg
+python3 app/prerender_maps.py
+
 # creating visualizations
 echo -e "[INFO:] Creating Visualizations for Analysis..." # user msg
 python3 src/analysis.py
@@ -9,21 +9,41 @@ Spatial Analytics, Cultural Data Science (F2023)
 
 # utils 
 import pathlib
+import json
+import hashlib
 from unidecode import unidecode  # for removing special characters from strings
 
 # data wrangling
 import geopandas as gpd
 import pandas as pd
 
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument, log_rows_dropped, emit
 
-def load_data():
+# fuzzy matching of street names without exact match
+from street_matcher import fuzzy_match_keys, load_trigram_index
+
+# municipality configuration (paths and district lists per municipality)
+from config import get_municipality
+
+# cached reading of geo layers
+from utils import read_layer
+
+# version of the format of the persisted street to district lookup (increase if build_street_lookup changes)
+STREET_LOOKUP_FORMAT = 1
+
+
+@instrument
+def load_data(municipality:dict):
     '''
     Function that loads all needed data for merging geodata.
 
+    Args:
+        municipality: municipality configuration (see config.py)
+
     Returns:
-        path: path to the current file
         apartments: pandas DataFrame with the scraped and cleaned rental data
-        districts: pandas DataFrame with the districts and their corresponding streets
+        districts: pandas DataFrame with the street to district lookup (see load_street_lookup)
         geo_streets: GeoDataFrame with the street names and their corresponding geometry
         geo_districts: GeoDataFrame with the statistic districts and their corresponding geometry
         geo_society: GeoDataFrame with the local community districts and their corresponding geometry
@@ -31,15 +51,15 @@ def load_data():
     '''
 
     # define paths
-    path = pathlib.Path(__file__)
+    paths = municipality["paths"]
 
-    apartments = pd.read_csv(path.parents[1] / "data" / "scrape_data" / "cleaned_data.csv")
-    districts = pd.read_csv(path.parents[1] / "data" / "geo_data" / "street_to_district.csv", sep=';')
-    geo_streets = gpd.read_file(path.parents[1] / "data" / "geo_data" / "streetnames.geojson")
-    geo_districts = gpd.read_file(path.parents[1] / "data" / "geo_data" / "statistics_districts.geojson")
-    geo_society = gpd.read_file(path.parents[1] / "data" / "geo_data" / "local_community.geojson")
+    apartments = pd.read_csv(paths["scrape_data"] / "cleaned_data.csv")
+    districts = load_street_lookup(paths["street_to_district"], municipality["missing_streets"], paths["street_lookup"])
+    geo_streets = read_layer(paths["streets"])
+    geo_districts = read_layer(paths["statistics_districts"])
+    geo_society = read_layer(paths["local_communities"])
 
-    return path, apartments, districts, geo_streets, geo_districts, geo_society
+    return apartments, districts, geo_streets, geo_districts, geo_society
 
 def clean_temp_cols(column):
     '''
@@ -67,14 +87,52 @@ def clean_temp_cols(column):
 
     return column
 
+def fuzzy_match_streets(street_temp, reference_temp, lookup:str, match_threshold:float=0.8, index_dir:pathlib.Path=None):
+    '''
+    Function for replacing cleaned street names without an exact match in a lookup by the most similar street name of the lookup (if above match_threshold).
 
-def add_street_geometry(apartments, geo_streets):
+    Args
+        street_temp: pandas Series with cleaned street names of the apartments (from clean_temp_cols)
+        reference_temp: pandas Series with cleaned street names of the lookup
+        lookup: name of the lookup for the report (e.g. "streets")
+        match_threshold: minimum similarity (Dice coefficient of trigrams) for a match
+        index_dir: folder of the persisted trigram index of the lookup ("{lookup}_trigrams.npz"). If None, the index is built on every call
+
+    Returns
+        street_temp: pandas Series with matched street names
+        report: pandas DataFrame with lookup, query, match (None if not matched), score and n_rows for every street name without exact match
+    '''
+    # load trigram index of the street names of the lookup (only built again if they changed)
+    index = load_trigram_index(reference_temp.dropna(), None if index_dir is None else index_dir / f"{lookup}_trigrams.npz")
+
+    # find most similar street names
+    report = fuzzy_match_keys(street_temp, reference_temp, match_threshold, index)
+    report.insert(0, "lookup", lookup)
+
+    # replace matched street names
+    matched = report.dropna(subset=["match"])
+    street_temp = street_temp.map(dict(zip(matched["query"], matched["match"]))).fillna(street_temp)
+
+    emit("street_matches", lookup=lookup, unmatched_names=len(report), matched_names=len(matched), rows_recovered=int(matched["n_rows"].sum()))
+
+    return street_temp, report
+
+
+@instrument
+def add_street_geometry(apartments, geo_streets, match_threshold:float=0.8, index_dir:pathlib.Path=None):
     '''
     Function for adding the geometry of the street names to the apartments DataFrame.
+    Street names without an exact match are matched to the most similar street name (see fuzzy_match_streets).
 
     Args
         apartments: pandas DataFrame with the scraped and cleaned rental data
         geo_streets: GeoDataFrame with the street names and their corresponding geometry
+        match_threshold: minimum similarity for fuzzy matches
+        index_dir: folder of the persisted trigram index of the street names (see fuzzy_match_streets)
+
+    Returns
+        merged_gdf: GeoDataFrame with the apartments and their street geometry
+        report: pandas DataFrame with fuzzy matches
     '''
 
     # remove final character for all street names in geo_streets if it is a space
@@ -90,6 +148,9 @@ def add_street_geometry(apartments, geo_streets):
     apartments['street_temp'] = clean_temp_cols(apartments['street'])
     geo_streets['vejnavne_temp'] = clean_temp_cols(geo_streets['vejnavne'])
 
+    # match near-misses (e.g., misspelled street names)
+    apartments['street_temp'], report = fuzzy_match_streets(apartments['street_temp'], geo_streets['vejnavne_temp'], "streets", match_threshold, index_dir)
+
     # Perform the merge using the temporary columns
     merged_df = apartments.merge(geo_streets[['vejnavne_temp', 'geometry']], left_on='street_temp', right_on='vejnavne_temp', how='left')
     
@@ -99,85 +160,145 @@ def add_street_geometry(apartments, geo_streets):
     # convert the merged DataFrame back to a GeoDataFrame
     merged_gdf = gpd.GeoDataFrame(merged_df, geometry='geometry')
 
-    return merged_gdf
+    return merged_gdf, report
 
 
-def update_stat_disticts(districts):
+@instrument
+def build_street_lookup(districts, missing_streets:dict):
     '''
-    Function that adds the most common missing streets and their corresponding districts to the districts DataFrame.
+    Function that compiles the street to district lookup: the most common district and spelling of each street and the manually matched streets.
+    The districts are given per address, so a street spanning several districts is assigned the district with the most addresses.
 
     Args
-        districts: pandas DataFrame with the districts and their corresponding streets
-    
+        districts: pandas DataFrame with the districts and their corresponding streets (one row per address, from street_to_district.csv)
+        missing_streets: dict with missing streets and their districts (e.g. {"Kongevellen": "Stat dist: 04.81"}), see "missing_streets" in data/municipalities.json
+
     Returns
-        districts: pandas DataFrame with the updated district names
+        lookup: pandas DataFrame with one row per cleaned street name ("Vejnavn_temp"), its most common spelling ("Vejnavn"),
+                district ("StatistikdistriktNavn") and number of addresses in the district ("counts", 0 for manually matched streets)
+    '''
+
+    # count addresses per street and district (cleaning only the unique street names)
+    counts = districts.groupby(['Vejnavn', 'StatistikdistriktNavn']).size().reset_index(name='counts')
+    counts['Vejnavn_temp'] = clean_temp_cols(counts['Vejnavn'])
+
+    # create a DataFrame with the missing streets and their districts (these override the districts of the addresses)
+    overrides = pd.DataFrame({'Vejnavn': pd.Series(list(missing_streets.keys()), dtype=str), 'StatistikdistriktNavn': pd.Series(list(missing_streets.values()), dtype=str), 'counts': 0})
+    overrides['Vejnavn_temp'] = clean_temp_cols(overrides['Vejnavn'])
+    counts = counts[~counts['Vejnavn_temp'].isin(overrides['Vejnavn_temp'])]
+
+    # keep only the most common "StatistikdistriktNavn" and "Vejnavn" (spelling) for each cleaned street name
+    lookup = counts.groupby(['Vejnavn_temp', 'StatistikdistriktNavn'], as_index=False)['counts'].sum()
+    lookup = lookup.sort_values(by='counts', ascending=False, kind='stable').drop_duplicates(subset=['Vejnavn_temp'])
+
+    spellings = counts.groupby(['Vejnavn_temp', 'Vejnavn'], as_index=False)['counts'].sum()
+    spellings = spellings.sort_values(by='counts', ascending=False, kind='stable').drop_duplicates(subset=['Vejnavn_temp'])
+
+    lookup = lookup.merge(spellings[['Vejnavn_temp', 'Vejnavn']], on='Vejnavn_temp')
+
+    # add missing streets
+    lookup = pd.concat([lookup, overrides.drop_duplicates(subset=['Vejnavn_temp'], keep='last')])
 
+    return lookup[['Vejnavn_temp', 'Vejnavn', 'StatistikdistriktNavn', 'counts']].sort_values('Vejnavn_temp').reset_index(drop=True)
+
+
+def street_lookup_version(source_path:pathlib.Path, missing_streets:dict):
     '''
+    Function to get the version of the street to district lookup, which changes if the source csv or the manually matched streets change.
 
-    # define the missing streets and their districts
-    missing_streets = ["Kongevellen", "Brassøvej", "Møllehatten", "Pollenvænget", "Borresøvej", "Broloftet", "Honningvænget",
-                       "Eya Jensens Gade", "Kværnloftet", "Dirch Passers Gade", "Doris Kæraas Gade", "Tommy Seebachs Gade",
-                       "Ellen Jensens Gade", "Ringen", "Tulipanhaven", "Tove Ditlevsens Gade", "Tulipanlunden", "Sifsgade",
-                       "Baldersgade"]
+    Args
+        source_path: path to street_to_district.csv
+        missing_streets: dict with missing streets and their districts
 
-    matching_districts = ["Stat dist: 04.81", "Stat dist: 04.40", "Stat dist: 04.81", "Stat dist: 06.10", "Stat dist: 04.40", "Stat dist: 04.81", "Stat dist: 06.10",
-                         "Stat dist: 04.81", "Stat dist: 04.81", "Stat dist: 01.60", "Stat dist: 04.81", "Stat dist: 01.60", 
-                         "Stat dist: 04.60", "Stat dist: 05.00", "Stat dist: 06.10", "Stat dist: 04.81", "Stat dist: 06.10", "Stat dist: 03.60",
-                         "Stat dist: 03.60"]
-    
-    # create a DataFrame with the missing streets and their districts
-    missing_districts = pd.DataFrame({'Vejnavn': missing_streets, 'StatistikdistriktNavn': matching_districts})
+    Returns
+        version: dict with version of the lookup format, (modification time, size) of the source and hash of the missing streets
+    '''
+    stat = source_path.stat()
+    overrides = json.dumps(missing_streets, sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+    return {"format": STREET_LOOKUP_FORMAT, "source": [stat.st_mtime_ns, stat.st_size], "overrides": hashlib.sha256(overrides).hexdigest()}
+
+
+def load_street_lookup(source_path:pathlib.Path, missing_streets:dict, lookup_path:pathlib.Path):
+    '''
+    Function that loads the persisted street to district lookup, and only builds it again (see build_street_lookup) if the source csv or the manually matched streets changed.
 
-    # append the missing streets and their districts to the original DataFrame
-    districts = pd.concat([districts, missing_districts])
+    Args
+        source_path: path to street_to_district.csv
+        missing_streets: dict with missing streets and their districts
+        lookup_path: path of the persisted lookup (its version is saved next to it with suffix .json)
+
+    Outputs
+        lookup_path, lookup_path with suffix .json: lookup and its version (if built)
+
+    Returns
+        lookup: pandas DataFrame with street to district lookup (see build_street_lookup)
+    '''
+    version = street_lookup_version(source_path, missing_streets)
+    version_path = lookup_path.with_suffix(".json")
+
+    # read persisted lookup if it is up to date
+    if lookup_path.exists() and version_path.exists():
+        with open(version_path, encoding="utf-8") as f:
+            saved_version = json.load(f)
 
-    return districts
+        if saved_version == version:
+            return pd.read_csv(lookup_path, dtype={'Vejnavn_temp': str, 'Vejnavn': str, 'StatistikdistriktNavn': str}, keep_default_na=False)
 
+    # build lookup from source
+    lookup = build_street_lookup(pd.read_csv(source_path, sep=';', usecols=['Vejnavn', 'StatistikdistriktNavn']), missing_streets)
+    lookup.to_csv(lookup_path, index=False)
 
-def add_stat_district(apartments, districts):
+    # write version last, so an incomplete lookup is never read
+    with open(version_path, "w", encoding="utf-8") as f:
+        json.dump(version, f, indent=2)
+
+    emit("street_lookup", action="built", n_streets=len(lookup), n_overrides=len(missing_streets))
+
+    return lookup
+
+
+@instrument
+def add_stat_district(apartments, lookup, match_threshold:float=0.8, index_dir:pathlib.Path=None):
     '''
-    Function that adds statistics districts to the apartments DataFrame.
+    Function that adds statistics districts and the spelling of the street names in the lookup to the apartments DataFrame.
+    Street names without an exact match are matched to the most similar street name (see fuzzy_match_streets).
 
     Args
         apartments: pandas DataFrame with the scraped and cleaned rental data
-        districts: pandas DataFrame with the districts and their corresponding streets
+        lookup: pandas DataFrame with street to district lookup (see build_street_lookup)
+        match_threshold: minimum similarity for fuzzy matches
+        index_dir: folder of the persisted trigram index of the street names (see fuzzy_match_streets)
 
     Returns
         merged_df: pandas DataFrame with the apartments and their corresponding statistics districts
+        report: pandas DataFrame with fuzzy matches
     '''
 
-    # for each "Vejnavn", find the most common "StatistikdistriktNavn"
-    districts = districts.groupby(['Vejnavn', 'StatistikdistriktNavn']).size().reset_index(name='counts')
-
-    # keep only the most common "StatistikdistriktNavn" for each "Vejnavn"
-    districts = districts.sort_values(by='counts', ascending=False)
-    districts = districts.drop_duplicates(subset=['Vejnavn'])
-
-    # create temp columns for merging
+    # create temp column for matching
     apartments['street_temp'] = clean_temp_cols(apartments['street'])
-    districts['Vejnavn_temp'] = clean_temp_cols(districts['Vejnavn'])
 
-    # merge the data
-    merged_df = apartments.merge(districts, left_on='street_temp', right_on='Vejnavn_temp', how='left')
+    # match near-misses (e.g., misspelled street names)
+    apartments['street_temp'], report = fuzzy_match_streets(apartments['street_temp'], lookup['Vejnavn_temp'], "street_to_district", match_threshold, index_dir)
 
-    # for all the same street_temp, change values in "street" to most common street name
-    most_common_streets = apartments.groupby('street_temp')['street'].agg(lambda x: x.value_counts().index[0])
+    # look up spelling and district of each street (NaN if not in lookup)
+    matches = lookup.set_index('Vejnavn_temp').reindex(apartments['street_temp'].to_numpy())
 
-    # Update 'street' column based on 'street_temp' groups
-    merged_df['street'] = merged_df['street_temp'].map(most_common_streets)
+    merged_df = apartments.drop(columns='street_temp')
 
-    # drop the redundant column
-    merged_df.drop(["Vejnavn_temp", "street_temp"], axis=1, inplace=True)
+    for col in ['Vejnavn', 'StatistikdistriktNavn', 'counts']:
+        merged_df[col] = matches[col].to_numpy()
 
-    # manually update morten børups gade to "Morten Børups Gade"
-    merged_df.loc[merged_df['street'] == 'morten børups gade', 'street'] = 'Morten Børups Gade'
+    # use the spelling of the lookup for all spellings of the same street
+    merged_df['street'] = merged_df['Vejnavn'].fillna(merged_df['street'])
 
     # convert the merged DataFrame back to a GeoDataFrame
     merged_gdf = gpd.GeoDataFrame(merged_df, geometry='geometry')
 
-    return merged_gdf
+    return merged_gdf, report
 
 
+@instrument
 def update_stat_district_names(apartments, geo_districts):
     '''
     Function that updates the statistic district names from being codes to being the actual district names.
@@ -225,6 +346,7 @@ def update_stat_district_names(apartments, geo_districts):
     return merged_gdf
 
 
+@instrument
 def add_society_districts(apartments, geo_society):
     """
     Add society districts ("Lokal Samfund") to apartments data based on the statistics districts ("Statistikdistrikt").
@@ -279,30 +401,26 @@ def add_society_districts(apartments, geo_society):
     return apartments 
 
 
-def merge_districts(apartments):
+@instrument
+def merge_districts(apartments, central_districts:list):
     """
     Merge "Statistikdistriker" (statistics districts) into larger districts based on the "Lokal Samfund" (local community districts). 
     Done for all statistics districts except "Midtbyen" (city center).
 
     Args:
         apartments: GeoDataFrame with apartments with both statistics districts and local community districts
+        central_districts: statistics districts of the city center which are kept as is (Midtbyen in Aarhus)
 
     Returns:
         apartments: GeoDataFrame with apartments with both statistics districts and society districts merged into larger districts for relevant areas.
     """
 
-    # define midtbyen districts
-    midtbyen = ["Trøjborg", "Universitetet/Kommunehospitalet", "Nordre Kirkegård", "Vestervang/Klostervang/Ø-gaderne", "Ø-gaderne Øst",
-                "Østbanetorvet/Nørre Stenbro", "Nørregade", "Latinerkvarteret", "Klostertorv/Vesterbro Torv", "Åboulevarden", "Skolegade/Bispetorv/Europaplads",
-                "Mølleparken", "TelefonTorvet", "Fredens Torv", "Ceresbyen/Godsbanen", "Rådhuskvarteret", "De Bynære Havnearealer/Aarhus Ø",
-                "Sydhavnen og Marselisborg lystbådehavn", "Frederiksbjerg Vest", "Frederiksbjerg Øst", "Erhvervshavnen", "Botanisk Have/Amtssygehuset"]
-    
     # initialize empty column for final districts
     districts = []
     geometry = []
     
     for i in range(len(apartments)):
-        if apartments["stat_district"][i] in midtbyen:
+        if apartments["stat_district"][i] in central_districts:
             districts.append(apartments["stat_district"][i])
             geometry.append(apartments["stat_geometry"][i])
         
@@ -323,24 +441,54 @@ def merge_districts(apartments):
     return apartments
 
 
-def main():
-    # load data
-    path, apartments, districts, geo_streets, geo_districts, geo_society = load_data()
+@instrument
+def add_geodata(apartments, districts, geo_streets, geo_districts, geo_society, municipality:dict=None, report_path:pathlib.Path=None, index_dir:pathlib.Path=None):
+    '''
+    Function that runs all merges to add geodata to the scraped and cleaned rental data.
+
+    Args
+        apartments: pandas DataFrame with the scraped and cleaned rental data
+        districts: pandas DataFrame with the street to district lookup (see load_street_lookup)
+        geo_streets: GeoDataFrame with the street names and their corresponding geometry
+        geo_districts: GeoDataFrame with the statistic districts and their corresponding geometry
+        geo_society: GeoDataFrame with the local community districts and their corresponding geometry
+        municipality: municipality configuration (see config.py). Defaults to the default municipality
+        report_path: path to save the report of fuzzy street name matches to. Defaults to None (no report)
+        index_dir: folder to persist the trigram indexes of the street names in (e.g. next to the street lookup). Defaults to None (built on every call)
+
+    Outputs
+        street_match_report.csv: fuzzy street name matches (lookup, query, match, score, n_rows). If report_path is not None.
+        streets_trigrams.npz, street_to_district_trigrams.npz: trigram indexes and their versions (.json). If index_dir is not None and the street names changed.
+
+    Returns
+        apartments: GeoDataFrame with apartments, their street geometry and their district
+    '''
+    if municipality is None:
+        municipality = get_municipality()
+
+    # define threshold for fuzzy street name matches
+    match_threshold = municipality.get("street_match_threshold", 0.8)
 
     # add geometry to the data
-    apartments = add_street_geometry(apartments, geo_streets)
+    apartments, street_report = add_street_geometry(apartments, geo_streets, match_threshold, index_dir)
 
-    # update districts
-    districts = update_stat_disticts(districts)
-    
     # add district to the data
-    apartments = add_stat_district(apartments, districts)
+    apartments, district_report = add_stat_district(apartments, districts, match_threshold, index_dir)
+
+    # save report of fuzzy matches
+    if report_path is not None:
+        pd.concat([street_report, district_report]).to_csv(report_path / "street_match_report.csv", index=False)
 
     # update district names
     apartments = update_stat_district_names(apartments, geo_districts)
 
+    # log rows with failed street and district lookups (counted as dropped rows by dropna below)
+    emit("failed_lookup", rows=len(apartments), missing={col: int(apartments[col].isna().sum()) for col in ["geometry_street", "stat_district"]})
+
     # drop all rows with missing values
+    n_rows = len(apartments)
     apartments = apartments.dropna()
+    log_rows_dropped("dropna", n_rows, len(apartments))
 
     # reset index
     apartments = apartments.reset_index(drop=True)
@@ -349,10 +497,24 @@ def main():
     apartments = add_society_districts(apartments, geo_society)
 
     # get overlaps
-    apartments = merge_districts(apartments)
+    apartments = merge_districts(apartments, municipality["central_districts"])
+
+    return apartments
+
+
+def main():
+    # get configuration of default municipality
+    municipality = get_municipality()
+
+    # load data
+    apartments, districts, geo_streets, geo_districts, geo_society = load_data(municipality)
+
+    # add geodata
+    apartments = add_geodata(apartments, districts, geo_streets, geo_districts, geo_society, municipality, report_path=municipality["paths"]["results"],
+                             index_dir=municipality["paths"]["street_lookup"].parent)
 
     # save as csv
-    apartments.to_csv(path.parents[1] / "data" / "complete_data.csv", index=False)
+    apartments.to_csv(municipality["paths"]["complete_data"], index=False)
 
 
 
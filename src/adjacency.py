@@ -0,0 +1,171 @@
+'''
+Functions to build, save and query the adjacency of districts as a compressed sparse row (CSR) structure.
+
+The adjacency is built once in aggregate_data.py and saved as results/district_adjacency.npz with three arrays:
+    district    names of the districts (position i is district id i, in the order of district_aggregates.csv)
+    indptr      start of the neighbors of each district in indices (indptr[i]:indptr[i + 1] are the neighbors of district i)
+    indices     district ids of the neighbors of all districts
+
+The neighbors of a district are a slice of indices (no parsing of stringified lists), and the same arrays give a sparse matrix
+which can be used as spatial weights (e.g. libpysal.weights.WSP(to_sparse_matrix(adjacency)).to_W()).
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+
+# sparse matrix for spatial weights
+from scipy.sparse import csr_matrix
+
+def build_adjacency(districts:gpd.GeoDataFrame, district_col:str="district"):
+    '''
+    Function to build the adjacency of districts from their polygons.
+    Both "touches" and "overlaps" are used to get all neighbors due to the resolution of the polygons (some polygons are not perfectly aligned).
+
+    Args
+        districts: geodataframe with one polygon per district
+        district_col: name of the column with district names
+
+    Returns
+        adjacency: dict with "district", "indptr" and "indices" arrays
+    '''
+    geometry = districts.geometry.reset_index(drop=True)
+    n_districts = len(geometry)
+
+    # query pairs of touching and overlapping polygons with the spatial index (instead of comparing every pair)
+    sources, targets = [], []
+
+    for predicate in ["touches", "overlaps"]:
+        source, target = geometry.sindex.query(geometry, predicate=predicate)
+        sources.append(source)
+        targets.append(target)
+
+    source, target = np.concatenate(sources), np.concatenate(targets)
+
+    # remove self pairs and duplicates, sort by source then target
+    pair_ids = np.unique(source[source != target].astype(np.int64) * n_districts + target[source != target])
+    source, target = pair_ids // n_districts, pair_ids % n_districts
+
+    # start of the neighbors of each district
+    indptr = np.zeros(n_districts + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(source, minlength=n_districts))
+
+    adjacency = {
+        "district": districts[district_col].to_numpy(dtype=str),
+        "indptr": indptr,
+        "indices": target.astype(np.int32),
+    }
+
+    return adjacency
+
+def save_adjacency(adjacency:dict, save_path:pathlib.Path):
+    '''
+    Function to save the adjacency to save_path.
+
+    Args
+        adjacency: adjacency from build_adjacency
+        save_path: path to save the adjacency to
+
+    Outputs
+        district_adjacency.npz: district names, indptr and indices
+    '''
+    np.savez(save_path / "district_adjacency.npz", district=adjacency["district"], indptr=adjacency["indptr"], indices=adjacency["indices"])
+
+def load_adjacency(adjacency_path:pathlib.Path):
+    '''
+    Function to load the adjacency.
+
+    Args
+        adjacency_path: path to district_adjacency.npz
+
+    Returns
+        adjacency: dict with district names, indptr, indices and a lookup from district name to id ("position")
+    '''
+    with np.load(adjacency_path) as arrays:
+        adjacency = {key: arrays[key] for key in arrays.files}
+
+    # lookup from district name to id
+    adjacency["position"] = {district: i for i, district in enumerate(adjacency["district"])}
+
+    return adjacency
+
+def neighbor_ids(adjacency:dict, district:str):
+    '''
+    Function to get the ids of the neighbors of a district.
+
+    Args
+        adjacency: adjacency from load_adjacency
+        district: name of district
+
+    Returns
+        ids: array of district ids of the neighbors
+    '''
+    i = adjacency["position"][district]
+
+    return adjacency["indices"][adjacency["indptr"][i]:adjacency["indptr"][i + 1]]
+
+def get_neighbors(adjacency:dict, district:str):
+    '''
+    Function to get the names of the neighbors of a district.
+
+    Args
+        adjacency: adjacency from load_adjacency
+        district: name of district
+
+    Returns
+        neighbors: list of names of neighbor districts
+    '''
+    return adjacency["district"][neighbor_ids(adjacency, district)].tolist()
+
+def k_hop_neighbors(adjacency:dict, district:str, k:int=2):
+    '''
+    Function to get all districts within k steps of a district (breadth-first search over the adjacency).
+
+    Args
+        adjacency: adjacency from load_adjacency
+        district: name of district
+        k: maximum number of steps (1 gives the neighbors)
+
+    Returns
+        neighborhood: dataframe with district and hops (number of steps from the district), sorted by hops
+    '''
+    hops = np.full(len(adjacency["district"]), -1)
+    frontier = np.array([adjacency["position"][district]])
+    hops[frontier] = 0
+
+    for hop in range(1, k + 1):
+        # neighbors of the frontier which have not been visited
+        candidates = np.concatenate([adjacency["indices"][adjacency["indptr"][i]:adjacency["indptr"][i + 1]] for i in frontier])
+        frontier = np.unique(candidates[hops[candidates] < 0])
+
+        if len(frontier) == 0:
+            break
+
+        hops[frontier] = hop
+
+    ids = np.flatnonzero(hops > 0)
+    ids = ids[np.argsort(hops[ids], kind="stable")]
+
+    return pd.DataFrame({"district": adjacency["district"][ids], "hops": hops[ids]})
+
+def to_sparse_matrix(adjacency:dict):
+    '''
+    Function to convert the adjacency to a binary sparse matrix (e.g. for spatial weights).
+
+    Args
+        adjacency: adjacency from build_adjacency or load_adjacency
+
+    Returns
+        matrix: scipy csr_matrix of shape (n_districts, n_districts) with 1 for neighbors
+    '''
+    n_districts = len(adjacency["district"])
+    data = np.ones(len(adjacency["indices"]), dtype=np.int8)
+
+    return csr_matrix((data, adjacency["indices"], adjacency["indptr"]), shape=(n_districts, n_districts))
@@ -9,6 +9,32 @@ import geopandas as gpd
 import pandas as pd
 import pathlib
 
+# custom functions for building nearest-neighbor index of streets, adjacency of districts, columnar store of listings and feature store of aggregates (all used in app)
+from street_index import build_street_index
+from adjacency import build_adjacency, save_adjacency, load_adjacency, to_sparse_matrix
+
+# bootstrap confidence intervals and empirical bayes smoothing of district and street means
+from bootstrap import bootstrap_means
+from smoothing import group_statistics, smooth_district_means, smooth_nested_means
+from listing_store import save_listing_store
+from feature_store import save_feature_store
+from results_db import save_results_db
+
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
+# district means which are smoothed towards their neighbor districts: (rental type, time, column of listings)
+SMOOTHED_DISTRICT_COLS = {
+    "apartment_rent_sqm_now": ("apartment", "now", "rent_per_square_meter"),
+    "apartment_rent_sqm_then": ("apartment", "then", "rent_per_square_meter"),
+    "room_rent_now": ("room", "now", "rent_without_expenses"),
+    "room_rent_then": ("room", "then", "rent_without_expenses"),
+}
+
+@instrument
 def get_neighbor_districts(complete_data:pd.DataFrame):
     '''
     Function to get neighbor districts by finding all districts that touch or overlap with each other using GeoPandas.
@@ -17,43 +43,75 @@ def get_neighbor_districts(complete_data:pd.DataFrame):
         complete_data: complete pandas dataframe with geometry as string
 
     Returns
-        complete_data: complete pandas dataframe with neighbor districts
+        adjacency: neighbors of each district as compressed sparse rows (see adjacency.py)
     '''
 
-    # convert geometry to wkt
-    complete_data["geometry"] = gpd.GeoSeries.from_wkt(complete_data["geometry"])
+    # transform into geodataframe with geometry from wkt (without changing the geometry column of complete_data)
+    districts = gpd.GeoDataFrame(complete_data[["district"]], geometry=gpd.GeoSeries.from_wkt(complete_data["geometry"]))
 
-    # transform into geodataframe
-    complete_data = gpd.GeoDataFrame(complete_data, geometry="geometry")
+    # get neighbors of all districts with the spatial index
+    adjacency = build_adjacency(districts)
 
-    district_neighbors = []
+    return adjacency
 
-    # loop through all districts
-    for i in range(len(complete_data)):
 
-        # get neighbors. Both "touches" and "overlaps" is used to get all neighbors due to the resolution of our polygons (some polygons are not perfectly aligned). # solution by https://gis.stackexchange.com/questions/281652/finding-all-neighbors-using-geopandas 
-        neighbors_touching = complete_data[complete_data.geometry.touches(complete_data.iloc[i].geometry)].district.tolist()
-        neighbors_overlaps = complete_data[complete_data.geometry.overlaps(complete_data.iloc[i].geometry)].district.tolist()
+def get_confidence_intervals(listings:pd.DataFrame, group_cols:list, value_col:str, name:str, workers:int=None):
+    '''
+    Function to get 95% bootstrap confidence intervals of the mean of value_col per group (see bootstrap.py).
 
-        # find union
-        neighbors = neighbors_touching + neighbors_overlaps
+    Args
+        listings: pandas dataframe with the listings the means are computed from
+        group_cols: columns to group by (e.g. ["district"])
+        value_col: column to compute the mean of
+        name: name of the mean in the aggregates (e.g. "apartment_rent_sqm_now")
+        workers: number of worker processes for the bootstrap (None to run in the current process)
+
+    Returns
+        intervals: dataframe with group_cols, "{name}_ci_low" and "{name}_ci_high" (NaN for groups with one listing), rounded to 1 decimal
+    '''
+    intervals = bootstrap_means(listings, group_cols, value_col, n_resamples=1000, confidence=0.95, workers=workers)
+
+    # rename to name of mean
+    intervals = intervals.rename(columns={f"{value_col}_ci_low": f"{name}_ci_low", f"{value_col}_ci_high": f"{name}_ci_high"})
+
+    return intervals.round({f"{name}_ci_low": 1, f"{name}_ci_high": 1})
 
-        # add neighbors to list
-        district_neighbors.append(neighbors)
-    
-    # add neighbors to dataframe
-    complete_data["neighbors"] = district_neighbors
 
-    return complete_data
+@instrument
+def add_smoothed_district_means(district_data:pd.DataFrame, complete_data:pd.DataFrame, adjacency:dict):
+    '''
+    Function to add empirical bayes smoothed means of districts, shrunk towards the mean of their neighbor districts (see smoothing.py).
+    Districts with few listings move towards their neighbors, and districts without listings get the mean of their neighbors.
 
+    Args
+        district_data: district aggregates (in the order of the adjacency)
+        complete_data: complete pandas dataframe with "time" column
+        adjacency: adjacency of the districts from get_neighbor_districts
 
-def get_district_aggregates(complete_data:pd.DataFrame, save_path:pathlib.Path):
+    Returns
+        district_data: district aggregates with "{col}_smoothed" for each column in SMOOTHED_DISTRICT_COLS
+    '''
+    matrix = to_sparse_matrix(adjacency)
+
+    for col, (rental_type, time, value_col) in SMOOTHED_DISTRICT_COLS.items():
+        listings = complete_data[(complete_data["rental_type"] == rental_type) & (complete_data["time"] == time)]
+
+        counts, means, within_var = group_statistics(listings, ["district"], value_col, adjacency["district"])
+        district_data[f"{col}_smoothed"] = smooth_district_means(matrix, means, counts, within_var).round(1)
+
+    return district_data
+
+
+@instrument
+def get_district_aggregates(complete_data:pd.DataFrame, save_path:pathlib.Path, bootstrap_workers:int=None, crs=25832):
     '''
     Function to get district aggregates from complete_data_csv.
 
     Args
         complete_data: complete pandas dataframe with geometry as string
         save_path: path to save the district aggregates to
+        bootstrap_workers: number of worker processes for the confidence intervals (None to run in the current process)
+        crs: crs of the geometries (recorded in the feature store, defaults to 25832 as this is the crs for Denmark)
     
     Returns
         district_data: district aggregates with geometry object as string
@@ -97,18 +155,35 @@ def get_district_aggregates(complete_data:pd.DataFrame, save_path:pathlib.Path):
     # add to district_data
     district_data = district_data.merge(apartment_rooms_count, on="district")
 
+    ## CONFIDENCE INTERVALS of 2023 means
+    listings_now = complete_data[complete_data["year"] == 2023]
+
+    apartment_intervals = get_confidence_intervals(listings_now[listings_now["rental_type"] == "apartment"], ["district"], "rent_per_square_meter", "apartment_rent_sqm_now", bootstrap_workers)
+    room_intervals = get_confidence_intervals(listings_now[listings_now["rental_type"] == "room"], ["district"], "rent_without_expenses", "room_rent_now", bootstrap_workers)
+
+    # add to district_data
+    district_data = district_data.merge(apartment_intervals, on="district", how="left").merge(room_intervals, on="district", how="left")
+
     # add back geometry from complete_data
     district_data = district_data.merge(complete_data[["district", "geometry"]].drop_duplicates(), on="district")
 
-    # get neighbor districts
-    district_data = get_neighbor_districts(district_data)
+    # get neighbor districts and save them as compressed sparse rows (ids are positions in district_aggregates.csv)
+    adjacency = get_neighbor_districts(district_data)
+    save_adjacency(adjacency, save_path)
+
+    # add smoothed means (shrunk towards neighbor districts)
+    district_data = add_smoothed_district_means(district_data, complete_data, adjacency)
 
     # write to csv
     district_data.to_csv(save_path / "district_aggregates.csv", index=False)
 
+    # write memory-mapped feature store (used in app)
+    save_feature_store(district_data, save_path / "features" / "districts", crs=crs)
+
     return district_data
 
 
+@instrument
 def similar_rent_prices(street_data, n_similar_streets:int):
     '''
     Get n_similar_streets with similar rent prices for each street in street_data.
@@ -171,13 +246,17 @@ def similar_rent_prices(street_data, n_similar_streets:int):
     return street_data
 
 
-def get_street_aggregates(complete_data, savepath, n_similar_streets:int=5):
+@instrument
+def get_street_aggregates(complete_data, savepath, n_similar_streets:int=5, bootstrap_workers:int=None, crs=25832):
     '''
     Function that calculates aggregates for each street in complete_data and saves them to savepath.
 
     Args
         complete_data: complete pandas dataframe with geometry as string
         savepath: path to save the street aggregates to
+        n_similar_streets: number of similar streets to get
+        bootstrap_workers: number of worker processes for the confidence intervals (None to run in the current process)
+        crs: crs of the geometries (recorded in the feature store, defaults to 25832 as this is the crs for Denmark)
     
     Returns
         street_data: street aggregates with geometry object as string
@@ -195,6 +274,14 @@ def get_street_aggregates(complete_data, savepath, n_similar_streets:int=5):
     # round rent_per_square_meter to 1 decimal
     street_data["rent_per_square_meter"] = round(street_data["rent_per_square_meter"], 1)
 
+    # add confidence intervals of rent_per_square_meter (many streets rest on a few listings)
+    street_intervals = get_confidence_intervals(complete_data, ["street", "district"], "rent_per_square_meter", "rent_per_square_meter", bootstrap_workers)
+    street_data = street_data.merge(street_intervals, on=["street", "district"], how="left")
+
+    # add empirical bayes smoothed rent_per_square_meter (shrunk towards the mean of the district of the street, see smoothing.py)
+    counts, means, within_var = group_statistics(complete_data, ["street", "district"], "rent_per_square_meter", pd.MultiIndex.from_frame(street_data[["street", "district"]]))
+    street_data["rent_per_square_meter_smoothed"] = smooth_nested_means(street_data["district"], means, counts, within_var).round(1)
+
     # for each street, find the five other streets with most similar rent_per_square_meter
     street_data = similar_rent_prices(street_data, n_similar_streets)
 
@@ -216,22 +303,35 @@ def get_street_aggregates(complete_data, savepath, n_similar_streets:int=5):
     # save to csv
     street_data.to_csv(savepath / "street_aggregates.csv", index=False)
 
+    # write memory-mapped feature store (used in app)
+    save_feature_store(street_data, savepath / "features" / "streets", geometry_col="geometry_street", crs=crs)
+
+    # build index for querying similar streets within a distance (used in app)
+    build_street_index(street_data, savepath)
+
     return street_data
 
 
 def main():
-    # define paths
-    path = pathlib.Path(__file__)
-    save_path = path.parents[1] / "results"
+    # define paths from configuration of default municipality
+    municipality = get_municipality()
+    paths = municipality["paths"]
+    save_path = paths["results"]
 
     # read complete data
-    complete_data = pd.read_csv(path.parents[1] / "data" / "complete_data.csv")
+    complete_data = pd.read_csv(paths["complete_data"])
 
     # create district aggregates
-    get_district_aggregates(complete_data, save_path)
+    district_data = get_district_aggregates(complete_data, save_path, crs=municipality["crs"])
 
     # create street aggregates
-    get_street_aggregates(complete_data, save_path, n_similar_streets=5)
+    street_data = get_street_aggregates(complete_data, save_path, n_similar_streets=5, crs=municipality["crs"])
+
+    # save listings as columnar store for filtering in app
+    save_listing_store(complete_data, save_path, municipality["crs"])
+
+    # save aggregates in indexed database (optional backend of app, queried per selected district or street)
+    save_results_db(district_data, street_data, load_adjacency(save_path / "district_adjacency.npz"), save_path, municipality["crs"])
     
 
 
@@ -28,8 +28,16 @@ import numpy as np
 
 # import custom functions
 from utils import filter_midtbyen
+from rent_surface import load_rent_surface
+
+# municipality configuration (streets excluded from plots)
+from config import get_municipality
+
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument
 
 ## HELPER FUNCTIONS ##
+@instrument
 def load_data(datapath:pathlib.Path, geometry_col:str, crs=25832): 
     '''
     Function to load data from path and convert to geodataframe with custom CRS. 
@@ -58,6 +66,7 @@ def load_data(datapath:pathlib.Path, geometry_col:str, crs=25832):
     return data
 
 ## DISTRICTS ## 
+@instrument
 def plot_district_overview(district_data, savepath):
     '''
     Function to plot the districts in Aarhus.
@@ -71,7 +80,7 @@ def plot_district_overview(district_data, savepath):
     '''
 
     # add missing districts
-    missing_districts = add_missing_districts(pathlib.Path(__file__))
+    missing_districts = add_missing_districts()
 
     # seperate midtbyen from the rest of the districts
     midtbyen_districts = filter_midtbyen(district_data, midtbyen=True)
@@ -165,13 +174,15 @@ def add_minimap(ax, district_data:gpd.GeoDataFrame, column_to_plot:str, district
         # remove ticks and labels from the inset plot
         ax_inset.tick_params(labelleft=False, labelbottom=False, left=False, bottom=False)
 
-def plot_districts_heatmap(district_data:gpd.GeoDataFrame, rental_type:str, savepath:pathlib.Path):
+@instrument
+def plot_districts_heatmap(district_data:gpd.GeoDataFrame, rental_type:str, savepath:pathlib.Path, smoothed:bool=False):
     '''
     Plot the districts as a heatmap (choropleth map)
     Args:
         district_data: dataframe containing the district data
         rental_type: The type of rental to plot
         savepath: The path to save the plot to
+        smoothed: Whether to plot the smoothed rents ("*_smoothed" columns from aggregate_data.py) instead of the raw averages. Defaults to False.
 
     Outputs: 
         .png: A plot of the districts and their average rent on the given rental type
@@ -189,6 +200,11 @@ def plot_districts_heatmap(district_data:gpd.GeoDataFrame, rental_type:str, save
         cmap_label = "Average Room rent (DKK)"
         cmap = "Purples"
 
+    # use smoothed rents (shrunk towards neighbor districts, so districts with few or no listings are not noisy or missing)
+    if smoothed:
+        col_now, col_then = f"{col_now}_smoothed", f"{col_then}_smoothed"
+        cmap_label = f"{cmap_label}, smoothed"
+
     # calculate min and max values for both years
     min_value = min(district_data[col_now].min(), district_data[col_then].min())
     max_value = max(district_data[col_now].max(), district_data[col_then].max())
@@ -230,7 +246,8 @@ def plot_districts_heatmap(district_data:gpd.GeoDataFrame, rental_type:str, save
     plt.savefig(savepath, dpi=300, bbox_inches="tight", pad_inches=0.5)
 
 ## PLOT STREETS ## 
-def plot_streets(street_data, district_data, savepath):
+@instrument
+def plot_streets(street_data, district_data, savepath, excluded_streets:list=None):
     '''
     Create a plot of the streets in the midtbyen district, colored by rent
 
@@ -238,6 +255,7 @@ def plot_streets(street_data, district_data, savepath):
         street_data: dataframe containing the street data
         district_data: dataframe containing the district data
         savepath: The path to save the plot to
+        excluded_streets: streets left out of the plot. Defaults to "excluded_streets" of the default municipality
     
     Outputs:
         .png: A plot of the streets in the midtbyen district, colored by rent
@@ -247,8 +265,11 @@ def plot_streets(street_data, district_data, savepath):
     street_data = filter_midtbyen(street_data)
     district_data = filter_midtbyen(district_data)
 
-    # filter out "strandvejen" and "stadion alle" as they run outside of bounds of the district map
-    street_data = street_data[~street_data["street"].isin(["Strandvejen", "Stadion Alle"])]
+    # filter out excluded streets (e.g., "strandvejen" and "stadion alle" in aarhus as they run outside of bounds of the district map)
+    if excluded_streets is None:
+        excluded_streets = get_municipality().get("excluded_streets", [])
+
+    street_data = street_data[~street_data["street"].isin(excluded_streets)]
 
     # define figure with one ax
     fig, ax = plt.subplots(1, figsize=(5, 10))
@@ -282,7 +303,52 @@ def plot_streets(street_data, district_data, savepath):
     # save the plot
     fig.savefig(savepath, dpi=300, bbox_inches="tight")
 
+@instrument
+def plot_rent_surface(surface_path:pathlib.Path, district_data:gpd.GeoDataFrame, savepath:pathlib.Path):
+    '''
+    Plot the smoothed surface of apartment rent per square meter (from rent_surface.py) with district borders
+
+    Args:
+        surface_path: The path to rent_surface.npz
+        district_data: dataframe containing the district data
+        savepath: The path to save the plot to
+
+    Outputs:
+        .png: A plot of the rent surface
+    '''
+    raster = load_rent_surface(surface_path)
+    surface, transform = raster["surface"], raster["transform"]
+
+    # extent of the raster (west, east, south, north)
+    extent = [transform[0], transform[0] + surface.shape[1] * transform[1], transform[3] + surface.shape[0] * transform[5], transform[3]]
+
+    # set font to Times New Roman
+    plt.rcParams["font.family"] = "Times New Roman"
+
+    fig, ax = plt.subplots(1, figsize=(10, 10))
+
+    # add districts as background, the surface and the district borders on top
+    district_data.plot(ax=ax, color="#F2F3F4", edgecolor="none")
+    image = ax.imshow(surface, extent=extent, cmap="Blues", interpolation="bilinear", zorder=2)
+    district_data.boundary.plot(ax=ax, color="black", linewidth=0.3, zorder=3)
+
+    # limit plot to the districts
+    xmin, ymin, xmax, ymax = district_data.total_bounds
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+
+    # plot colorbar
+    cbar = fig.colorbar(image, ax=ax, orientation="horizontal", shrink=0.5, aspect=20, pad=0.02)
+    cbar.set_label(f"Apartment rent (DKK per m2), smoothed within {raster['bandwidth']:.0f} m", fontsize=14, labelpad=10)
+
+    # remove axis ticks
+    ax.tick_params(labelleft=False, labelbottom=False, left=False, bottom=False)
+
+    # save the plot
+    fig.savefig(savepath, dpi=300, bbox_inches="tight")
+
 ## MORANS I ##
+@instrument
 def calculate_global_moran(street_data):
     '''
     Calculate global morans I for all streets in aarhus and just for just midtbyen streets
@@ -312,7 +378,8 @@ def calculate_global_moran(street_data):
 
     return mi_aarhus, mi_midtbyen
 
-def plot_local_moran(street_data, savepath):
+@instrument
+def plot_local_moran(street_data, savepath, excluded_streets:list=None):
     '''
     Plots significant local morans I in midtbyen.
     Based on tutorial by Dani Arribas-Bel (http://darribas.org/gds15/content/labs/lab_06.html)
@@ -320,6 +387,7 @@ def plot_local_moran(street_data, savepath):
     Args:
         street_data: dataframe containing the street data
         savepath: The path to save the plot to
+        excluded_streets: streets left out of the plot. Defaults to "excluded_streets" of the default municipality
     
     Outputs:
         .png: A plot of the streets in the midtbyen district, colored by rent
@@ -331,8 +399,11 @@ def plot_local_moran(street_data, savepath):
     # filter midtbyen
     street_data_midtbyen = filter_midtbyen(street_data)
 
-    # filter out "strandvejen" and "stadion alle" as they run outside of bounds of the district map
-    street_data_midtbyen = street_data_midtbyen[~street_data_midtbyen["street"].isin(["Strandvejen", "Stadion Alle"])]
+    # filter out excluded streets (e.g., "strandvejen" and "stadion alle" in aarhus as they run outside of bounds of the district map)
+    if excluded_streets is None:
+        excluded_streets = get_municipality().get("excluded_streets", [])
+
+    street_data_midtbyen = street_data_midtbyen[~street_data_midtbyen["street"].isin(excluded_streets)]
 
     # get spatial weights
     w_midtbyen = lps.weights.KNN.from_dataframe(street_data_midtbyen, k = 3)
@@ -433,9 +504,18 @@ def main():
     # plot room rent
     plot_districts_heatmap(district_data, "room", plot_dir / "room_rent_comparison.png")
 
+    # plot smoothed rents (if in the aggregates)
+    if "apartment_rent_sqm_now_smoothed" in district_data.columns:
+        plot_districts_heatmap(district_data, "apartment", plot_dir / "apartment_rent_comparison_smoothed.png", smoothed=True)
+        plot_districts_heatmap(district_data, "room", plot_dir / "room_rent_comparison_smoothed.png", smoothed=True)
+
     # plot streets
     plot_streets(street_data, district_data, plot_dir / "street_apartment_rent_sqm_now.png")
 
+    # plot rent surface (if computed with rent_surface.py)
+    if (datapath / "rent_surface.npz").exists():
+        plot_rent_surface(datapath / "rent_surface.npz", district_data, plot_dir / "apartment_rent_surface.png")
+
     # calculate global morans I
     mi_aarhus, mi_midtbyen = calculate_global_moran(street_data)
 
@@ -0,0 +1,103 @@
+'''
+Functions for bootstrap confidence intervals of group means (e.g. the mean rent per square meter of each street), used in aggregate_data.py.
+
+Groups are bucketed by their number of listings. For all groups of the same size k, the resamples are drawn at once as one matrix of
+random positions (groups x resamples x k) and the resampled means are computed with a single gather and mean, so there are no loops over groups.
+Large buckets are split into chunks to limit memory, and chunks can be spread over a process pool. Each chunk gets its own seed spawned
+from one seed, so the intervals are the same for any number of workers.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+from concurrent.futures import ProcessPoolExecutor
+
+# data wrangling
+import pandas as pd
+import numpy as np
+
+# maximum number of resampled values per chunk (groups x resamples x group size), i.e. about 40 MB of positions
+MAX_CHUNK_VALUES = 10_000_000
+
+def bootstrap_chunk(values:np.ndarray, n_resamples:int, confidence:float, seed:np.random.SeedSequence):
+    '''
+    Function to compute percentile bootstrap intervals of the means of groups of the same size.
+
+    Args
+        values: array of shape (n_groups, group size) with the values of each group
+        n_resamples: number of bootstrap resamples
+        confidence: confidence level (e.g. 0.95)
+        seed: seed of the random generator
+
+    Returns
+        intervals: array of shape (n_groups, 2) with the lower and upper bound of each group
+    '''
+    rng = np.random.default_rng(seed)
+    n_groups, size = values.shape
+
+    # draw positions of all resamples at once and gather the resampled values
+    positions = rng.integers(0, size, size=(n_groups, n_resamples, size), dtype=np.int32)
+    means = values[np.arange(n_groups)[:, None, None], positions].mean(axis=2)
+
+    alpha = (1 - confidence) / 2
+
+    return np.quantile(means, [alpha, 1 - alpha], axis=1).T
+
+def bootstrap_means(data:pd.DataFrame, group_cols:list, value_col:str, n_resamples:int=1000, confidence:float=0.95, min_count:int=2, seed:int=1999, workers:int=None):
+    '''
+    Function to compute bootstrap confidence intervals of the mean of value_col per group.
+
+    Args
+        data: dataframe with one row per listing
+        group_cols: columns defining the groups (e.g. ["street", "district"])
+        value_col: column to compute intervals of the mean for (rows with missing values or groups are ignored)
+        n_resamples: number of bootstrap resamples per group
+        confidence: confidence level of the intervals
+        min_count: minimum number of values of a group to compute an interval (NaN otherwise, as resampling one value gives no spread)
+        seed: random seed
+        workers: number of worker processes. If None, chunks are computed in the current process
+
+    Returns
+        intervals: dataframe with group_cols, "{value_col}_ci_low" and "{value_col}_ci_high"
+    '''
+    data = data.dropna(subset=group_cols + [value_col])
+
+    # group ids and positions of values sorted by group
+    groups = data.groupby(group_cols, sort=True)
+    group_ids = groups.ngroup().to_numpy()
+    order = np.argsort(group_ids, kind="stable")
+    values = data[value_col].to_numpy(dtype=float)[order]
+
+    sizes = np.bincount(group_ids, minlength=groups.ngroups)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    # split groups into chunks of groups with the same size
+    tasks = []
+    for size in np.unique(sizes[sizes >= min_count]):
+        bucket = np.flatnonzero(sizes == size)
+        chunk_size = max(1, MAX_CHUNK_VALUES // (n_resamples * size))
+
+        for chunk in np.array_split(bucket, np.arange(chunk_size, len(bucket), chunk_size)):
+            tasks.append((chunk, values[starts[chunk][:, None] + np.arange(size)]))
+
+    # one seed per chunk (independent of the number of workers)
+    seeds = np.random.SeedSequence(seed).spawn(len(tasks))
+    args = ([task[1] for task in tasks], [n_resamples] * len(tasks), [confidence] * len(tasks), seeds)
+
+    if workers is None:
+        results = list(map(bootstrap_chunk, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(bootstrap_chunk, *args))
+
+    # collect intervals of all groups (NaN for groups below min_count)
+    bounds = np.full((groups.ngroups, 2), np.nan)
+    for (chunk, _), result in zip(tasks, results):
+        bounds[chunk] = result
+
+    intervals = groups.size().index.to_frame(index=False)
+    intervals[f"{value_col}_ci_low"] = bounds[:, 0]
+    intervals[f"{value_col}_ci_high"] = bounds[:, 1]
+
+    return intervals
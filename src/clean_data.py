@@ -16,7 +16,20 @@ import pandas as pd
 
 import numpy as np
 
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument, log_rows_dropped, emit
+
+# validation of types and values (bad rows are quarantined to a rejects file)
+from validate import validate_listings
+
+# near-duplicate detection (same listing on several sites with slightly different rent or size)
+from deduplicate import collapse_near_duplicates
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
 ## functions ##
+@instrument
 def clean_site_A(data_path:pathlib.Path, zip_codes:pd.DataFrame):
     '''
     Function to clean scraped data from site A using pandas.
@@ -44,16 +57,17 @@ def clean_site_A(data_path:pathlib.Path, zip_codes:pd.DataFrame):
     # extract number of rooms from rooms_type_kvm column
     df["rooms"] = df["rooms_type_kvm"].str.extract(r'(\d+) vær\.')
 
-    # extract size from rooms_type_kvm column, convert to int
+    # extract size from rooms_type_kvm column (converted to int in validate_listings)
     df['square_meters'] = df["rooms_type_kvm"].str.extract(r'(\d+) m²')
-    df['square_meters'] = df['square_meters'].astype(int)
 
     # translate "Lejlighed" to "apartment" and "Værelse" to "room"
     df["rental_type"] = df["rental_type"].str.replace("Lejlighed", "apartment")
     df["rental_type"] = df["rental_type"].str.replace("Værelse", "room")
 
     # filter everything that is not an apartment or a room
+    n_rows = len(df)
     df = df[df["rental_type"].isin(["apartment", "room"])]
+    log_rows_dropped("filter rental_type", n_rows, len(df))
 
     # fix price 
     df["price"] = df["price"].str.replace("kr.", "", regex=False) # remove kr.
@@ -75,7 +89,9 @@ def clean_site_A(data_path:pathlib.Path, zip_codes:pd.DataFrame):
     df["zip_code"] = df["area"].map(zip_codes.set_index("area")["zip_code"])
 
     # rm all rows with missing zip codes as they are not in Aarhus kommune
+    n_rows = len(df)
     df = df.dropna(subset=["zip_code"])
+    log_rows_dropped("dropna zip_code (failed zip code lookup)", n_rows, len(df))
 
     # convert to int
     df["zip_code"] = df["zip_code"].astype(int)
@@ -85,6 +101,7 @@ def clean_site_A(data_path:pathlib.Path, zip_codes:pd.DataFrame):
     
     return df
 
+@instrument
 def clean_site_B(data_path:pathlib.Path, zip_codes:pd.DataFrame):
     '''
     Function to clean scraped data from site B using pandas.
@@ -123,11 +140,12 @@ def clean_site_B(data_path:pathlib.Path, zip_codes:pd.DataFrame):
     df["rental_type"] = df["rental_type"].str.strip()
 
     # print unique values in rental_type column
+    n_rows = len(df)
     df = df[df["rental_type"].isin(["apartment", "room"])]
+    log_rows_dropped("filter rental_type", n_rows, len(df))
 
-    # print type of price 
+    # fix price (converted to int in validate_listings)
     df["price"] = df["price"].str.replace(".", "", regex=False) # remove . in number
-    df["price"] = df["price"].astype(int) # convert to int
 
     # rename price to rent_without_expenses
     df = df.rename(columns={"price": "rent_without_expenses"})
@@ -140,15 +158,15 @@ def clean_site_B(data_path:pathlib.Path, zip_codes:pd.DataFrame):
     df["street"] = df["address"].str.split(",").str[0]
     df["street"] = df["street"].str.strip()
 
-    # add zip code column, convert to int
+    # add zip code column (areas not in lookup are rejected in validate_listings)
     df["zip_code"] = df["area"].map(zip_codes.set_index("area")["zip_code"])
-    df["zip_code"] = df["zip_code"].astype(int)
 
     # select cols
     df = df[["website", "year", "rental_type", "rent_without_expenses", "square_meters", "zip_code", "street", "area", "rooms"]]
 
     return df
 
+@instrument
 def clean_site_C(data_path:pathlib.Path):
     '''
     Function to clean scraped data from site C using pandas.
@@ -163,8 +181,7 @@ def clean_site_C(data_path:pathlib.Path):
     # read in data
     df = pd.read_csv(data_path / "rental_scrape_C.csv")
 
-    # remove first row which contains weird address
-    df = df.iloc[1:]
+    # NB. project listings with several units (e.g. "11.500 - 18.000 kr./md.", "95 - 135 m²") are rejected in validate_listings
 
     # add website column (random ID)
     df["website"] = "Site C"
@@ -199,6 +216,7 @@ def clean_site_C(data_path:pathlib.Path):
 
     return df
 
+@instrument
 def clean_site_D(data_path:pathlib.Path, zip_codes):
     '''
     Function to clean scraped data from site D using pandas.
@@ -252,6 +270,7 @@ def clean_site_D(data_path:pathlib.Path, zip_codes):
 
     return df
 
+@instrument
 def fix_spelling_streetnames(df:pd.DataFrame):
     '''
     Function to manually fix streetnames in dataframe to correspond to the streetnames in "streetnames.geojson"
@@ -274,6 +293,7 @@ def fix_spelling_streetnames(df:pd.DataFrame):
 
     return df     
 
+@instrument
 def clean_all_data(data_path:pathlib.Path, zip_codes:pd.DataFrame, save_path:pathlib.Path=None):
     '''
     Function to clean all data using pandas.
@@ -285,6 +305,11 @@ def clean_all_data(data_path:pathlib.Path, zip_codes:pd.DataFrame, save_path:pat
     
     Output:
         clean_all_data.csv: Cleaned data. If save_path is not None.
+        duplicate_counts.csv: Number of near-duplicates per pair of sites. If save_path is not None.
+        rejected_rows.csv: Rows failing validation with the reason. If save_path is not None.
+
+    Returns:
+        all_df: Cleaned data.
     '''
 
     # site A
@@ -311,8 +336,19 @@ def clean_all_data(data_path:pathlib.Path, zip_codes:pd.DataFrame, save_path:pat
     # remove accents
     all_df["street"] = all_df["street"].str.replace('é', 'e')
 
+    # quarantine rows with unparseable or implausible values (converts numeric columns to int)
+    all_df, rejects = validate_listings(all_df, zip_codes)
+
     # remove duplicates, consider everything but website and year
+    n_rows = len(all_df)
     all_df = all_df.drop_duplicates(subset=["year", "rental_type", "rent_without_expenses", "square_meters", "zip_code", "street", "area", "rooms"])
+    log_rows_dropped("drop_duplicates", n_rows, len(all_df))
+
+    # collapse near-duplicates across sites (rent within 2%, size within 2 m²), count duplicates per pair of sites
+    n_rows = len(all_df)
+    all_df, duplicate_counts = collapse_near_duplicates(all_df, rent_tolerance=0.02, sqm_tolerance=2)
+    log_rows_dropped("collapse near-duplicates", n_rows, len(all_df))
+    emit("near_duplicates", site_pairs=duplicate_counts.to_dict(orient="records"))
 
     # add id column
     all_df["id"] = all_df.index
@@ -334,19 +370,20 @@ def clean_all_data(data_path:pathlib.Path, zip_codes:pd.DataFrame, save_path:pat
     # save data
     if save_path is not None:
         all_df.to_csv(save_path / "cleaned_data.csv", index=False)
+        duplicate_counts.to_csv(save_path / "duplicate_counts.csv", index=False)
+        rejects.to_csv(save_path / "rejected_rows.csv", index=False)
+
+    return all_df
 
 
 ## run script ##
 def main(): 
-    # path to file 
-    path = pathlib.Path(__file__)
-
-    # define paths
-    data_path = path.parents[1] / "data" / "scrape_data"
-    zip_codes_path = path.parents[1] / "data" / "geo_data"
+    # define paths from configuration of default municipality
+    paths = get_municipality()["paths"]
+    data_path = paths["scrape_data"]
 
     # read in zip codes dataframe from geodata folder
-    zip_codes = pd.read_csv(zip_codes_path / "zipcode_lookup.csv")
+    zip_codes = pd.read_csv(paths["zip_codes"])
 
     # clean data
     clean_all_data(data_path, zip_codes, data_path)
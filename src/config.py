@@ -0,0 +1,75 @@
+'''
+Functions for reading the municipality configuration (data/municipalities.json).
+
+Each municipality is a partition of the pipeline with its own scrape data, geo layers, lookup tables and results folder.
+Paths in the configuration are relative to the root of the repository. New municipalities are added as an entry in the
+configuration, conventionally with inputs in data/<key>/ and outputs in results/<key>/ (Aarhus keeps its original locations).
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import json
+import pathlib
+
+# root of repository and default location of configuration
+ROOT = pathlib.Path(__file__).parents[1]
+CONFIG_PATH = ROOT / "data" / "municipalities.json"
+
+def load_config(config_path:pathlib.Path=CONFIG_PATH):
+    '''
+    Function to load the municipality configuration.
+
+    Args:
+        config_path: path to configuration file. Defaults to data/municipalities.json
+
+    Returns:
+        config: dict with "default" (key of default municipality) and "municipalities" (dict with one entry per municipality)
+    '''
+    with open(config_path, encoding="utf-8") as f:
+        config = json.load(f)
+
+    return config
+
+def list_municipalities(config_path:pathlib.Path=CONFIG_PATH):
+    '''
+    Function to list the municipalities in the configuration.
+
+    Returns:
+        municipalities: dict with key and display name of each municipality (default municipality first)
+    '''
+    config = load_config(config_path)
+
+    # put default municipality first
+    keys = sorted(config["municipalities"], key=lambda key: key != config["default"])
+
+    return {key: config["municipalities"][key]["name"] for key in keys}
+
+def get_municipality(key:str=None, config_path:pathlib.Path=CONFIG_PATH):
+    '''
+    Function to get the configuration of a municipality with paths resolved relative to the repository.
+
+    Args:
+        key: key of municipality (e.g. "aarhus"). Defaults to the default municipality of the configuration
+        config_path: path to configuration file
+
+    Returns:
+        municipality: dict with "key", "name", "crs", "paths" (pathlib.Path per input/output), "central_districts",
+                      "missing_districts", "missing_streets" and optionally "excluded_streets" and "district_zoom_levels"
+    '''
+    config = load_config(config_path)
+
+    # use default municipality if none is given
+    if key is None:
+        key = config["default"]
+
+    if key not in config["municipalities"]:
+        raise KeyError(f"Municipality '{key}' not found in {config_path}. Available: {list(config['municipalities'])}")
+
+    municipality = dict(config["municipalities"][key], key=key)
+
+    # resolve paths relative to root of repository
+    municipality["paths"] = {name: ROOT / path for name, path in municipality["paths"].items()}
+
+    return municipality
@@ -0,0 +1,150 @@
+'''
+Functions for detecting near-duplicate listings, i.e. the same apartment posted on several sites with a slightly different rent or size
+(e.g. 8.900 kr. and 100 m² on one site, 8.950 kr. and 101 m² on another). Used in clean_data.py after exact duplicates are dropped.
+
+Listings are only compared within blocks of listings with the same year, rental type, zip code, street and number of rooms.
+Within a block, listings are sorted by rent, so listings within the rent tolerance of each other are neighbours in the sorted order.
+Each listing is compared with its next neighbours (vectorized over all blocks at once) until no listing has a neighbour within the rent
+tolerance, so the run time is roughly linear in the number of listings. Pairs of listings from different sites which are also within the
+square meter tolerance are candidates. Candidates which are the closest candidate of both listings with the other's site are paired (repeated
+for the remaining candidates), so each listing is paired with at most one listing of every other site. Of each pair, the listing from the site with lower priority is dropped.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# data wrangling
+import pandas as pd
+import numpy as np
+
+# columns a duplicate must match exactly
+BLOCK_COLS = ["year", "rental_type", "zip_code", "street", "rooms"]
+
+def find_near_duplicates(df:pd.DataFrame, rent_tolerance:float=0.02, sqm_tolerance:int=2, cross_site_only:bool=True):
+    '''
+    Function to find pairs of near-duplicate listings.
+
+    Args:
+        df: cleaned listings (with BLOCK_COLS, "website", "rent_without_expenses" and "square_meters")
+        rent_tolerance: maximum difference in rent relative to the higher rent (e.g. 0.02 for 2%)
+        sqm_tolerance: maximum difference in square meters
+        cross_site_only: only pair listings from different sites (units in the same building posted on one site often only differ slightly)
+
+    Returns:
+        pairs: dataframe with the positions (first, second) of the listings in df of every duplicate pair
+    '''
+    # normalize block columns (types differ between sites)
+    blocks = pd.DataFrame({col: df[col].astype(str).str.strip().str.lower() for col in BLOCK_COLS})
+    block = blocks.groupby(BLOCK_COLS, sort=False).ngroup().to_numpy()
+
+    # parse numbers, listings without rent or size are never duplicates
+    rent = pd.to_numeric(df["rent_without_expenses"], errors="coerce").to_numpy(dtype=float)
+    sqm = pd.to_numeric(df["square_meters"], errors="coerce").to_numpy(dtype=float)
+    site = df["website"].astype(str).to_numpy()
+
+    # sort by block, then by rent (missing rents last)
+    order = np.lexsort((rent, block))
+    s_block, s_rent, s_sqm, s_site = block[order], rent[order], sqm[order], site[order]
+
+    firsts, seconds = [], []
+    lag = 1
+
+    while lag < len(order):
+        # compare every listing with the listing lag positions later in the sorted order
+        same_block = s_block[lag:] == s_block[:-lag]
+        within_rent = same_block & (s_rent[lag:] - s_rent[:-lag] <= rent_tolerance * s_rent[lag:])
+
+        # stop when no listing has a neighbour this far away within the rent tolerance (rents are sorted)
+        if not within_rent.any():
+            break
+
+        is_pair = within_rent & (np.abs(s_sqm[lag:] - s_sqm[:-lag]) <= sqm_tolerance)
+
+        if cross_site_only:
+            is_pair &= s_site[lag:] != s_site[:-lag]
+
+        positions = np.flatnonzero(is_pair)
+        firsts.append(order[positions])
+        seconds.append(order[positions + lag])
+
+        lag += 1
+
+    pairs = pd.DataFrame({
+        "first": np.concatenate(firsts) if firsts else np.zeros(0, dtype=int),
+        "second": np.concatenate(seconds) if seconds else np.zeros(0, dtype=int),
+    })
+
+    # distance of pairs relative to the tolerances (0 for identical rent and size)
+    first, second = pairs["first"].to_numpy(), pairs["second"].to_numpy()
+    distance = (1 - rent[first] / rent[second]) / max(rent_tolerance, 1e-9) + np.abs(sqm[first] - sqm[second]) / max(sqm_tolerance, 1e-9)
+
+    # each pair seen from both of its listings: the listing and the site of the other listing
+    ends = pd.DataFrame({
+        "pair": np.tile(np.arange(len(pairs)), 2),
+        "listing": np.concatenate([first, second]),
+        "other_site": np.concatenate([site[second], site[first]]),
+        "distance": np.tile(distance, 2),
+    })
+
+    # keep pairs which are the closest pair of both listings with the other's site (mutual best match), in rounds:
+    # pairs of listings already paired with that site are removed and the mutual best matches of the rest are found again.
+    # This pairs similar units in one building posted on two sites one to one instead of chaining them together
+    is_best = np.zeros(len(pairs), dtype=bool)
+
+    while len(ends) > 0:
+        # closest pair of every listing with each other site (ties broken by position of the pair)
+        best = ends.sort_values(["distance", "pair"], kind="stable").drop_duplicates(["listing", "other_site"])
+        n_best = best["pair"].value_counts()
+        matched = n_best.index[n_best == 2].to_numpy()
+        is_best[matched] = True
+
+        # remove all pairs of listings which are now paired with the other's site
+        taken = ends[ends["pair"].isin(matched)][["listing", "other_site"]]
+        ends = ends[~ends["pair"].isin(ends.merge(taken, on=["listing", "other_site"])["pair"])]
+
+    return pairs[is_best].reset_index(drop=True)
+
+def site_pair_counts(df:pd.DataFrame, pairs:pd.DataFrame):
+    '''
+    Function to count duplicate pairs per pair of sites.
+
+    Args:
+        df: listings the pairs were found in
+        pairs: duplicate pairs from find_near_duplicates
+
+    Returns:
+        counts: dataframe with site_1, site_2 (alphabetically ordered) and n_duplicates
+    '''
+    site = df["website"].astype(str).to_numpy()
+    first, second = site[pairs["first"]], site[pairs["second"]]
+
+    counts = pd.DataFrame({"site_1": np.minimum(first, second), "site_2": np.maximum(first, second)})
+    counts = counts.value_counts().rename("n_duplicates").reset_index()
+
+    return counts.sort_values(["site_1", "site_2"]).reset_index(drop=True)
+
+def collapse_near_duplicates(df:pd.DataFrame, rent_tolerance:float=0.02, sqm_tolerance:int=2):
+    '''
+    Function to collapse near-duplicate listings into one listing. Of each duplicate pair, the listing from the site appearing first in df is kept
+    (i.e. sites are prioritized in the order they are concatenated in), so distinct units on one site are never collapsed into each other.
+
+    Args:
+        df: cleaned listings
+        rent_tolerance: maximum difference in rent relative to the higher rent
+        sqm_tolerance: maximum difference in square meters
+
+    Returns:
+        df: listings without near-duplicates
+        counts: dataframe with duplicate pairs per pair of sites (see site_pair_counts)
+    '''
+    pairs = find_near_duplicates(df, rent_tolerance, sqm_tolerance)
+
+    # rank sites by order of appearance
+    priority = pd.factorize(df["website"].astype(str))[0]
+    first, second = pairs["first"].to_numpy(), pairs["second"].to_numpy()
+
+    # flag listing from site with lower priority in each pair
+    is_duplicate = np.zeros(len(df), dtype=bool)
+    is_duplicate[np.where(priority[first] > priority[second], first, second)] = True
+
+    return df[~is_duplicate].copy(), site_pair_counts(df, pairs)
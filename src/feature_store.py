@@ -0,0 +1,186 @@
+'''
+Functions for a compact binary store of the district and street aggregates which the app opens memory-mapped.
+
+The store is written by aggregate_data.py as a folder per layer (results/features/districts and results/features/streets):
+    manifest.json                       column names and types, number of rows and crs
+    {col}.npy                           one NumPy array per numeric column
+    {col}.strings, {col}.offsets.npy    string columns as one UTF-8 blob with the start of each string (string table)
+    geometry.wkb, geometry.offsets.npy  geometries as one blob of WKB with the start of each geometry
+
+The app opens the files with np.memmap instead of reading them into memory, so all Streamlit worker processes on a machine share
+the pages through the OS page cache, and rows (e.g. a selected street) and columns are decoded only when they are needed.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import json
+import pathlib
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+
+def write_blob(values:list, path:pathlib.Path):
+    '''
+    Function to write a list of bytes as one blob with offsets (offsets[i] is the start of value i, offsets[-1] the end of the blob).
+
+    Args
+        values: list of bytes
+        path: path of the blob (offsets are saved to path with suffix .offsets.npy)
+    '''
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in values])
+
+    path.write_bytes(b"".join(values))
+    np.save(path.with_suffix(".offsets.npy"), offsets)
+
+def open_blob(path:pathlib.Path):
+    '''
+    Function to open a blob written with write_blob memory-mapped.
+
+    Args
+        path: path of the blob
+
+    Returns
+        blob: memory-mapped uint8 array (empty array for an empty blob, which cannot be memory-mapped)
+        offsets: memory-mapped int64 array of offsets
+    '''
+    offsets = np.load(path.with_suffix(".offsets.npy"), mmap_mode="r")
+    blob = np.memmap(path, dtype=np.uint8, mode="r") if offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    return blob, offsets
+
+def read_blob(blob:np.ndarray, offsets:np.ndarray, rows=None):
+    '''
+    Function to read values of a blob.
+
+    Args
+        blob: blob from open_blob
+        offsets: offsets from open_blob
+        rows: positions of values to read (defaults to all)
+
+    Returns
+        values: list of bytes
+    '''
+    rows = np.arange(len(offsets) - 1) if rows is None else np.atleast_1d(rows)
+
+    return [blob[offsets[row]:offsets[row + 1]].tobytes() for row in rows]
+
+def save_feature_store(data:pd.DataFrame, save_path:pathlib.Path, geometry_col:str="geometry", crs=25832):
+    '''
+    Function to save aggregates as a feature store.
+
+    Args
+        data: aggregates with geometry as wkt or shapely geometries
+        save_path: folder to save the store to (e.g. results/features/streets)
+        geometry_col: name of the geometry column
+        crs: crs of the geometry (defaults to 25832 as this is the crs for Denmark)
+
+    Outputs
+        manifest.json, one .npy per numeric column, a string table per string column and geometry.wkb (see module docstring)
+    '''
+    save_path.mkdir(parents=True, exist_ok=True)
+
+    manifest = {"n_rows": len(data), "crs": crs, "columns": [], "numeric": {}, "strings": []}
+
+    for col in data.columns.drop(geometry_col):
+        manifest["columns"].append(col)
+
+        # numeric columns as arrays
+        if pd.api.types.is_numeric_dtype(data[col]):
+            values = data[col].to_numpy()
+            np.save(save_path / f"{col}.npy", values)
+            manifest["numeric"][col] = str(values.dtype)
+
+        # other columns (e.g. names and lists of neighbors) as string table, missing values as empty strings
+        else:
+            write_blob([str(value).encode("utf-8") for value in data[col].fillna("")], save_path / f"{col}.strings")
+            manifest["strings"].append(col)
+
+    # encode geometries as wkb
+    geometry = data[geometry_col]
+
+    if not isinstance(geometry, gpd.GeoSeries):
+        geometry = gpd.GeoSeries.from_wkt(geometry)
+
+    write_blob(list(geometry.to_wkb()), save_path / "geometry.wkb")
+
+    # write manifest last, so a store is only opened once it is complete
+    with open(save_path / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+def open_feature_store(store_path:pathlib.Path):
+    '''
+    Function to open a feature store memory-mapped (no data is read until it is accessed).
+
+    Args
+        store_path: folder of the store
+
+    Returns
+        store: dict with "manifest", "numeric" (memory-mapped array per column), "strings" ((blob, offsets) per column) and "geometry" (blob, offsets)
+    '''
+    with open(store_path / "manifest.json", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    store = {
+        "manifest": manifest,
+        "numeric": {col: np.load(store_path / f"{col}.npy", mmap_mode="r") for col in manifest["numeric"]},
+        "strings": {col: open_blob(store_path / f"{col}.strings") for col in manifest["strings"]},
+        "geometry": open_blob(store_path / "geometry.wkb"),
+    }
+
+    return store
+
+def get_column(store:dict, col:str, rows=None):
+    '''
+    Function to read a column of the store.
+
+    Args
+        store: feature store from open_feature_store
+        col: name of column
+        rows: positions of rows to read (defaults to all)
+
+    Returns
+        values: numpy array (numeric columns are copied out of the memory map, string columns are decoded)
+    '''
+    if col in store["numeric"]:
+        values = store["numeric"][col]
+        return np.array(values if rows is None else values[rows])
+
+    return np.array([value.decode("utf-8") for value in read_blob(*store["strings"][col], rows)], dtype=object)
+
+def find_rows(store:dict, col:str, values:list):
+    '''
+    Function to find the positions of rows where a column takes one of the values (e.g. the selected street).
+
+    Args
+        store: feature store from open_feature_store
+        col: name of column
+        values: values to find
+
+    Returns
+        rows: array of positions
+    '''
+    return np.flatnonzero(np.isin(get_column(store, col), values))
+
+def to_geodataframe(store:dict, columns:list=None, rows=None):
+    '''
+    Function to decode (part of) the store as a GeoDataFrame.
+
+    Args
+        store: feature store from open_feature_store
+        columns: columns to include besides geometry (defaults to all)
+        rows: positions of rows to include (defaults to all)
+
+    Returns
+        gdf: GeoDataFrame with the columns and "geometry"
+    '''
+    columns = store["manifest"]["columns"] if columns is None else columns
+
+    data = {col: get_column(store, col, rows) for col in columns}
+    geometry = gpd.GeoSeries.from_wkb(read_blob(*store["geometry"], rows), crs=store["manifest"]["crs"])
+
+    return gpd.GeoDataFrame(data, geometry=geometry)
@@ -0,0 +1,224 @@
+'''
+Script to aggregate the listings on a regular grid of hexagonal or square cells at several resolutions (a grid pyramid).
+
+District and street aggregates follow administrative boundaries whose sizes vary greatly. The grid aggregates instead assign every listing
+to equally sized cells, placing each listing at the midpoint of its street (the listings only have street geometry).
+The cells of all resolutions are computed at once (cell coordinates of every listing at every cell size, stacked) and aggregated in a single groupby.
+
+Each resolution is shown at a range of zoom levels (GRID_LEVELS), so the app and the vector tiles (make_tiles.py) show finer cells when zoomed in.
+The pyramid is saved as results/grid_aggregates.csv with one row per cell and its geometry as wkt (as the other aggregates).
+
+To aggregate the default municipality on a hexagonal grid, type:
+    python src/grid_aggregates.py
+
+To use a square grid instead, type:
+    python src/grid_aggregates.py --grid square
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import argparse
+import pathlib
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument, log_rows_dropped
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
+# width of the cells in meters (side of squares, distance between opposite edges of hexagons) and the zoom levels each is shown at
+GRID_LEVELS = {
+    1000: (10, 11),
+    500: (12, 12),
+    250: (13, 13),
+    125: (14, 16),
+}
+
+def input_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grid", type=str, default="hex", choices=["hex", "square"], help="shape of the grid cells")
+
+    return parser.parse_args()
+
+def street_points(geometry_street:pd.Series, crs=25832):
+    '''
+    Function to get a point per listing at the midpoint of its street (each unique street geometry is only parsed once).
+
+    Args
+        geometry_street: street geometry of each listing as wkt
+        crs: crs of the geometry (defaults to 25832 as this is the crs for Denmark)
+
+    Returns
+        x, y: arrays with the coordinates of each listing
+    '''
+    codes, uniques = pd.factorize(geometry_street)
+
+    # midpoint along the street (on the street, unlike the centroid of a curved street)
+    streets = gpd.GeoSeries.from_wkt(np.asarray(uniques), crs=crs)
+    midpoints = streets.interpolate(0.5, normalized=True)
+
+    return midpoints.x.to_numpy()[codes], midpoints.y.to_numpy()[codes]
+
+def square_cells(x:np.ndarray, y:np.ndarray, cell_size:float):
+    '''
+    Function to get the square cell of points (column i, row j).
+    '''
+    return np.floor(x / cell_size).astype(np.int64), np.floor(y / cell_size).astype(np.int64)
+
+def hex_cells(x:np.ndarray, y:np.ndarray, cell_size:float):
+    '''
+    Function to get the hexagonal cell of points in axial coordinates (q, r) of a pointy-top hexagonal grid, by rounding cube coordinates.
+    '''
+    radius = cell_size / np.sqrt(3)
+
+    # fractional axial coordinates
+    q = (np.sqrt(3) / 3 * x - y / 3) / radius
+    r = (2 / 3 * y) / radius
+    s = -q - r
+
+    # round cube coordinates and fix the coordinate with the largest rounding error (q + r + s = 0)
+    q_round, r_round, s_round = np.round(q), np.round(r), np.round(s)
+    q_diff, r_diff, s_diff = np.abs(q_round - q), np.abs(r_round - r), np.abs(s_round - s)
+
+    fix_q = (q_diff > r_diff) & (q_diff > s_diff)
+    fix_r = ~fix_q & (r_diff > s_diff)
+
+    q_round = np.where(fix_q, -r_round - s_round, q_round)
+    r_round = np.where(fix_r, -q_round - s_round, r_round)
+
+    return q_round.astype(np.int64), r_round.astype(np.int64)
+
+def cell_polygons(grid:str, cell_size:float, i:np.ndarray, j:np.ndarray):
+    '''
+    Function to get the polygons of cells.
+
+    Args
+        grid: "hex" or "square"
+        cell_size: width of the cells
+        i, j: cell coordinates (from hex_cells or square_cells)
+
+    Returns
+        polygons: array of shapely polygons
+    '''
+    if grid == "hex":
+        radius = cell_size / np.sqrt(3)
+
+        # centers and corners of pointy-top hexagons
+        center_x = radius * np.sqrt(3) * (i + j / 2)
+        center_y = radius * 1.5 * j
+        angles = np.radians(30 + 60 * np.arange(7))
+
+        corners_x = center_x[:, None] + radius * np.cos(angles)
+        corners_y = center_y[:, None] + radius * np.sin(angles)
+
+    else:
+        corners_x = (i[:, None] + np.array([0, 1, 1, 0, 0])) * cell_size
+        corners_y = (j[:, None] + np.array([0, 0, 1, 1, 0])) * cell_size
+
+    return shapely.polygons(np.stack([corners_x, corners_y], axis=-1))
+
+@instrument
+def get_grid_aggregates(complete_data:pd.DataFrame, grid:str="hex", levels:dict=GRID_LEVELS, crs=25832):
+    '''
+    Function to aggregate the current (2023) listings on a grid at several resolutions.
+
+    Args
+        complete_data: complete pandas dataframe with geometry_street as wkt
+        grid: "hex" or "square"
+        levels: cell sizes in meters and the (min, max) zoom levels they are shown at
+        crs: crs of the geometry (defaults to 25832 as this is the crs for Denmark)
+
+    Returns
+        grid_data: geodataframe with one row per cell and level: "grid", "cell_size", "min_zoom", "max_zoom", cell coordinates "i" and "j",
+                   "count" (listings), "apartment_count", "apartment_rent_sqm_now", "room_count", "room_rent_now" and geometry
+    '''
+    listings = complete_data[complete_data["year"] == 2023].dropna(subset=["geometry_street"])
+    log_rows_dropped("dropna geometry_street", (complete_data["year"] == 2023).sum(), len(listings))
+
+    x, y = street_points(listings["geometry_street"], crs)
+
+    # values to average (NaN for listings of the other rental type)
+    apartment = (listings["rental_type"] == "apartment").to_numpy()
+    apartment_rent = np.where(apartment, listings["rent_per_square_meter"].to_numpy(dtype=float), np.nan)
+    room_rent = np.where(~apartment & (listings["rental_type"] == "room").to_numpy(), listings["rent_without_expenses"].to_numpy(dtype=float), np.nan)
+
+    # cell of every listing at every level, stacked
+    to_cells = hex_cells if grid == "hex" else square_cells
+    cell_sizes = list(levels)
+
+    cells = [to_cells(x, y, cell_size) for cell_size in cell_sizes]
+
+    stacked = pd.DataFrame({
+        "cell_size": np.repeat(cell_sizes, len(listings)),
+        "i": np.concatenate([i for i, _ in cells]),
+        "j": np.concatenate([j for _, j in cells]),
+        "apartment_rent_sqm_now": np.tile(apartment_rent, len(cell_sizes)),
+        "room_rent_now": np.tile(room_rent, len(cell_sizes)),
+    })
+
+    # aggregate all levels in one groupby
+    grid_data = stacked.groupby(["cell_size", "i", "j"]).agg(
+        count=("apartment_rent_sqm_now", "size"),
+        apartment_count=("apartment_rent_sqm_now", "count"),
+        apartment_rent_sqm_now=("apartment_rent_sqm_now", "mean"),
+        room_count=("room_rent_now", "count"),
+        room_rent_now=("room_rent_now", "mean"),
+    ).reset_index()
+
+    grid_data = grid_data.round({"apartment_rent_sqm_now": 1, "room_rent_now": 1})
+
+    # add grid, zoom levels and polygons of each level
+    grid_data.insert(0, "grid", grid)
+    grid_data["min_zoom"] = grid_data["cell_size"].map({cell_size: zoom[0] for cell_size, zoom in levels.items()})
+    grid_data["max_zoom"] = grid_data["cell_size"].map({cell_size: zoom[1] for cell_size, zoom in levels.items()})
+
+    geometry = np.empty(len(grid_data), dtype=object)
+
+    for cell_size, rows in grid_data.groupby("cell_size").indices.items():
+        geometry[rows] = cell_polygons(grid, cell_size, grid_data["i"].to_numpy()[rows], grid_data["j"].to_numpy()[rows])
+
+    grid_data = gpd.GeoDataFrame(grid_data, geometry=geometry, crs=crs)
+
+    return grid_data
+
+def save_grid_aggregates(grid_data:gpd.GeoDataFrame, save_path:pathlib.Path):
+    '''
+    Function to save the grid aggregates with geometry as wkt.
+
+    Args
+        grid_data: grid aggregates from get_grid_aggregates
+        save_path: path to save the aggregates to
+
+    Outputs
+        grid_aggregates.csv: one row per cell and level
+    '''
+    grid_data.to_wkt().to_csv(save_path / "grid_aggregates.csv", index=False)
+
+
+def main():
+    args = input_parse()
+
+    # define paths from configuration of default municipality
+    municipality = get_municipality()
+    paths = municipality["paths"]
+
+    # read complete data
+    complete_data = pd.read_csv(paths["complete_data"])
+
+    # aggregate on grid and save
+    grid_data = get_grid_aggregates(complete_data, args.grid, crs=municipality["crs"])
+    save_grid_aggregates(grid_data, paths["results"])
+
+    print(f"[INFO:] Aggregated listings in {len(grid_data)} {args.grid} cells at {grid_data['cell_size'].nunique()} resolutions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+'''
+Script to fit a hedonic rent model on the complete data and functions to predict the rent of (hypothetical) listings with it.
+
+The model is a ridge regression of the log rent on the log size and fixed effects of rooms, rental type, year, district and street:
+    log(rent) = intercept + b * log(square meters) + rooms + rental_type + year + district + street
+
+The fixed effects are one-hot encoded in a sparse design matrix and solved in closed form from the (sparse) normal equations.
+The penalty shrinks the effects of streets with few listings towards zero, i.e. towards the rent of their district.
+Coefficients are saved to results/hedonic_model.npz, so the app can estimate a "fair rent" without reading the listings.
+Predictions are vectorized over listings (unique levels are looked up with a hash index and the effects summed), so thousands of listings are scored in about a millisecond.
+
+To fit the model for the default municipality, type:
+    python src/hedonic_model.py
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+
+# data wrangling
+import pandas as pd
+import numpy as np
+
+# sparse design matrix and solver
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument, emit
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
+# columns with fixed effects (in the order of the design matrix)
+EFFECT_COLS = ["rooms", "rental_type", "year", "district", "street"]
+
+def design_matrix(log_sqm:np.ndarray, codes:dict, n_levels:dict):
+    '''
+    Function to build the sparse design matrix (intercept, log size and one column per level of each fixed effect).
+
+    Args
+        log_sqm: centered log square meters of the listings
+        codes: positions of the levels of each listing per column in EFFECT_COLS
+        n_levels: number of levels per column in EFFECT_COLS
+
+    Returns
+        X: scipy csr_matrix of shape (n_listings, 2 + total number of levels)
+    '''
+    n_rows = len(log_sqm)
+
+    # every row has an entry for the intercept, the log size and one level of each fixed effect
+    columns = [np.zeros(n_rows, dtype=np.int64), np.ones(n_rows, dtype=np.int64)]
+    values = [np.ones(n_rows), log_sqm]
+
+    offset = 2
+    for col in EFFECT_COLS:
+        columns.append(codes[col] + offset)
+        values.append(np.ones(n_rows))
+        offset += n_levels[col]
+
+    X = sparse.csr_matrix((np.column_stack(values).ravel(), np.column_stack(columns).ravel(), np.arange(0, n_rows * len(columns) + 1, len(columns))), shape=(n_rows, offset))
+
+    return X
+
+@instrument
+def fit_hedonic_model(complete_data:pd.DataFrame, alpha:float=1.0):
+    '''
+    Function to fit the hedonic rent model.
+
+    Args
+        complete_data: complete pandas dataframe (listings with rent_without_expenses, square_meters and the columns in EFFECT_COLS)
+        alpha: ridge penalty of the fixed effects (the intercept and the log size are not penalized)
+
+    Returns
+        model: dict with "intercept", "log_sqm" (coefficient), "log_sqm_center", "smearing" (to convert predicted log rents back to rents),
+               "{col}_levels" and "{col}_effects" per column in EFFECT_COLS and the fit statistics "n_listings", "r2" and "rmse_log"
+    '''
+    data = complete_data.dropna(subset=["rent_without_expenses", "square_meters"] + EFFECT_COLS)
+
+    # response and centered log size
+    y = np.log(data["rent_without_expenses"].to_numpy(dtype=float))
+    log_sqm = np.log(data["square_meters"].to_numpy(dtype=float))
+    log_sqm_center = log_sqm.mean()
+
+    # encode levels of fixed effects as positions
+    model = {}
+    codes, n_levels = {}, {}
+
+    for col in EFFECT_COLS:
+        categorical = pd.Categorical(data[col].astype(str))
+        model[f"{col}_levels"] = categorical.categories.to_numpy(dtype=str)
+        codes[col] = categorical.codes.astype(np.int64)
+        n_levels[col] = len(categorical.categories)
+
+    X = design_matrix(log_sqm - log_sqm_center, codes, n_levels)
+
+    # solve the normal equations (X'X + alpha * I) b = X'y, without penalizing the intercept and the log size
+    penalty = np.full(X.shape[1], alpha, dtype=float)
+    penalty[:2] = 0
+
+    coefs = spsolve((X.T @ X + sparse.diags(penalty)).tocsc(), X.T @ y)
+
+    # fit statistics and smearing estimate (mean of exponentiated residuals) for unbiased rents
+    residuals = y - X @ coefs
+
+    model.update({
+        "intercept": coefs[0],
+        "log_sqm": coefs[1],
+        "log_sqm_center": log_sqm_center,
+        "smearing": np.mean(np.exp(residuals)),
+        "n_listings": len(y),
+        "r2": 1 - residuals.var() / y.var(),
+        "rmse_log": np.sqrt(np.mean(residuals ** 2)),
+    })
+
+    # split coefficients into the effects of each column
+    offset = 2
+    for col in EFFECT_COLS:
+        model[f"{col}_effects"] = coefs[offset:offset + n_levels[col]]
+        offset += n_levels[col]
+
+    emit("hedonic_model", n_listings=len(y), n_coefficients=X.shape[1], r2=round(float(model["r2"]), 3), rmse_log=round(float(model["rmse_log"]), 3))
+
+    return model
+
+def save_hedonic_model(model:dict, save_path:pathlib.Path):
+    '''
+    Function to save the coefficients of the hedonic model.
+
+    Args
+        model: model from fit_hedonic_model
+        save_path: path to save the model to
+
+    Outputs
+        hedonic_model.npz: coefficients, levels and fit statistics (see fit_hedonic_model)
+    '''
+    np.savez(save_path / "hedonic_model.npz", **model)
+
+def load_hedonic_model(model_path:pathlib.Path):
+    '''
+    Function to load the hedonic model.
+
+    Args
+        model_path: path to hedonic_model.npz
+
+    Returns
+        model: dict with coefficients and levels (scalars as floats)
+    '''
+    with np.load(model_path) as arrays:
+        model = {key: arrays[key] if arrays[key].ndim > 0 else arrays[key].item() for key in arrays.files}
+
+    # index of levels per column for fast lookups
+    for col in EFFECT_COLS:
+        model[f"{col}_index"] = pd.Index(model[f"{col}_levels"])
+
+    return model
+
+def predict(model:dict, listings):
+    '''
+    Function to predict the monthly rent (without expenses) of listings.
+    Levels not seen in the fit (e.g. a new street) and columns left out of listings get no effect, i.e. the average of the other columns.
+
+    Args
+        model: model from fit_hedonic_model or load_hedonic_model
+        listings: dataframe or dict of arrays with "square_meters" and optionally the columns in EFFECT_COLS (e.g. rooms as "1", ..., "4+", year as 2023)
+
+    Returns
+        rent: array of predicted rents in DKK
+    '''
+    log_sqm = np.log(np.asarray(listings["square_meters"], dtype=float))
+    log_rent = model["intercept"] + model["log_sqm"] * (log_sqm - model["log_sqm_center"])
+
+    for col in EFFECT_COLS:
+        if col not in listings:
+            continue
+
+        # look up the unique values only (listings often share a street or size), -1 for unseen or missing values
+        index = pd.Index(model.get(f"{col}_index", model[f"{col}_levels"]))
+        value_codes, uniques = pd.factorize(np.asarray(listings[col]))
+        codes = np.append(index.get_indexer(np.asarray(uniques).astype(str)), -1)[value_codes]
+
+        # add effects (-1 picks the appended zero effect)
+        log_rent = log_rent + np.append(model[f"{col}_effects"], 0)[codes]
+
+    return np.exp(log_rent) * model["smearing"]
+
+
+def main():
+    # define paths from configuration of default municipality
+    paths = get_municipality()["paths"]
+
+    # read complete data
+    complete_data = pd.read_csv(paths["complete_data"])
+
+    # fit and save model
+    model = fit_hedonic_model(complete_data)
+    save_hedonic_model(model, paths["results"])
+
+    print(f"[INFO:] Fitted hedonic rent model on {model['n_listings']} listings (R2 of log rent: {model['r2']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+'''
+Lightweight instrumentation of the pipeline stages in src/.
+
+Public functions of the pipeline scripts are wrapped with the @instrument decorator, which emits one structured JSON log line per call with
+wall time, rows in/out and peak RSS. Rows dropped within a stage (e.g., by dropna or drop_duplicates) are logged with log_rows_dropped.
+
+Logs are written to stderr through the "rentmapper" logger. Set the environment variable RENTMAPPER_PROFILE_DIR to a folder to additionally
+dump a cProfile file per (outermost) stage, which can be inspected with e.g. "python -m pstats" or snakeviz.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import os
+import sys
+import json
+import time
+import pathlib
+import logging
+import functools
+import contextlib
+import cProfile
+
+# resource is not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# logger writing one JSON object per line to stderr
+logger = logging.getLogger("rentmapper")
+
+if not logger.handlers:
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# names of the stages currently running (innermost last), used to attribute dropped rows to a stage
+_active_stages = []
+
+def emit(event:str, **fields):
+    '''
+    Function to emit a structured log line.
+
+    Args:
+        event: name of the event (e.g. "stage" or "rows_dropped")
+        fields: fields of the log line
+    '''
+    logger.info(json.dumps({"event": event, **fields}, default=str, ensure_ascii=False))
+
+def peak_rss_mb():
+    '''
+    Function to get the peak resident set size (RSS) of the process in MB (None if not available on the platform).
+    '''
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    if sys.platform == "darwin":
+        return round(peak / 1024 ** 2, 1)
+
+    return round(peak / 1024, 1)
+
+def count_rows(obj):
+    '''
+    Function to count rows of a (Geo)DataFrame or Series (None for anything else).
+    '''
+    if hasattr(obj, "shape") and hasattr(obj, "index"):
+        return len(obj)
+
+    return None
+
+@contextlib.contextmanager
+def stage(name:str):
+    '''
+    Context manager instrumenting a stage. Emits a "stage" log line on exit with wall time and peak RSS.
+    Rows in/out can be added to the log line by setting them in the yielded dict.
+
+    Args:
+        name: name of the stage
+
+    Yields:
+        record: dict of extra fields for the log line (e.g. record["rows_out"] = len(df))
+    '''
+    record = {}
+
+    # profile only the outermost stage, as only one profiler can be active at a time
+    profile_dir = os.environ.get("RENTMAPPER_PROFILE_DIR")
+    profiler = cProfile.Profile() if profile_dir and len(_active_stages) == 0 else None
+
+    _active_stages.append(name)
+    start = time.perf_counter()
+
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            pathlib.Path(profile_dir).mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(pathlib.Path(profile_dir) / f"{name}.prof")
+
+        wall_time = time.perf_counter() - start
+        _active_stages.pop()
+
+        emit("stage", stage=name, wall_time_s=round(wall_time, 4), peak_rss_mb=peak_rss_mb(), **record)
+
+def instrument(func):
+    '''
+    Decorator instrumenting a pipeline function as a stage (named "script.function", also when the script is run as __main__).
+    Rows in are counted from the first argument (if it is a dataframe) and rows out from the return value.
+    '''
+    name = f"{pathlib.Path(func.__code__.co_filename).stem}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # count rows of first argument
+        rows_in = count_rows(args[0]) if len(args) > 0 else None
+
+        with stage(name) as record:
+            result = func(*args, **kwargs)
+
+            # count rows of output (first element if several outputs are returned)
+            output = result[0] if isinstance(result, tuple) and len(result) > 0 else result
+            record.update(rows_in=rows_in, rows_out=count_rows(output))
+
+        return result
+
+    return wrapper
+
+def log_rows_dropped(step:str, rows_before:int, rows_after:int):
+    '''
+    Function to log rows dropped by a step within the current stage (e.g. dropna or drop_duplicates).
+
+    Args:
+        step: description of the step (e.g. "dropna zip_code")
+        rows_before: number of rows before the step
+        rows_after: number of rows after the step
+    '''
+    rows_before, rows_after = int(rows_before), int(rows_after)
+
+    emit("rows_dropped", stage=_active_stages[-1] if _active_stages else None, step=step, rows_before=rows_before, rows_after=rows_after, rows_dropped=rows_before - rows_after)
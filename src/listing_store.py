@@ -0,0 +1,242 @@
+'''
+Functions for an in-memory columnar store of the listing-level data used for interactive filtering in the app.
+
+The store is written by aggregate_data.py as results/listing_store.npz (one NumPy array per column, categorical columns as integer codes).
+It is loaded once per process in the app and district aggregates are recomputed from it with boolean masks and np.bincount.
+
+The store also holds the position of each listing as "lat" and "lon" (float32, NaN without street geometry), used for the listing layer of the street view.
+The listings only have street geometry, so the listings of each street (and year) are spread evenly along it. Positions are computed once here
+(each unique street geometry is parsed once and reprojected in one call), so the app only has to select and round them.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+
+# data wrangling
+import pandas as pd
+import numpy as np
+import shapely
+
+# reprojection of listing positions to lat/lon
+from pyproj import Transformer
+
+# categorical columns stored as integer codes (with categories saved alongside)
+CATEGORICAL_COLS = ["district", "rental_type", "rooms"]
+
+# numeric columns stored as is
+NUMERIC_COLS = {"year": np.int16, "square_meters": np.int32, "rent_without_expenses": np.float32, "rent_per_square_meter": np.float32}
+
+def listing_positions(geometry_street:pd.Series, year:pd.Series, crs=25832):
+    '''
+    Function to place the listings along their street, with the listings of each street and year spread evenly along the street.
+
+    Args
+        geometry_street: street geometry of each listing as wkt
+        year: year of each listing
+        crs: crs of the geometry (defaults to 25832 as this is the crs for Denmark)
+
+    Returns
+        lat, lon: float32 arrays with the position of each listing (NaN for listings without street geometry)
+    '''
+    codes, uniques = pd.factorize(geometry_street)
+    has_street = codes >= 0
+
+    # position of each listing along its street, (k + 0.5) / n for the k-th of n listings of the street in a year
+    groups = pd.DataFrame({"street": codes, "year": np.asarray(year)})[has_street].groupby(["street", "year"])
+    fractions = (groups.cumcount().to_numpy() + 0.5) / groups["street"].transform("size").to_numpy()
+
+    streets = shapely.from_wkt(np.asarray(uniques))
+    points = shapely.line_interpolate_point(streets[codes[has_street]], fractions, normalized=True)
+
+    # reproject to lat/lon
+    lon, lat = np.full(len(codes), np.nan), np.full(len(codes), np.nan)
+    lon[has_street], lat[has_street] = Transformer.from_crs(crs, 4326, always_xy=True).transform(shapely.get_x(points), shapely.get_y(points))
+
+    return lat.astype(np.float32), lon.astype(np.float32)
+
+def save_listing_store(complete_data:pd.DataFrame, save_path:pathlib.Path, crs=25832):
+    '''
+    Function to save the listing-level data as a columnar store.
+
+    Args
+        complete_data: complete pandas dataframe
+        save_path: path to save the store to
+        crs: crs of geometry_street (defaults to 25832 as this is the crs for Denmark)
+
+    Outputs
+        listing_store.npz: one array per column. Categorical columns as codes ("{col}_codes") and categories ("{col}_categories").
+                           Positions of listings as "lat" and "lon" (if complete_data has geometry_street)
+    '''
+    arrays = {}
+
+    # encode categorical columns
+    for col in CATEGORICAL_COLS:
+        categorical = pd.Categorical(complete_data[col].astype(str))
+        arrays[f"{col}_codes"] = categorical.codes.astype(np.int16)
+        arrays[f"{col}_categories"] = categorical.categories.to_numpy(dtype=str)
+
+    # add numeric columns
+    for col, dtype in NUMERIC_COLS.items():
+        arrays[col] = complete_data[col].to_numpy(dtype=dtype)
+
+    # add positions along streets
+    if "geometry_street" in complete_data:
+        arrays["lat"], arrays["lon"] = listing_positions(complete_data["geometry_street"], complete_data["year"], crs)
+
+    np.savez(save_path / "listing_store.npz", **arrays)
+
+def load_listing_store(store_path:pathlib.Path):
+    '''
+    Function to load the columnar store into memory.
+
+    Args
+        store_path: path to listing_store.npz
+
+    Returns
+        store: dict with one array per column
+    '''
+    with np.load(store_path) as arrays:
+        store = {key: arrays[key] for key in arrays.files}
+
+    return store
+
+def listing_points(store:dict, year:int=None, decimals:int=5):
+    '''
+    Function to get the listings with a position as compact rows for a clustered marker layer (see maps.add_listing_layer).
+
+    Args
+        store: columnar store from load_listing_store (with "lat" and "lon")
+        year: year of listings to include (defaults to the latest year)
+        decimals: decimals of lat/lon (5 decimals is about 1 m)
+
+    Returns
+        points: list of rows [lat, lon, rent without expenses, square meters, is room (0 or 1)]
+    '''
+    year = store["year"].max() if year is None else year
+    mask = (store["year"] == year) & np.isfinite(store["lat"])
+
+    # round in float64 (float32 values serialize with spurious digits)
+    points = np.column_stack([
+        np.round(store["lat"][mask].astype(np.float64), decimals),
+        np.round(store["lon"][mask].astype(np.float64), decimals),
+        np.round(store["rent_without_expenses"][mask].astype(np.float64)),
+        store["square_meters"][mask],
+        category_mask(store, "rental_type", ["room"])[mask],
+    ])
+
+    # as python lists, ints for all but lat/lon (shorter json)
+    return [[lat, lon, int(rent), int(size), int(room)] for lat, lon, rent, size, room in points.tolist()]
+
+def category_mask(store:dict, col:str, values:list):
+    '''
+    Function to get a boolean mask of listings where a categorical column takes one of the values.
+
+    Args
+        store: columnar store from load_listing_store
+        col: name of categorical column
+        values: values to keep
+
+    Returns
+        mask: boolean array with True for listings where col is in values
+    '''
+    # find codes of the values, then compare codes (avoids comparing strings per listing)
+    codes = np.flatnonzero(np.isin(store[f"{col}_categories"], values))
+
+    return np.isin(store[f"{col}_codes"], codes)
+
+def filter_listings(store:dict, rooms:list=None, size_range:tuple=None, rental_types:list=None, price_range:tuple=None):
+    '''
+    Function to get a boolean mask of listings matching the filters. Filters set to None are not applied.
+
+    Args
+        store: columnar store from load_listing_store
+        rooms: rooms to keep (e.g. ["1", "2", "4+"])
+        size_range: (min, max) square meters (inclusive)
+        rental_types: rental types to keep (e.g. ["apartment"])
+        price_range: (min, max) rent without expenses (inclusive)
+
+    Returns
+        mask: boolean array with True for listings matching all filters
+    '''
+    mask = np.ones(len(store["year"]), dtype=bool)
+
+    if rooms is not None:
+        mask &= category_mask(store, "rooms", rooms)
+
+    if rental_types is not None:
+        mask &= category_mask(store, "rental_type", rental_types)
+
+    if size_range is not None:
+        mask &= (store["square_meters"] >= size_range[0]) & (store["square_meters"] <= size_range[1])
+
+    if price_range is not None:
+        mask &= (store["rent_without_expenses"] >= price_range[0]) & (store["rent_without_expenses"] <= price_range[1])
+
+    return mask
+
+def grouped_mean(codes:np.ndarray, values:np.ndarray, mask:np.ndarray, n_groups:int):
+    '''
+    Function to compute the mean and count of values per group code for the masked rows.
+
+    Args
+        codes: group code per row
+        values: values per row
+        mask: boolean mask of rows to include
+        n_groups: number of groups
+
+    Returns
+        means: mean per group (NaN for empty groups)
+        counts: count per group
+    '''
+    counts = np.bincount(codes[mask], minlength=n_groups)
+    sums = np.bincount(codes[mask], weights=values[mask], minlength=n_groups)
+
+    # divide, empty groups become NaN
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+
+    return means, counts
+
+def aggregate_by_district(store:dict, mask:np.ndarray, current_year:int=2023):
+    '''
+    Function to recompute the district aggregates (as in aggregate_data.get_district_aggregates) for the listings in mask.
+
+    Args
+        store: columnar store from load_listing_store
+        mask: boolean mask of listings to include (from filter_listings)
+        current_year: year considered "now", all other years are "then"
+
+    Returns
+        district_data: dataframe with district, apartment/room rents now and then, rent changes and number of listings now
+    '''
+    n_districts = len(store["district_categories"])
+    codes = store["district_codes"]
+
+    # define masks for rental type and time
+    is_apartment = category_mask(store, "rental_type", ["apartment"])
+    is_room = category_mask(store, "rental_type", ["room"])
+    is_now = store["year"] == current_year
+
+    # compute means per district
+    apartment_now, n_apartments = grouped_mean(codes, store["rent_per_square_meter"], mask & is_apartment & is_now, n_districts)
+    apartment_then, _ = grouped_mean(codes, store["rent_per_square_meter"], mask & is_apartment & ~is_now, n_districts)
+    room_now, n_rooms = grouped_mean(codes, store["rent_without_expenses"], mask & is_room & is_now, n_districts)
+    room_then, _ = grouped_mean(codes, store["rent_without_expenses"], mask & is_room & ~is_now, n_districts)
+
+    district_data = pd.DataFrame({
+        "district": store["district_categories"],
+        "apartment_rent_sqm_now": apartment_now,
+        "apartment_rent_sqm_then": apartment_then,
+        "room_rent_now": room_now,
+        "room_rent_then": room_then,
+        "n_listings": n_apartments + n_rooms,
+    }).round(1)
+
+    # calculate apartment_rent_change and room_rent_change in percent
+    district_data["apartment_rent_change"] = round((district_data["apartment_rent_sqm_now"] - district_data["apartment_rent_sqm_then"]) / district_data["apartment_rent_sqm_then"] * 100, 1)
+    district_data["room_rent_change"] = round((district_data["room_rent_now"] - district_data["room_rent_then"]) / district_data["room_rent_then"] * 100, 1)
+
+    return district_data
@@ -0,0 +1,265 @@
+'''
+Script to pre-generate Mapbox Vector Tiles (MVT) for the street, district and grid layers of the Aarhus RentMapper app.
+
+Tiles are written per zoom level to results/tiles/{layer}/{z}/{x}/{y}.pbf together with a metadata.json per layer.
+The grid layer (if grid_aggregates.py has been run) holds the cells of each resolution only at its zoom levels, so finer cells are served when zoomed in.
+They can be served locally with app/tile_server.py, allowing the app to draw every street without sending all geometries to the browser.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+import json
+import math
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+
+# vector tiles
+import mapbox_vector_tile
+from shapely.geometry import box
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
+# half the circumference of the earth in web mercator (EPSG:3857) metres
+ORIGIN_SHIFT = 20037508.342789244
+
+def load_layer(datapath:pathlib.Path, geometry_col:str, properties:list, crs=25832):
+    '''
+    Function to load aggregates and reproject them to web mercator (EPSG:3857) for tiling.
+
+    Args:
+        datapath: path to aggregates csv
+        geometry_col: name of the column with geometry as wkt
+        properties: columns to keep as feature properties in the tiles
+        crs: crs of the geometry in the csv (defaults to 25832 as this is the crs for Denmark)
+
+    Returns:
+        layer: geodataframe in EPSG:3857 with only properties and geometry
+    '''
+    # read in data, only keep needed columns
+    data = pd.read_csv(datapath, usecols=properties + [geometry_col])
+
+    # change wkt to geometry
+    geometry = gpd.GeoSeries.from_wkt(data[geometry_col], crs=crs)
+
+    # convert to geodataframe with web mercator crs
+    layer = gpd.GeoDataFrame(data[properties], geometry=geometry).to_crs("epsg:3857")
+
+    return layer
+
+def tile_bounds(x:int, y:int, z:int):
+    '''
+    Function to get the bounds of a tile in web mercator (EPSG:3857) coordinates.
+
+    Args:
+        x, y, z: tile coordinates (XYZ scheme, y counted from the top)
+
+    Returns:
+        bounds: (minx, miny, maxx, maxy) of the tile
+    '''
+    # size of one tile at zoom level z
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+
+    return (minx, maxy - size, minx + size, maxy)
+
+def tiles_for_bounds(bounds, z:int):
+    '''
+    Function to get all tiles at zoom level z covering the bounds.
+
+    Args:
+        bounds: (minx, miny, maxx, maxy) in EPSG:3857
+        z: zoom level
+
+    Returns:
+        tiles: list of (x, y) tile coordinates
+    '''
+    # size of one tile at zoom level z
+    size = 2 * ORIGIN_SHIFT / 2 ** z
+
+    minx, miny, maxx, maxy = bounds
+
+    # tile indices of the corners (y is counted from the top)
+    x_min = int(math.floor((minx + ORIGIN_SHIFT) / size))
+    x_max = int(math.floor((maxx + ORIGIN_SHIFT) / size))
+    y_min = int(math.floor((ORIGIN_SHIFT - maxy) / size))
+    y_max = int(math.floor((ORIGIN_SHIFT - miny) / size))
+
+    return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+def make_tile(layer:gpd.GeoDataFrame, layer_name:str, bounds, extent:int=4096, buffer:int=64):
+    '''
+    Function to encode all features of a layer intersecting a tile as a Mapbox Vector Tile.
+    Geometries are clipped to the (buffered) tile and simplified to the tile resolution.
+
+    Args:
+        layer: geodataframe in EPSG:3857
+        layer_name: name of the layer within the tile
+        bounds: (minx, miny, maxx, maxy) of the tile
+        extent: number of tile units per side (defaults to the MVT standard of 4096)
+        buffer: buffer around the tile in tile units to avoid clipping artifacts at tile edges
+
+    Returns:
+        tile: encoded tile as bytes (None if no features in tile)
+    '''
+    minx, miny, maxx, maxy = bounds
+
+    # size of one tile unit in metres
+    resolution = (maxx - minx) / extent
+
+    # buffered tile bounds
+    margin = buffer * resolution
+    clip_bounds = (minx - margin, miny - margin, maxx + margin, maxy + margin)
+
+    # find candidate features with the spatial index
+    candidates = layer.iloc[layer.sindex.query(box(*clip_bounds))]
+
+    if candidates.empty:
+        return None
+
+    # clip and simplify geometries to the tile resolution
+    geometries = candidates.geometry.clip_by_rect(*clip_bounds).simplify(resolution)
+
+    # collect features, drop missing properties as they cannot be encoded
+    features = []
+    for geometry, properties in zip(geometries, candidates.drop(columns="geometry").to_dict("records")):
+        if geometry is None or geometry.is_empty:
+            continue
+
+        properties = {key: value for key, value in properties.items() if not pd.isna(value)}
+        features.append({"geometry": geometry, "properties": properties})
+
+    if len(features) == 0:
+        return None
+
+    # encode tile
+    tile = mapbox_vector_tile.encode(
+        [{"name": layer_name, "features": features}],
+        default_options={"quantize_bounds": bounds, "extents": extent, "y_coord_down": False},
+    )
+
+    return tile
+
+def write_tiles(layer:gpd.GeoDataFrame, layer_name:str, tile_dir:pathlib.Path, min_zoom:int=10, max_zoom:int=16):
+    '''
+    Function to write a tile pyramid for a layer.
+
+    Args:
+        layer: geodataframe in EPSG:3857
+        layer_name: name of the layer (used as folder name and as layer name within the tiles)
+        tile_dir: folder to write tiles to
+        min_zoom: lowest zoom level to generate tiles for
+        max_zoom: highest zoom level to generate tiles for
+
+    Outputs:
+        {layer_name}/{z}/{x}/{y}.pbf: vector tiles
+        {layer_name}/metadata.json: zoom levels, bounds (lon/lat) and properties of the layer
+
+    Returns:
+        n_tiles: number of tiles written
+    '''
+    layer_dir = tile_dir / layer_name
+
+    n_tiles = 0
+
+    for z in range(min_zoom, max_zoom + 1):
+        for x, y in tiles_for_bounds(layer.total_bounds, z):
+            # encode tile
+            tile = make_tile(layer, layer_name, tile_bounds(x, y, z))
+
+            # skip empty tiles
+            if tile is None:
+                continue
+
+            # write tile
+            tile_path = layer_dir / str(z) / str(x) / f"{y}.pbf"
+            tile_path.parent.mkdir(parents=True, exist_ok=True)
+            tile_path.write_bytes(tile)
+
+            n_tiles += 1
+
+    # write metadata
+    metadata = {
+        "name": layer_name,
+        "minzoom": min_zoom,
+        "maxzoom": max_zoom,
+        "bounds": layer.to_crs("epsg:4326").total_bounds.tolist(),
+        "fields": [col for col in layer.columns if col != "geometry"],
+    }
+
+    with open(layer_dir / "metadata.json", "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    return n_tiles
+
+def write_grid_tiles(grid:gpd.GeoDataFrame, tile_dir:pathlib.Path, layer_name:str="grid"):
+    '''
+    Function to write the tiles of a grid pyramid, with the cells of each resolution at its zoom levels (see grid_aggregates.py).
+
+    Args:
+        grid: geodataframe in EPSG:3857 with "cell_size", "min_zoom" and "max_zoom" of each cell
+        tile_dir: folder to write tiles to
+        layer_name: name of the layer
+
+    Outputs:
+        {layer_name}/{z}/{x}/{y}.pbf: vector tiles
+        {layer_name}/metadata.json: zoom levels, bounds (lon/lat), properties and the cell size of each zoom level
+
+    Returns:
+        n_tiles: number of tiles written
+    '''
+    n_tiles = 0
+
+    for (min_zoom, max_zoom), level in grid.groupby(["min_zoom", "max_zoom"]):
+        n_tiles += write_tiles(level.drop(columns=["min_zoom", "max_zoom"]), layer_name, tile_dir, min_zoom=int(min_zoom), max_zoom=int(max_zoom))
+
+    # write metadata of all levels (replaces the metadata of the last level)
+    levels = grid[["cell_size", "min_zoom", "max_zoom"]].drop_duplicates().sort_values("min_zoom")
+
+    metadata = {
+        "name": layer_name,
+        "minzoom": int(levels["min_zoom"].min()),
+        "maxzoom": int(levels["max_zoom"].max()),
+        "bounds": grid.to_crs("epsg:4326").total_bounds.tolist(),
+        "fields": [col for col in grid.columns if col not in ["geometry", "min_zoom", "max_zoom"]],
+        "levels": levels.astype(int).to_dict(orient="records"),
+    }
+
+    with open(tile_dir / layer_name / "metadata.json", "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    return n_tiles
+
+
+def main():
+    # define paths from configuration of default municipality
+    datapath = get_municipality()["paths"]["results"]
+    tile_dir = datapath / "tiles"
+
+    # load layers
+    districts = load_layer(datapath / "district_aggregates.csv", "geometry", ["district", "apartment_rent_sqm_now"])
+    streets = load_layer(datapath / "street_aggregates.csv", "geometry_street", ["street", "district", "rent_per_square_meter"])
+
+    # write tiles
+    n_district_tiles = write_tiles(districts, "districts", tile_dir, min_zoom=10, max_zoom=14)
+    n_street_tiles = write_tiles(streets, "streets", tile_dir, min_zoom=10, max_zoom=16)
+
+    print(f"[INFO:] Wrote {n_district_tiles} district tiles and {n_street_tiles} street tiles to {tile_dir}")
+
+    # write grid tiles (if grid aggregates exist)
+    if (datapath / "grid_aggregates.csv").exists():
+        grid = load_layer(datapath / "grid_aggregates.csv", "geometry", ["cell_size", "min_zoom", "max_zoom", "count", "apartment_rent_sqm_now"])
+        n_grid_tiles = write_grid_tiles(grid, tile_dir)
+
+        print(f"[INFO:] Wrote {n_grid_tiles} grid tiles to {tile_dir}")
+
+
+if __name__ == "__main__":
+    main()
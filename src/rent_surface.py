@@ -0,0 +1,240 @@
+'''
+Script to compute a smoothed surface of the apartment rent per square meter as a raster (kernel density estimation).
+
+Points are sampled along the geometry of each street in the street aggregates, and each street's listings are spread evenly over its points.
+Listing weights and weighted rents are binned on a regular grid. Both grids are convolved with a Gaussian kernel using FFT convolution,
+so the cost depends on the grid size and not on the number of listings. The surface is their ratio (a Nadaraya-Watson estimate):
+    surface = (K * (weights x rents)) / (K * weights)
+Cells with less than min_weight listings within about one bandwidth are left empty (NaN).
+
+The raster is saved as results/rent_surface.npz with:
+    surface         float32 array (rows from north to south) in the crs of the municipality
+    transform       affine transform as in GeoTIFFs (x of west edge, cell size, 0, y of north edge, 0, -cell size)
+    overlay         the surface resampled to a web mercator grid (for map overlays in the app)
+    overlay_bounds  bounds of the overlay as [[south, west], [north, east]] in lat/lon
+
+To compute the surface for the default municipality, type:
+    python src/rent_surface.py
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import argparse
+import pathlib
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+
+# convolution and reprojection
+from scipy.signal import fftconvolve
+from pyproj import Transformer
+
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument, emit
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
+def input_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cell_size", type=float, default=50, help="size of the raster cells in meters")
+    parser.add_argument("--bandwidth", type=float, default=300, help="standard deviation of the Gaussian kernel in meters")
+
+    return parser.parse_args()
+
+def sample_street_points(street_data:gpd.GeoDataFrame, value_col:str="rent_per_square_meter", weight_col:str="count", spacing:float=50):
+    '''
+    Function to sample points along the streets, with the listings of each street spread evenly over its points.
+
+    Args
+        street_data: geodataframe with street aggregates (one geometry per street)
+        value_col: column with the value of each street
+        weight_col: column with the number of listings of each street
+        spacing: distance between points along a street (streets shorter than spacing get one point at their midpoint)
+
+    Returns
+        x, y: coordinates of the points
+        weights: weight of each point (listings of the street / points of the street)
+        values: value of the street of each point
+    '''
+    street_data = street_data.dropna(subset=[value_col, weight_col])
+    geometry = street_data.geometry.to_numpy()
+
+    # number of points per street and their positions along the street (centered in each segment of length spacing)
+    n_points = np.maximum(1, np.round(shapely.length(geometry) / spacing)).astype(np.int64)
+    streets = np.repeat(np.arange(len(geometry)), n_points)
+    positions = (np.arange(len(streets)) - np.repeat(np.cumsum(n_points) - n_points, n_points) + 0.5) / n_points[streets]
+
+    points = shapely.line_interpolate_point(geometry[streets], positions, normalized=True)
+
+    weights = (street_data[weight_col].to_numpy(dtype=float) / n_points)[streets]
+    values = street_data[value_col].to_numpy(dtype=float)[streets]
+
+    return shapely.get_x(points), shapely.get_y(points), weights, values
+
+def gaussian_kernel(bandwidth:float, cell_size:float, truncate:float=3):
+    '''
+    Function to get a Gaussian kernel on the raster grid with a peak of 1 (so convolved weights are listings within about one bandwidth).
+
+    Args
+        bandwidth: standard deviation of the kernel in meters
+        cell_size: size of the raster cells in meters
+        truncate: radius of the kernel in standard deviations
+
+    Returns
+        kernel: square array of odd size
+    '''
+    radius = int(np.ceil(truncate * bandwidth / cell_size))
+    offsets = np.arange(-radius, radius + 1) * cell_size
+
+    kernel_1d = np.exp(-offsets ** 2 / (2 * bandwidth ** 2))
+
+    return np.outer(kernel_1d, kernel_1d)
+
+@instrument
+def compute_rent_surface(street_data:gpd.GeoDataFrame, cell_size:float=50, bandwidth:float=300, min_weight:float=1.0):
+    '''
+    Function to compute the smoothed rent per square meter on a regular grid covering the streets.
+
+    Args
+        street_data: geodataframe with street aggregates ("rent_per_square_meter" and "count")
+        cell_size: size of the raster cells in meters
+        bandwidth: standard deviation of the Gaussian kernel in meters
+        min_weight: minimum kernel-weighted number of listings of a cell (cells with fewer are NaN)
+
+    Returns
+        surface: float32 array of smoothed rents (rows from north to south)
+        transform: affine transform (x of west edge, cell size, 0, y of north edge, 0, -cell size)
+    '''
+    x, y, weights, values = sample_street_points(street_data, spacing=cell_size)
+
+    # grid covering the streets with a margin of the kernel radius
+    kernel = gaussian_kernel(bandwidth, cell_size)
+    margin = (kernel.shape[0] // 2) * cell_size
+    minx, miny, maxx, maxy = street_data.total_bounds
+
+    west, north = np.floor((minx - margin) / cell_size) * cell_size, np.ceil((maxy + margin) / cell_size) * cell_size
+    n_cols = int(np.ceil((maxx + margin - west) / cell_size))
+    n_rows = int(np.ceil((north - (miny - margin)) / cell_size))
+
+    # bin weights and weighted rents (rows from north to south)
+    rows = ((north - y) // cell_size).astype(np.int64)
+    cols = ((x - west) // cell_size).astype(np.int64)
+
+    binned_weights = np.bincount(rows * n_cols + cols, weights=weights, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+    binned_values = np.bincount(rows * n_cols + cols, weights=weights * values, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
+
+    # smooth both with the kernel (FFT convolution) and take their ratio where there are enough listings
+    smoothed_weights = fftconvolve(binned_weights, kernel, mode="same")
+    smoothed_values = fftconvolve(binned_values, kernel, mode="same")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        surface = np.where(smoothed_weights >= min_weight, smoothed_values / smoothed_weights, np.nan).astype(np.float32)
+
+    transform = np.array([west, cell_size, 0, north, 0, -cell_size])
+
+    emit("rent_surface", n_points=len(x), shape=list(surface.shape), cells_with_rent=int(np.isfinite(surface).sum()))
+
+    return surface, transform
+
+def to_web_mercator(surface:np.ndarray, transform:np.ndarray, crs=25832):
+    '''
+    Function to resample the surface to a web mercator grid of the same shape (nearest neighbor), so it can be drawn as an image overlay on web maps.
+
+    Args
+        surface: array from compute_rent_surface
+        transform: affine transform of the surface
+        crs: crs of the surface
+
+    Returns
+        overlay: float32 array on a web mercator grid (rows from north to south)
+        bounds: [[south, west], [north, east]] of the overlay in lat/lon
+    '''
+    n_rows, n_cols = surface.shape
+    west, north, cell_size = transform[0], transform[3], transform[1]
+    east, south = west + n_cols * cell_size, north - n_rows * cell_size
+
+    to_mercator = Transformer.from_crs(crs, 3857, always_xy=True)
+    from_mercator = Transformer.from_crs(3857, crs, always_xy=True)
+
+    # bounds of the surface in web mercator (from all edges, as the grids are not aligned)
+    edge_x = np.concatenate([np.linspace(west, east, n_cols + 1), np.full(n_rows + 1, east), np.linspace(west, east, n_cols + 1), np.full(n_rows + 1, west)])
+    edge_y = np.concatenate([np.full(n_cols + 1, north), np.linspace(north, south, n_rows + 1), np.full(n_cols + 1, south), np.linspace(north, south, n_rows + 1)])
+    merc_x, merc_y = to_mercator.transform(edge_x, edge_y)
+
+    # centers of the web mercator cells, transformed back to find the nearest cell of the surface
+    center_x = np.linspace(merc_x.min(), merc_x.max(), n_cols, endpoint=False) + (merc_x.max() - merc_x.min()) / n_cols / 2
+    center_y = np.linspace(merc_y.max(), merc_y.min(), n_rows, endpoint=False) - (merc_y.max() - merc_y.min()) / n_rows / 2
+    source_x, source_y = from_mercator.transform(*np.meshgrid(center_x, center_y))
+
+    rows = np.floor((north - source_y) / cell_size).astype(np.int64)
+    cols = np.floor((source_x - west) / cell_size).astype(np.int64)
+    inside = (rows >= 0) & (rows < n_rows) & (cols >= 0) & (cols < n_cols)
+
+    overlay = np.full(surface.shape, np.nan, dtype=np.float32)
+    overlay[inside] = surface[rows[inside], cols[inside]]
+
+    # bounds in lat/lon
+    lon, lat = Transformer.from_crs(3857, 4326, always_xy=True).transform([merc_x.min(), merc_x.max()], [merc_y.min(), merc_y.max()])
+
+    return overlay, [[lat[0], lon[0]], [lat[1], lon[1]]]
+
+def save_rent_surface(surface:np.ndarray, transform:np.ndarray, save_path:pathlib.Path, crs=25832, bandwidth:float=300):
+    '''
+    Function to save the surface together with its web mercator overlay.
+
+    Args
+        surface: array from compute_rent_surface
+        transform: affine transform of the surface
+        save_path: path to save the surface to
+        crs: crs of the surface
+        bandwidth: bandwidth the surface was computed with
+
+    Outputs
+        rent_surface.npz: surface, transform, crs, bandwidth, overlay and overlay_bounds
+    '''
+    overlay, overlay_bounds = to_web_mercator(surface, transform, crs)
+
+    np.savez_compressed(save_path / "rent_surface.npz", surface=surface, transform=transform, crs=crs, bandwidth=bandwidth, overlay=overlay, overlay_bounds=np.array(overlay_bounds))
+
+def load_rent_surface(surface_path:pathlib.Path):
+    '''
+    Function to load the surface.
+
+    Args
+        surface_path: path to rent_surface.npz
+
+    Returns
+        raster: dict with the arrays of the file (scalars as numbers)
+    '''
+    with np.load(surface_path) as arrays:
+        raster = {key: arrays[key] if arrays[key].ndim > 0 else arrays[key].item() for key in arrays.files}
+
+    return raster
+
+
+def main():
+    args = input_parse()
+
+    # define paths from configuration of default municipality
+    municipality = get_municipality()
+    results_path = municipality["paths"]["results"]
+
+    # read street aggregates
+    street_data = pd.read_csv(results_path / "street_aggregates.csv", usecols=["street", "rent_per_square_meter", "count", "geometry_street"])
+    street_data = gpd.GeoDataFrame(street_data, geometry=gpd.GeoSeries.from_wkt(street_data["geometry_street"]), crs=municipality["crs"])
+
+    # compute and save surface
+    surface, transform = compute_rent_surface(street_data, args.cell_size, args.bandwidth)
+    save_rent_surface(surface, transform, results_path, municipality["crs"], args.bandwidth)
+
+    print(f"[INFO:] Computed rent surface of {surface.shape[0]}x{surface.shape[1]} cells ({args.cell_size:.0f} m)")
+
+
+if __name__ == "__main__":
+    main()
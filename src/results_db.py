@@ -0,0 +1,224 @@
+'''
+Functions to save the district and street aggregates in an embedded SQLite database (results/results.sqlite) and to query single rows from it.
+
+The database is an optional backend for the app. With indexes on district and street, a view can fetch the selected district and its neighbors
+(or the selected street) without decoding the full aggregates. Geometries are stored as WKB. The database has four tables:
+    districts           district aggregates with "id" (position in district_aggregates.csv, as in district_adjacency.npz)
+    district_neighbors  pairs of district ids and neighbor ids (the adjacency as rows)
+    streets             street aggregates
+    metadata            key-value pairs (e.g. the crs of the geometries)
+
+The database is written to a temporary file and moved in place, so app workers never read a partial database.
+App workers open it read-only, with one connection per thread which is reopened if the file is replaced.
+
+To build the database from the aggregates in the results folder of the default municipality, type:
+    python src/results_db.py
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import os
+import pathlib
+import sqlite3
+import threading
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+import shapely
+
+# adjacency of districts
+from adjacency import load_adjacency
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
+# read-only connections of the current thread (per database path)
+_connections = threading.local()
+
+def to_wkb(wkt:pd.Series):
+    '''
+    Function to convert geometries as wkt to wkb.
+    '''
+    return shapely.to_wkb(shapely.from_wkt(wkt.to_numpy()))
+
+def save_results_db(district_data:pd.DataFrame, street_data:pd.DataFrame, adjacency:dict, save_path:pathlib.Path, crs=25832):
+    '''
+    Function to save the district and street aggregates with indexes in an SQLite database.
+
+    Args
+        district_data: district aggregates with geometry as wkt (in the order of the adjacency)
+        street_data: street aggregates with geometry_street as wkt
+        adjacency: adjacency of the districts (see adjacency.py)
+        save_path: path to save the database to
+        crs: crs of the geometries
+
+    Outputs
+        results.sqlite: database with the tables districts, district_neighbors, streets and metadata
+    '''
+    districts = pd.DataFrame(district_data).drop(columns=["geometry"])
+    districts.insert(0, "id", np.arange(len(districts)))
+    districts["geometry"] = to_wkb(district_data["geometry"])
+
+    streets = pd.DataFrame(street_data).drop(columns=["geometry_street"])
+    streets["geometry"] = to_wkb(street_data["geometry_street"])
+
+    # adjacency as rows (district id, neighbor id)
+    neighbors = pd.DataFrame({
+        "district_id": np.repeat(np.arange(len(adjacency["indptr"]) - 1), np.diff(adjacency["indptr"])),
+        "neighbor_id": adjacency["indices"].astype(np.int64),
+    })
+
+    # write to temporary file and replace, so the app never reads a partial database
+    db_path = save_path / "results.sqlite"
+    tmp_path = db_path.with_suffix(".tmp")
+    tmp_path.unlink(missing_ok=True)
+
+    with sqlite3.connect(tmp_path) as connection:
+        districts.to_sql("districts", connection, index=False)
+        neighbors.to_sql("district_neighbors", connection, index=False)
+        streets.to_sql("streets", connection, index=False)
+        pd.DataFrame({"key": ["crs"], "value": [str(crs)]}).to_sql("metadata", connection, index=False)
+
+        # indexes for the lookups of the app
+        connection.executescript("""
+            CREATE UNIQUE INDEX idx_districts_id ON districts(id);
+            CREATE UNIQUE INDEX idx_districts_district ON districts(district);
+            CREATE INDEX idx_district_neighbors_district_id ON district_neighbors(district_id);
+            CREATE UNIQUE INDEX idx_streets_street ON streets(street);
+            CREATE INDEX idx_streets_district ON streets(district);
+        """)
+
+    connection.close()
+    os.replace(tmp_path, db_path)
+
+def connect(db_path:pathlib.Path):
+    '''
+    Function to get a read-only connection to the database for the current thread (reopened if the file has been replaced).
+
+    Args
+        db_path: path to results.sqlite
+
+    Returns
+        connection: sqlite3 connection
+    '''
+    version = os.stat(db_path).st_mtime_ns
+    cached = getattr(_connections, "cache", {}).get(db_path)
+
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if cached is not None:
+        cached[1].close()
+
+    connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+
+    _connections.cache = {**getattr(_connections, "cache", {}), db_path: (version, connection)}
+
+    return connection
+
+def query(db_path:pathlib.Path, sql:str, params:tuple=()):
+    '''
+    Function to query the database. Geometries are decoded from wkb.
+
+    Args
+        db_path: path to results.sqlite
+        sql: SQL query
+        params: parameters of the query
+
+    Returns
+        data: geodataframe (dataframe if the query has no geometry column) with the rows of the query
+    '''
+    connection = connect(db_path)
+    data = pd.read_sql_query(sql, connection, params=params)
+
+    # columns with only NULLs are read as None, convert them to NaN (as when reading the aggregates)
+    for col in data.columns[data.isna().all()]:
+        data[col] = np.nan
+
+    if "geometry" not in data.columns:
+        return data
+
+    crs = connection.execute("SELECT value FROM metadata WHERE key = 'crs'").fetchone()[0]
+
+    return gpd.GeoDataFrame(data, geometry=gpd.GeoSeries.from_wkb(data["geometry"]), crs=int(crs))
+
+def list_names(db_path:pathlib.Path, table:str):
+    '''
+    Function to get the names of all districts or streets (in the order of the aggregates).
+
+    Args
+        db_path: path to results.sqlite
+        table: "districts" or "streets"
+
+    Returns
+        names: list of names
+    '''
+    name_col = {"districts": "district", "streets": "street"}[table]
+
+    return [row[0] for row in connect(db_path).execute(f"SELECT {name_col} FROM {table} ORDER BY rowid")]
+
+def get_district(db_path:pathlib.Path, district:str):
+    '''
+    Function to get the aggregates of a district.
+
+    Returns
+        data: geodataframe with one row (empty if the district does not exist)
+    '''
+    return query(db_path, "SELECT * FROM districts WHERE district = ?", (district,))
+
+def get_district_neighbors(db_path:pathlib.Path, district:str):
+    '''
+    Function to get the aggregates of the neighbors of a district.
+
+    Returns
+        data: geodataframe with one row per neighbor (in the order of the adjacency)
+    '''
+    return query(db_path, """
+        SELECT neighbors.* FROM districts AS selected
+        JOIN district_neighbors ON district_neighbors.district_id = selected.id
+        JOIN districts AS neighbors ON neighbors.id = district_neighbors.neighbor_id
+        WHERE selected.district = ?
+        ORDER BY district_neighbors.rowid
+    """, (district,))
+
+def get_street(db_path:pathlib.Path, street:str):
+    '''
+    Function to get the aggregates of a street.
+
+    Returns
+        data: geodataframe with one row (empty if the street does not exist)
+    '''
+    return query(db_path, "SELECT * FROM streets WHERE street = ?", (street,))
+
+def get_district_streets(db_path:pathlib.Path, districts:list):
+    '''
+    Function to get the aggregates of all streets in some districts (e.g. the districts of the city center).
+
+    Returns
+        data: geodataframe with one row per street (in the order of the aggregates)
+    '''
+    placeholders = ", ".join("?" * len(districts))
+
+    return query(db_path, f"SELECT * FROM streets WHERE district IN ({placeholders}) ORDER BY rowid", tuple(districts))
+
+def main():
+    # define paths from configuration of default municipality
+    municipality = get_municipality()
+    results_path = municipality["paths"]["results"]
+
+    # read aggregates and adjacency
+    district_data = pd.read_csv(results_path / "district_aggregates.csv")
+    street_data = pd.read_csv(results_path / "street_aggregates.csv")
+    adjacency = load_adjacency(results_path / "district_adjacency.npz")
+
+    save_results_db(district_data, street_data, adjacency, results_path, municipality["crs"])
+
+    print(f"[INFO:] Saved {len(district_data)} districts and {len(street_data)} streets to {results_path / 'results.sqlite'}")
+
+
+if __name__ == "__main__":
+    main()
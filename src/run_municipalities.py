@@ -0,0 +1,123 @@
+'''
+Script to run the pipeline (cleaning, adding geodata, aggregates, grid aggregates, rent surface and vector tiles) for several municipalities in parallel.
+
+Each municipality in data/municipalities.json is a partition with its own inputs and results folder (see config.py),
+so municipalities are processed independently in separate worker processes.
+
+To run the pipeline for all municipalities, type:
+    python src/run_municipalities.py
+
+To run it for selected municipalities with a fixed number of workers, type:
+    python src/run_municipalities.py --municipalities aarhus odense --workers 2
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import os
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# data wrangling
+import pandas as pd
+import geopandas as gpd
+
+# pipeline stages
+from config import get_municipality, list_municipalities
+from clean_data import clean_all_data
+from add_geodata import load_data, add_geodata
+from aggregate_data import get_district_aggregates, get_street_aggregates
+from listing_store import save_listing_store
+from results_db import save_results_db
+from adjacency import load_adjacency
+from hedonic_model import fit_hedonic_model, save_hedonic_model
+from grid_aggregates import get_grid_aggregates, save_grid_aggregates
+from rent_surface import compute_rent_surface, save_rent_surface
+from make_tiles import load_layer, write_tiles, write_grid_tiles
+
+def input_parse():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--municipalities", type=str, nargs="+", default=None, help="keys of municipalities to run (defaults to all in data/municipalities.json)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes (defaults to one per municipality, at most the number of CPUs)")
+    parser.add_argument("--skip_tiles", action="store_true", help="do not generate vector tiles")
+
+    return parser.parse_args()
+
+def run_municipality(key:str, make_tiles:bool=True):
+    '''
+    Function to run all pipeline stages for one municipality. Run in a worker process.
+
+    Args:
+        key: key of municipality in data/municipalities.json
+        make_tiles: whether to generate vector tiles
+
+    Returns:
+        key: key of municipality
+        n_listings: number of listings in the complete data
+        seconds: time spent on the municipality
+    '''
+    start = time.perf_counter()
+
+    # get configuration of municipality
+    municipality = get_municipality(key)
+    paths = municipality["paths"]
+    paths["results"].mkdir(parents=True, exist_ok=True)
+
+    # clean data
+    zip_codes = pd.read_csv(paths["zip_codes"])
+    clean_all_data(paths["scrape_data"], zip_codes, paths["scrape_data"])
+
+    # add geodata
+    apartments, districts, geo_streets, geo_districts, geo_society = load_data(municipality)
+    complete_data = add_geodata(apartments, districts, geo_streets, geo_districts, geo_society, municipality, report_path=paths["results"], index_dir=paths["street_lookup"].parent)
+    complete_data.to_csv(paths["complete_data"], index=False)
+
+    # compute aggregates (from csv, as geometries are stored as wkt)
+    complete_data = pd.read_csv(paths["complete_data"])
+    district_data = get_district_aggregates(complete_data.copy(), paths["results"], crs=municipality["crs"])
+    street_data = get_street_aggregates(complete_data.copy(), paths["results"], n_similar_streets=5, crs=municipality["crs"])
+    save_listing_store(complete_data, paths["results"], municipality["crs"])
+    save_results_db(district_data, street_data, load_adjacency(paths["results"] / "district_adjacency.npz"), paths["results"], municipality["crs"])
+    save_hedonic_model(fit_hedonic_model(complete_data), paths["results"])
+    save_grid_aggregates(get_grid_aggregates(complete_data, crs=municipality["crs"]), paths["results"])
+
+    # compute rent surface from street aggregates
+    street_data = gpd.GeoDataFrame(street_data, geometry=gpd.GeoSeries.from_wkt(street_data["geometry_street"]), crs=municipality["crs"])
+    save_rent_surface(*compute_rent_surface(street_data), paths["results"], municipality["crs"])
+
+    # generate vector tiles
+    if make_tiles:
+        crs = municipality["crs"]
+        districts = load_layer(paths["results"] / "district_aggregates.csv", "geometry", ["district", "apartment_rent_sqm_now"], crs=crs)
+        streets = load_layer(paths["results"] / "street_aggregates.csv", "geometry_street", ["street", "district", "rent_per_square_meter"], crs=crs)
+        write_tiles(districts, "districts", paths["results"] / "tiles", min_zoom=10, max_zoom=14)
+        write_tiles(streets, "streets", paths["results"] / "tiles", min_zoom=10, max_zoom=16)
+
+        grid = load_layer(paths["results"] / "grid_aggregates.csv", "geometry", ["cell_size", "min_zoom", "max_zoom", "count", "apartment_rent_sqm_now"], crs=crs)
+        write_grid_tiles(grid, paths["results"] / "tiles")
+
+    return key, len(complete_data), time.perf_counter() - start
+
+def main():
+    args = input_parse()
+
+    # define municipalities to run
+    keys = args.municipalities or list(list_municipalities())
+
+    # check that all municipalities exist before starting workers
+    for key in keys:
+        get_municipality(key)
+
+    # run municipalities in parallel (each in its own process)
+    with ProcessPoolExecutor(max_workers=args.workers or min(len(keys), os.cpu_count() or 1)) as executor:
+        futures = {executor.submit(run_municipality, key, not args.skip_tiles): key for key in keys}
+
+        for future in as_completed(futures):
+            key, n_listings, seconds = future.result()
+            print(f"[INFO:] {key}: {n_listings} listings processed in {seconds:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+'''
+Functions for empirical Bayes smoothing of district and street means (used in aggregate_data.py).
+
+Means of groups with few listings are noisy, and groups without listings have no mean at all. Each mean is therefore shrunk towards a prior mean
+(the mean of the neighbor districts for districts, the mean of the district for streets), weighted by how precise it is:
+    smoothed = w * mean + (1 - w) * prior,    w = tau2 / (tau2 + sigma2 / count)
+where sigma2 is the pooled variance of the listings within groups and tau2 the variance of the group means around their priors (method of moments).
+A group with many listings keeps its mean, a group with one listing moves towards its prior and a group without listings gets its prior.
+
+Neighbor and district means are sparse matrix-vector products with the adjacency (see adjacency.py) or a street to district membership matrix.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# data wrangling
+import pandas as pd
+import numpy as np
+
+# sparse matrices
+from scipy import sparse
+
+def group_statistics(listings:pd.DataFrame, group_cols:list, value_col:str, groups):
+    '''
+    Function to get the number of listings and the mean of value_col per group and the pooled variance within groups.
+
+    Args
+        listings: dataframe with one row per listing
+        group_cols: columns with the group of each listing (e.g. ["district"] or ["street", "district"])
+        value_col: column to compute the means of
+        groups: groups to return statistics for, in this order (e.g. district names or a MultiIndex of streets and districts). Groups without listings get count 0 and mean NaN
+
+    Returns
+        counts: array with number of listings per group
+        means: array with mean per group
+        within_var: pooled variance of the listings around the mean of their group
+    '''
+    listings = listings.dropna(subset=group_cols + [value_col])
+    stats = listings.groupby(group_cols)[value_col].agg(["count", "mean", "var"]).reindex(groups)
+
+    counts = stats["count"].fillna(0).to_numpy()
+    means = stats["mean"].to_numpy()
+
+    # pool sums of squares of groups with more than one listing
+    sum_squares = (stats["var"] * (stats["count"] - 1)).sum()
+    degrees = (stats["count"] - 1).clip(lower=0).sum()
+    within_var = sum_squares / degrees if degrees > 0 else np.nan
+
+    return counts, means, within_var
+
+def weighted_means(matrix, means:np.ndarray, counts:np.ndarray):
+    '''
+    Function to get the count-weighted mean of the groups in each row of a sparse matrix (e.g. the neighbors of each district).
+
+    Args
+        matrix: sparse matrix of shape (n_rows, n_groups) with 1 for groups included in a row
+        means: array with mean per group (NaN for groups without listings)
+        counts: array with number of listings per group
+
+    Returns
+        weighted: array with weighted mean per row (NaN if no group in the row has listings)
+    '''
+    has_data = ~np.isnan(means) & (counts > 0)
+    weights = np.where(has_data, counts, 0.0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (matrix @ np.where(has_data, means * weights, 0.0)) / (matrix @ weights)
+
+def shrink(means:np.ndarray, counts:np.ndarray, priors:np.ndarray, within_var:float):
+    '''
+    Function to shrink group means towards their prior means (see module docstring).
+
+    Args
+        means: array with mean per group (NaN for groups without listings)
+        counts: array with number of listings per group
+        priors: array with prior mean per group (NaN if unknown, then the mean is kept)
+        within_var: pooled variance of the listings within groups
+
+    Returns
+        smoothed: array with smoothed mean per group
+    '''
+    has_data = ~np.isnan(means) & (counts > 0)
+    has_both = has_data & ~np.isnan(priors)
+
+    # variance of the means around their priors beyond the sampling variance (method of moments, weighted by counts)
+    n = counts[has_both].sum()
+    if n > 0 and not np.isnan(within_var):
+        tau2 = max(0.0, (np.sum(counts[has_both] * (means[has_both] - priors[has_both]) ** 2) - has_both.sum() * within_var) / n)
+    else:
+        tau2 = np.inf
+
+    # weight of each mean (0 without listings, so the prior is used)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        weights = np.where(has_data, tau2 / (tau2 + within_var / counts), 0.0)
+
+    weights = np.nan_to_num(weights, nan=1.0)
+
+    smoothed = np.where(has_both | ~has_data, weights * np.nan_to_num(means) + (1 - weights) * priors, means)
+
+    return smoothed
+
+def smooth_district_means(adjacency_matrix, means:np.ndarray, counts:np.ndarray, within_var:float, max_hops:int=5):
+    '''
+    Function to smooth district means towards the count-weighted mean of their neighbor districts.
+    Districts without listings and without neighbors with listings get the mean of their smoothed neighbors (repeated up to max_hops times),
+    and finally the overall mean.
+
+    Args
+        adjacency_matrix: sparse adjacency matrix of the districts (see adjacency.to_sparse_matrix)
+        means: array with mean per district (in the order of the adjacency)
+        counts: array with number of listings per district
+        within_var: pooled variance of the listings within districts
+        max_hops: maximum number of steps to fill districts without neighbors with listings
+
+    Returns
+        smoothed: array with smoothed mean per district
+    '''
+    priors = weighted_means(adjacency_matrix, means, counts)
+    smoothed = shrink(means, counts, priors, within_var)
+
+    # fill districts without any neighbor with listings from their smoothed neighbors
+    for _ in range(max_hops):
+        missing = np.isnan(smoothed)
+
+        if not missing.any():
+            break
+
+        filled = weighted_means(adjacency_matrix, smoothed, (~missing).astype(float))
+        smoothed = np.where(missing, filled, smoothed)
+
+    # fall back to the overall mean (e.g. an island district)
+    overall = np.nansum(means * counts) / counts[~np.isnan(means)].sum() if np.any(counts[~np.isnan(means)] > 0) else np.nan
+
+    return np.where(np.isnan(smoothed), overall, smoothed)
+
+def smooth_nested_means(group_parents, means:np.ndarray, counts:np.ndarray, within_var:float):
+    '''
+    Function to smooth group means (e.g. streets) towards the count-weighted mean of their parent group (e.g. the district of the street).
+
+    Args
+        group_parents: array with the parent of each group
+        means: array with mean per group
+        counts: array with number of listings per group
+        within_var: pooled variance of the listings within groups
+
+    Returns
+        smoothed: array with smoothed mean per group
+    '''
+    # sparse membership matrix (groups x parents)
+    parent_codes, parents = pd.factorize(np.asarray(group_parents))
+    rows = np.flatnonzero(parent_codes >= 0)
+    membership = sparse.csr_matrix((np.ones(len(rows)), (rows, parent_codes[rows])), shape=(len(means), len(parents)))
+
+    # mean of each parent from its groups, mapped back to the groups
+    parent_means = weighted_means(membership.T.tocsr(), means, counts)
+    priors = membership @ np.nan_to_num(parent_means, nan=0.0)
+    priors = np.where((membership @ ~np.isnan(parent_means)) > 0, priors, np.nan)
+
+    return shrink(means, counts, priors, within_var)
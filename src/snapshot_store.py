@@ -0,0 +1,301 @@
+'''
+Functions for an append-only, date-partitioned store of scrape snapshots (Parquet) with trend aggregates over arbitrary periods.
+
+Every scrape of a rental site is cleaned with the site functions in clean_data.py and written as one partition:
+    snapshots/scrape_date=YYYY-MM-DD/site=X/part-0.parquet
+
+New scrapes only add partitions, so history is never re-read to add a snapshot. Range queries only read the partitions within the
+requested dates (partition pruning in pyarrow). Listings seen in several snapshots (or on several sites) share a listing_id and are
+deduplicated when reading, which allows computing rent changes between any two periods (see rent_change).
+
+Snapshots are stored before geodata is added (add_geodata.py), so rent changes are available per zip code or area, not per district.
+The district aggregates (aggregate_data.py) still compare 2023 with the historical data (2014-2016).
+
+To add snapshots of the current scrape files, type:
+    python src/snapshot_store.py
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import os
+import pathlib
+
+# data wrangling
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# custom functions for cleaning each site
+from clean_data import clean_site_A, clean_site_B, clean_site_C, clean_site_D
+
+# validation of types and values (bad rows are quarantined to a rejects file)
+from validate import validate_listings
+
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument, log_rows_dropped
+
+# municipality configuration (paths per municipality)
+from config import get_municipality
+
+# columns identifying a listing across snapshots and sites. Only attributes which do not change while a listing is online,
+# so a listing which is repriced between scrapes keeps its id (and deduplicate_listings keeps its latest price)
+ID_COLS = ["rental_type", "square_meters", "zip_code", "street", "rooms"]
+
+# partition columns (stored as strings, ISO dates are compared lexicographically)
+PARTITIONING = ds.partitioning(pa.schema([("scrape_date", pa.string()), ("site", pa.string())]), flavor="hive")
+
+def scrape_date_from_file(csv_path:pathlib.Path):
+    '''
+    Function to get the scrape date of a raw scrape file from the unix timestamp in its "web-scraper-order" column (e.g. "1681720076-863").
+
+    Args:
+        csv_path: path to raw scrape file
+
+    Returns:
+        scrape_date: date of the scrape as ISO string (e.g. "2023-04-17")
+    '''
+    order = pd.read_csv(csv_path, usecols=["web-scraper-order"], dtype=str)["web-scraper-order"]
+
+    # timestamp is before the dash, use median in case a scrape ran over midnight
+    timestamps = order.str.split("-").str[0].astype(int)
+
+    return pd.to_datetime(timestamps.median(), unit="s").date().isoformat()
+
+def listing_ids(listings:pd.DataFrame):
+    '''
+    Function to compute an id for each listing from the columns in ID_COLS.
+
+    Args:
+        listings: cleaned listings
+
+    Returns:
+        ids: pandas Series of uint64 hashes
+    '''
+    # cast to string so that e.g. zip codes read as int and str give the same id
+    return pd.util.hash_pandas_object(listings[ID_COLS].astype(str), index=False)
+
+def append_snapshot(listings:pd.DataFrame, store_path:pathlib.Path, scrape_date:str, site:str):
+    '''
+    Function to add the cleaned listings of one scrape of a site as a partition of the store.
+    Writing the same scrape date and site again replaces the partition, so reruns do not duplicate snapshots.
+
+    Args:
+        listings: cleaned listings of the scrape (e.g. from clean_site_A)
+        store_path: folder of the store
+        scrape_date: date of the scrape as ISO string
+        site: site id (e.g. "A")
+
+    Returns:
+        partition_path: path to the written partition
+    '''
+    listings = listings.copy()
+
+    # align types across sites (some site functions return numbers as strings)
+    for col in ["rent_without_expenses", "square_meters", "zip_code"]:
+        listings[col] = listings[col].astype(int)
+    listings["rooms"] = listings["rooms"].astype(str)
+
+    # add listing id, stamp year from scrape date
+    listings["listing_id"] = listing_ids(listings).to_numpy()
+    listings["year"] = int(scrape_date[:4])
+
+    # write to temporary file and replace to never leave a partial partition
+    partition_path = store_path / f"scrape_date={scrape_date}" / f"site={site}"
+    partition_path.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = partition_path / "part-0.parquet.tmp"
+    pq.write_table(pa.Table.from_pandas(listings, preserve_index=False), tmp_path)
+    os.replace(tmp_path, partition_path / "part-0.parquet")
+
+    return partition_path
+
+@instrument
+def read_snapshots(store_path:pathlib.Path, start:str=None, end:str=None, sites:list=None, columns:list=None):
+    '''
+    Function to read all snapshots within a date range. Only partitions within the range are read.
+
+    Args:
+        store_path: folder of the store
+        start: first scrape date to include as ISO string (defaults to all)
+        end: last scrape date to include as ISO string (defaults to all)
+        sites: sites to include (defaults to all)
+        columns: columns to read (defaults to all)
+
+    Returns:
+        listings: dataframe with one row per listing per snapshot, including "scrape_date" and "site"
+    '''
+    dataset = ds.dataset(store_path, format="parquet", partitioning=PARTITIONING)
+
+    # build filter on partition columns
+    expression = None
+
+    for condition in [ds.field("scrape_date") >= start if start is not None else None,
+                      ds.field("scrape_date") <= end if end is not None else None,
+                      ds.field("site").isin(sites) if sites is not None else None]:
+        if condition is not None:
+            expression = condition if expression is None else expression & condition
+
+    # always read partition columns and listing id
+    if columns is not None:
+        columns = list(dict.fromkeys(columns + ["listing_id", "scrape_date", "site"]))
+
+    listings = dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    return listings.sort_values("scrape_date", kind="stable").reset_index(drop=True)
+
+@instrument
+def deduplicate_listings(listings:pd.DataFrame):
+    '''
+    Function to keep one row per listing (the latest observation) across snapshots and sites.
+
+    Args:
+        listings: listings from read_snapshots
+
+    Returns:
+        listings: deduplicated listings with "first_seen", "last_seen" and "n_snapshots"
+    '''
+    # count snapshots of each listing
+    seen = listings.groupby("listing_id")["scrape_date"].agg(first_seen="min", last_seen="max", n_snapshots="nunique")
+
+    # keep latest observation (listings are sorted by scrape date)
+    n_rows = len(listings)
+    listings = listings.drop_duplicates(subset="listing_id", keep="last")
+    log_rows_dropped("drop_duplicates listing_id", n_rows, len(listings))
+
+    return listings.merge(seen, left_on="listing_id", right_index=True).reset_index(drop=True)
+
+def period_rent(store_path:pathlib.Path, start:str, end:str, by:str="zip_code", rental_type:str="apartment"):
+    '''
+    Function to compute the mean rent per square meter for a period with each listing counted once.
+
+    Args:
+        store_path: folder of the store
+        start, end: first and last scrape date of the period as ISO strings
+        by: column to aggregate by (e.g. "zip_code" or "area")
+        rental_type: rental type to include
+
+    Returns:
+        rents: dataframe with by, rent_sqm and n_listings
+    '''
+    listings = read_snapshots(store_path, start, end, columns=[by, "rental_type", "rent_without_expenses", "square_meters"])
+    listings = deduplicate_listings(listings[listings["rental_type"] == rental_type])
+
+    listings["rent_per_square_meter"] = listings["rent_without_expenses"] / listings["square_meters"]
+
+    rents = listings.groupby(by).agg(rent_sqm=("rent_per_square_meter", "mean"), n_listings=("listing_id", "count")).reset_index()
+
+    return rents
+
+def rent_change(store_path:pathlib.Path, then:tuple, now:tuple, by:str="zip_code", rental_type:str="apartment"):
+    '''
+    Function to compute the change in rent per square meter between two periods (as apartment_rent_change in aggregate_data.py).
+
+    Args:
+        store_path: folder of the store
+        then: (start, end) of the first period as ISO strings
+        now: (start, end) of the second period as ISO strings
+        by: column to aggregate by (e.g. "zip_code" or "area")
+        rental_type: rental type to include
+
+    Returns:
+        change: dataframe with by, rent_sqm_then, rent_sqm_now, n_listings_then, n_listings_now and rent_change (in percent)
+    '''
+    rents_then = period_rent(store_path, *then, by=by, rental_type=rental_type)
+    rents_now = period_rent(store_path, *now, by=by, rental_type=rental_type)
+
+    change = rents_then.merge(rents_now, on=by, how="outer", suffixes=("_then", "_now")).round(1)
+
+    # calculate change in percent
+    change["rent_change"] = round((change["rent_sqm_now"] - change["rent_sqm_then"]) / change["rent_sqm_then"] * 100, 1)
+
+    return change[[by, "rent_sqm_then", "rent_sqm_now", "n_listings_then", "n_listings_now", "rent_change"]]
+
+def trend_aggregates(store_path:pathlib.Path, start:str=None, end:str=None, by:str="zip_code", freq:str="W", rental_type:str="apartment"):
+    '''
+    Function to compute the mean rent per square meter per period (e.g. per week) within a date range.
+
+    Args:
+        store_path: folder of the store
+        start, end: first and last scrape date as ISO strings (defaults to all)
+        by: column to aggregate by (e.g. "zip_code" or "area")
+        freq: pandas frequency of the periods (e.g. "W" for weekly or "M" for monthly)
+        rental_type: rental type to include
+
+    Returns:
+        trends: dataframe with period, by, rent_sqm and n_listings
+    '''
+    listings = read_snapshots(store_path, start, end, columns=[by, "rental_type", "rent_without_expenses", "square_meters"])
+    listings = listings[listings["rental_type"] == rental_type].copy()
+
+    # count each listing once per period
+    listings["period"] = pd.to_datetime(listings["scrape_date"]).dt.to_period(freq)
+    listings = listings.drop_duplicates(subset=["listing_id", "period"], keep="last")
+
+    listings["rent_per_square_meter"] = listings["rent_without_expenses"] / listings["square_meters"]
+
+    trends = listings.groupby(["period", by]).agg(rent_sqm=("rent_per_square_meter", "mean"), n_listings=("listing_id", "count")).round(1).reset_index()
+
+    return trends
+
+def snapshot_scrapes(data_path:pathlib.Path, zip_codes:pd.DataFrame, store_path:pathlib.Path):
+    '''
+    Function to clean and validate the current scrape files of each site and add them as snapshots.
+    The historical files (2014-2016) are added once as site "historical", dated to the first of January of each year.
+    Rows failing validation are written to _rejects/site=X.csv in the store (replaced with every snapshot of the site, ignored when reading snapshots).
+
+    Args:
+        data_path: path to raw data
+        zip_codes: dataframe with zip codes
+        store_path: folder of the store
+
+    Returns:
+        partitions: list of written partitions
+    '''
+    partitions = []
+
+    # scrape files of each site with their cleaning function
+    sites = {"A": lambda: clean_site_A(data_path, zip_codes), "B": lambda: clean_site_B(data_path, zip_codes),
+             "C": lambda: clean_site_C(data_path), "D": lambda: clean_site_D(data_path, zip_codes)}
+
+    (store_path / "_rejects").mkdir(parents=True, exist_ok=True)
+
+    for site, clean_site in sites.items():
+        scrape_date = scrape_date_from_file(data_path / f"rental_scrape_{site}.csv")
+
+        # quarantine bad rows of the scrape
+        listings, rejects = validate_listings(clean_site(), zip_codes)
+        rejects.to_csv(store_path / "_rejects" / f"site={site}.csv", index=False)
+
+        partitions.append(append_snapshot(listings, store_path, scrape_date, site))
+
+    # add historical data (only once, as it does not change)
+    if not any(store_path.glob("scrape_date=*/site=historical")):
+        historical = pd.concat([pd.read_csv(data_path / "historical-data-anton.csv"), pd.read_csv(data_path / "historical-data-mina.csv")])
+
+        historical, rejects = validate_listings(historical, zip_codes)
+        rejects.to_csv(store_path / "_rejects" / "site=historical.csv", index=False)
+
+        for year, listings in historical.groupby("year"):
+            partitions.append(append_snapshot(listings, store_path, f"{year}-01-01", "historical"))
+
+    return partitions
+
+
+def main():
+    # define paths from configuration of default municipality
+    paths = get_municipality()["paths"]
+
+    # read in zip codes
+    zip_codes = pd.read_csv(paths["zip_codes"])
+
+    # add snapshots
+    partitions = snapshot_scrapes(paths["scrape_data"], zip_codes, paths["snapshots"])
+
+    print(f"[INFO:] Wrote {len(partitions)} snapshot partitions to {paths['snapshots']}")
+
+
+if __name__ == "__main__":
+    main()
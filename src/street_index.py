@@ -0,0 +1,109 @@
+'''
+Functions to build and query a nearest-neighbor index of streets which considers both rent and distance.
+
+The index is built once in aggregate_data.py and saved as results/street_index.npz.
+It allows querying the k most similar priced streets within a radius (in km) of a street without rerunning the pipeline (used in the street view of the app).
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+
+# data wrangling
+import geopandas as gpd
+import pandas as pd
+import numpy as np
+
+# spatial index
+from scipy.spatial import cKDTree
+
+def build_street_index(street_data:pd.DataFrame, save_path:pathlib.Path, geometry_col:str="geometry_street", crs=25832):
+    '''
+    Function to build the street index from street aggregates and save it to save_path.
+
+    Args
+        street_data: street aggregates with street, district, rent_per_square_meter and geometry as wkt
+        save_path: path to save the index to
+        geometry_col: name of the column with geometry as wkt
+        crs: crs of the geometry (defaults to 25832 as this is the crs for Denmark, must be in metres)
+
+    Outputs
+        street_index.npz: street names, districts, rents and centroids (in km) of all streets
+    '''
+
+    # get centroids of streets in km
+    centroids = gpd.GeoSeries.from_wkt(street_data[geometry_col], crs=crs).centroid
+    coords = np.column_stack([centroids.x, centroids.y]) / 1000
+
+    # save arrays (strings as unicode arrays to load without pickle)
+    np.savez(save_path / "street_index.npz",
+             street=street_data["street"].to_numpy(dtype=str),
+             district=street_data["district"].to_numpy(dtype=str),
+             rent=street_data["rent_per_square_meter"].to_numpy(dtype=float),
+             coords=coords,
+             )
+
+def load_street_index(index_path:pathlib.Path):
+    '''
+    Function to load the street index and build the KD-tree over the street centroids.
+
+    Args
+        index_path: path to street_index.npz
+
+    Returns
+        index: dict with KD-tree ("tree"), street names, districts, rents, centroids and a lookup from street name to position
+    '''
+    with np.load(index_path) as arrays:
+        index = {key: arrays[key] for key in arrays.files}
+
+    # build KD-tree over centroids
+    index["tree"] = cKDTree(index["coords"])
+
+    # lookup from street name to position in arrays
+    index["position"] = {street: i for i, street in enumerate(index["street"])}
+
+    return index
+
+def query_similar_streets(index:dict, street:str, k:int=5, radius_km:float=None):
+    '''
+    Function to get the k streets with most similar rent within radius_km of a street.
+
+    Args
+        index: street index from load_street_index
+        street: name of the target street
+        k: number of similar streets to get
+        radius_km: only consider streets with centroids within this distance in km. If None, all streets are considered.
+
+    Returns
+        similar_streets: dataframe with street, district, rent_per_square_meter and distance_km of the k most similar streets (sorted by rent difference)
+    '''
+    # get position of target street
+    i = index["position"][street]
+    target_coords = index["coords"][i]
+
+    # get candidates within radius from the KD-tree
+    if radius_km is None:
+        candidates = np.arange(len(index["street"]))
+    else:
+        candidates = np.asarray(index["tree"].query_ball_point(target_coords, r=radius_km), dtype=int)
+
+    # remove target street
+    candidates = candidates[candidates != i]
+
+    # absolute difference in rent to target street
+    abs_diff = np.abs(index["rent"][candidates] - index["rent"][i])
+
+    # get k candidates with smallest difference (stable sort to keep ties in index order)
+    order = np.argsort(abs_diff, kind="stable")[:k]
+    similar = candidates[order]
+
+    similar_streets = pd.DataFrame({
+        "street": index["street"][similar],
+        "district": index["district"][similar],
+        "rent_per_square_meter": index["rent"][similar],
+        "distance_km": np.linalg.norm(index["coords"][similar] - target_coords, axis=1).round(1),
+    })
+
+    return similar_streets
@@ -0,0 +1,286 @@
+'''
+Functions for fuzzy matching of street names with a trigram index, used in add_geodata.py to recover listings whose street name
+does not exactly match the street registry (e.g. "Fredriks Allé" vs "Frederiks Allé").
+
+Reference names are split into character trigrams and stored as a sparse (names x trigrams) matrix. Candidate names for a query
+are found in one sparse matrix product over the trigrams which are not too common (e.g. "ade" of "gade" is shared by thousands of
+street names), so a query is only compared with the few names it shares rare trigrams with (no comparison of all pairs of names).
+The similarity of a query and a candidate is the Dice coefficient of all their trigrams (1 for identical names).
+
+The index of a set of reference names can be persisted (see load_trigram_index), so it is only built again if the reference names change.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+import json
+import hashlib
+
+# data wrangling
+import pandas as pd
+import numpy as np
+
+# sparse matrices
+from scipy.sparse import csr_matrix
+
+# version of the format of persisted trigram indexes (increase if build_trigram_index changes)
+TRIGRAM_INDEX_FORMAT = 1
+
+def trigrams(name:str):
+    '''
+    Function to split a name into character trigrams. The name is padded to give weight to its start and end.
+
+    Args:
+        name: (normalized) name
+
+    Returns:
+        grams: set of trigrams, e.g. {"$$n", "$no", "nor", ...}
+    '''
+    padded = f"$${name}$"
+
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def trigram_matrix(names, vocabulary:dict, grow:bool=False):
+    '''
+    Function to create a sparse binary matrix with a row per name and a column per trigram in vocabulary.
+
+    Args:
+        names: names to encode
+        vocabulary: dict with trigram as key and column as value
+        grow: whether to add unseen trigrams to vocabulary (when building the index). Otherwise unseen trigrams are ignored
+
+    Returns:
+        matrix: scipy csr matrix of shape (len(names), len(vocabulary))
+    '''
+    rows, cols = [], []
+
+    for i, name in enumerate(names):
+        for gram in trigrams(name):
+            col = vocabulary.get(gram)
+
+            if col is None:
+                if not grow:
+                    continue
+
+                col = vocabulary[gram] = len(vocabulary)
+
+            rows.append(i)
+            cols.append(col)
+
+    return csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=(len(names), len(vocabulary)))
+
+def build_trigram_index(names, max_names_per_trigram:int=1000):
+    '''
+    Function to build a trigram index of reference names.
+
+    Args:
+        names: reference names (duplicates are removed)
+        max_names_per_trigram: trigrams found in more names are not used to find candidates (but still count in the similarity)
+
+    Returns:
+        index: dict with "names" (array of unique names), "vocabulary" (trigram to column), "matrix" (names x trigrams), "sizes" (trigrams per name),
+               "rare_cols" (columns of rare trigrams) and "candidate_matrix_t" (rare trigrams x names)
+    '''
+    names = np.unique(np.asarray(list(names), dtype=str))
+    vocabulary = {}
+
+    matrix = trigram_matrix(names, vocabulary, grow=True)
+
+    # keep rare trigrams for finding candidates, stored transposed for (queries x trigrams) @ (trigrams x names) products
+    rare_cols = np.flatnonzero(matrix.getnnz(axis=0) <= max_names_per_trigram)
+
+    index = {
+        "names": names,
+        "vocabulary": vocabulary,
+        "matrix": matrix,
+        "sizes": matrix.getnnz(axis=1),
+        "rare_cols": rare_cols,
+        "candidate_matrix_t": matrix[:, rare_cols].T.tocsr(),
+    }
+
+    return index
+
+def trigram_index_version(names, max_names_per_trigram:int=1000):
+    '''
+    Function to get the version of the trigram index of reference names, which changes if the names change.
+
+    Args:
+        names: reference names
+        max_names_per_trigram: see build_trigram_index
+
+    Returns:
+        version: dict with version of the index format, max_names_per_trigram and hash of the unique names
+    '''
+    names = np.unique(np.asarray(list(names), dtype=str))
+    digest = hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest()
+
+    return {"format": TRIGRAM_INDEX_FORMAT, "max_names_per_trigram": max_names_per_trigram, "names": digest}
+
+def save_trigram_index(index:dict, index_path:pathlib.Path):
+    '''
+    Function to save a trigram index.
+
+    Args:
+        index: trigram index from build_trigram_index
+        index_path: path to save the index to (.npz)
+
+    Outputs:
+        index_path: names, trigrams (in column order), the sparse matrix and the rare columns
+    '''
+    np.savez(index_path,
+             names=index["names"],
+             trigrams=np.array(list(index["vocabulary"]), dtype=str),
+             indices=index["matrix"].indices,
+             indptr=index["matrix"].indptr,
+             rare_cols=index["rare_cols"])
+
+def read_trigram_index(index_path:pathlib.Path):
+    '''
+    Function to read a trigram index saved with save_trigram_index.
+
+    Args:
+        index_path: path to the index (.npz)
+
+    Returns:
+        index: trigram index (as from build_trigram_index)
+    '''
+    with np.load(index_path) as arrays:
+        names, grams, indices, indptr, rare_cols = (arrays[key] for key in ["names", "trigrams", "indices", "indptr", "rare_cols"])
+
+    matrix = csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(len(names), len(grams)))
+
+    index = {
+        "names": names,
+        "vocabulary": {gram: col for col, gram in enumerate(grams.tolist())},
+        "matrix": matrix,
+        "sizes": matrix.getnnz(axis=1),
+        "rare_cols": rare_cols,
+        "candidate_matrix_t": matrix[:, rare_cols].T.tocsr(),
+    }
+
+    return index
+
+def load_trigram_index(names, index_path:pathlib.Path=None, max_names_per_trigram:int=1000):
+    '''
+    Function that loads the persisted trigram index of reference names, and only builds it again (see build_trigram_index) if the names changed.
+
+    Args:
+        names: reference names
+        index_path: path of the persisted index (its version is saved next to it with suffix .json). If None, the index is built and not saved
+        max_names_per_trigram: see build_trigram_index
+
+    Outputs:
+        index_path, index_path with suffix .json: index and its version (if built)
+
+    Returns:
+        index: trigram index (as from build_trigram_index)
+    '''
+    if index_path is None:
+        return build_trigram_index(names, max_names_per_trigram)
+
+    version = trigram_index_version(names, max_names_per_trigram)
+    version_path = index_path.with_suffix(".json")
+
+    # read persisted index if it is up to date
+    if index_path.exists() and version_path.exists():
+        with open(version_path, encoding="utf-8") as f:
+            saved_version = json.load(f)
+
+        if saved_version == version:
+            return read_trigram_index(index_path)
+
+    index = build_trigram_index(names, max_names_per_trigram)
+    save_trigram_index(index, index_path)
+
+    # write version last, so an incomplete index is never read
+    with open(version_path, "w", encoding="utf-8") as f:
+        json.dump(version, f, indent=2)
+
+    return index
+
+def match_names(index:dict, queries, threshold:float=0.8):
+    '''
+    Function to find the most similar reference name for each query.
+
+    Args:
+        index: trigram index from build_trigram_index
+        queries: names to match
+        threshold: minimum Dice similarity for a match
+
+    Returns:
+        matches: dataframe with query, match (None if the best name is below threshold or ties with another name) and score (Dice similarity of best name)
+    '''
+    queries = np.asarray(list(queries), dtype=str)
+
+    # no reference names to match to (e.g. an empty lookup)
+    if len(index["names"]) == 0:
+        return pd.DataFrame({"query": queries, "match": np.full(len(queries), None, dtype=object), "score": np.zeros(len(queries))})
+
+    query_matrix = trigram_matrix(queries, index["vocabulary"])
+
+    # find candidates (names sharing at least one rare trigram with the query)
+    candidates = (query_matrix[:, index["rare_cols"]] @ index["candidate_matrix_t"]).tocoo()
+    rows, cols = candidates.row, candidates.col
+
+    # count all shared trigrams of query and candidate
+    overlap = np.asarray(query_matrix[rows].multiply(index["matrix"][cols]).sum(axis=1)).ravel()
+
+    # dice similarity (unseen trigrams of the query still count in its size)
+    query_sizes = np.array([len(trigrams(query)) for query in queries])
+    scores = 2 * overlap / (query_sizes[rows] + index["sizes"][cols])
+
+    # find best name per query (sort by query, then by descending score)
+    order = np.lexsort((-scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    is_best = np.r_[True, rows[1:] != rows[:-1]] if len(rows) > 0 else np.zeros(0, dtype=bool)
+
+    best_score = np.zeros(len(queries))
+    best_match = np.full(len(queries), -1)
+    best_score[rows[is_best]] = scores[is_best]
+    best_match[rows[is_best]] = cols[is_best]
+
+    # find second best score per query to detect ties
+    is_second = np.r_[False, is_best[:-1] & (rows[1:] == rows[:-1])] if len(rows) > 0 else np.zeros(0, dtype=bool)
+    second_score = np.zeros(len(queries))
+    second_score[rows[is_second]] = scores[is_second]
+
+    # only keep matches above threshold which are not ambiguous
+    is_match = (best_score >= threshold) & (best_score > second_score)
+    matches = pd.DataFrame({
+        "query": queries,
+        "match": np.where(is_match, index["names"][best_match], None),
+        "score": best_score.round(3),
+    })
+
+    return matches
+
+def fuzzy_match_keys(keys:pd.Series, reference_keys:pd.Series, threshold:float=0.8, index:dict=None):
+    '''
+    Function to match the keys which have no exact match in reference_keys to their most similar reference key.
+
+    Args:
+        keys: (normalized) keys to match, e.g. street names of listings
+        reference_keys: (normalized) keys of the lookup, e.g. street names of the street registry
+        threshold: minimum Dice similarity for a match
+        index: trigram index of reference_keys (e.g. from load_trigram_index). If None, it is built from reference_keys
+
+    Returns:
+        report: dataframe with query, match, score and n_rows (rows of keys with the query) for every key without exact match
+    '''
+    # find keys without exact match
+    counts = keys.dropna().value_counts()
+    unmatched = counts.index[~counts.index.isin(reference_keys.dropna())]
+
+    if len(unmatched) == 0:
+        return pd.DataFrame({"query": [], "match": [], "score": [], "n_rows": []})
+
+    # match to reference keys
+    if index is None:
+        index = build_trigram_index(reference_keys.dropna())
+
+    report = match_names(index, unmatched, threshold)
+    report["n_rows"] = counts[unmatched].to_numpy()
+
+    return report
@@ -1,26 +1,78 @@
 import pathlib
+import threading
+import importlib.util
 import geopandas as gpd
 
-def add_missing_districts(path: pathlib.Path):
+# municipality configuration (paths and district lists per municipality)
+from config import get_municipality
+
+# engine for reading geo layers (pyogrio is much faster than fiona, fall back to the default engine if it is not installed)
+LAYER_ENGINE = "pyogrio" if importlib.util.find_spec("pyogrio") is not None else None
+
+# process-level cache of geo layers, key: (path, crs, to_crs, where), value: ((modification time, size) of file, layer)
+_layer_cache = {}
+_layer_lock = threading.Lock()
+
+def read_layer(path:pathlib.Path, crs:int=None, to_crs=None, where:tuple=None, copy:bool=True):
+    '''
+    Function for reading a geo layer (e.g. a geojson file) once per process.
+    The layer is read again if the file has changed (modification time or size) since it was cached.
+
+    Args:
+        path: path to layer
+        crs: crs to set on the layer (e.g. 25832). Defaults to the crs of the file
+        to_crs: crs to project the layer to (e.g. "epsg:4326"). Defaults to no projection
+        where: (column, values) to only keep the rows where column is in values. Defaults to all rows
+        copy: whether to return a copy. Without a copy, the cached layer must not be modified (e.g. only filtered)
+
+    Returns:
+        layer: geodataframe
+    '''
+    path = pathlib.Path(path).resolve()
+    key = (path, crs, to_crs, None if where is None else (where[0], tuple(where[1])))
+
+    stat = path.stat()
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    with _layer_lock:
+        cached = _layer_cache.get(key)
+
+        if cached is None or cached[0] != version:
+            # read in layer, set crs and project
+            layer = gpd.read_file(path, engine=LAYER_ENGINE)
+
+            if where is not None:
+                layer = layer[layer[where[0]].isin(where[1])]
+
+            if crs is not None:
+                layer = layer.set_crs(epsg=crs, allow_override=True)
+
+            if to_crs is not None:
+                layer = layer.to_crs(to_crs)
+
+            cached = _layer_cache[key] = (version, layer)
+
+    return cached[1].copy() if copy else cached[1]
+
+def add_missing_districts(municipality:dict=None, to_crs=None):
     '''
     Function for adding missing districts to dataframe.
     Districts are missing because they have no apartment data.
 
     Args:
-        path: path to script
+        municipality: municipality configuration (see config.py). Defaults to the default municipality
+        to_crs: crs to project the districts to (e.g. "epsg:4326" for folium). Defaults to the crs of the municipality
 
     Returns:
         missing_districts: geodataframe with missing districts
     '''
+    if municipality is None:
+        municipality = get_municipality()
 
-    # read in geojson file
-    geojson = gpd.read_file(path.parents[1] / "data" / "geo_data" / "statistics_districts.geojson")
-
-    # set crs to 25832
-    geojson = geojson.set_crs("epsg:25832")
-
-    # extract "Erhvervshavnen" and "Sydhavnen og Marselisborg lystbådehavn" in one dataframe
-    missing_districts = geojson[(geojson["prog_distrikt_navn"] == "Erhvervshavnen") | (geojson["prog_distrikt_navn"] == "Sydhavnen og Marselisborg lystbådehavn")]
+    # read in missing districts (e.g., "Erhvervshavnen" and "Sydhavnen og Marselisborg lystbådehavn" for Aarhus) from geojson file
+    # with crs of municipality (cached, only parsed again if the file changes)
+    missing_districts = read_layer(municipality["paths"]["statistics_districts"], crs=municipality["crs"], to_crs=to_crs,
+                                   where=("prog_distrikt_navn", municipality["missing_districts"]), copy=False)
 
     # rename prog_distrikt_navn to district
     missing_districts = missing_districts.rename(columns={"prog_distrikt_navn": "district"})
@@ -33,29 +85,28 @@ def add_missing_districts(path: pathlib.Path):
 
     return missing_districts
 
-def filter_midtbyen(data, midtbyen=True):
+def filter_midtbyen(data, midtbyen=True, central_districts:list=None):
     '''
     Function to filter the district data to only include midtbyen
 
     Args:
         data: dataframe containing the district data
         midtbyen: boolean indicating whether to filter to midtbyen (True) or remove it (False). Defaults to True.
+        central_districts: districts of the city center. Defaults to "central_districts" of the default municipality (Midtbyen in Aarhus)
     
     Returns:
         data: dataframe containing the district data for midtbyen
     '''
     # define midtbyen districts
-    midtbyen_districts = ["Trøjborg", "Universitetet/Kommunehospitalet", "Nordre Kirkegård", "Vestervang/Klostervang/Ø-gaderne", "Ø-gaderne Øst",
-                "Østbanetorvet/Nørre Stenbro", "Nørregade", "Latinerkvarteret", "Klostertorv/Vesterbro Torv", "Åboulevarden", "Skolegade/Bispetorv/Europaplads",
-                "Mølleparken", "TelefonTorvet", "Fredens Torv", "Ceresbyen/Godsbanen", "Rådhuskvarteret", "De Bynære Havnearealer/Aarhus Ø",
-                "Sydhavnen og Marselisborg lystbådehavn", "Frederiksbjerg Vest", "Frederiksbjerg Øst", "Erhvervshavnen", "Botanisk Have/Amtssygehuset"]
+    if central_districts is None:
+        central_districts = get_municipality()["central_districts"]
     
     # check if midtbyen should be included or excluded
     if midtbyen == True:
-        data = data[data["district"].isin(midtbyen_districts)]
+        data = data[data["district"].isin(central_districts)]
         
     if midtbyen == False:
-        data = data[~data["district"].isin(midtbyen_districts)]
+        data = data[~data["district"].isin(central_districts)]
 
     # reset index
     data = data.reset_index(drop=True)
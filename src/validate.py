@@ -0,0 +1,81 @@
+'''
+Functions for validating cleaned listings before they are combined (used in clean_data.py and snapshot_store.py).
+
+Rows which cannot be parsed (e.g. a malformed price in a new scrape) or have implausible values are quarantined to a rejects file
+with the reason(s) they were rejected, instead of crashing the pipeline on a type conversion. All checks are vectorized, and each
+column is parsed once, so validation is a single pass over the columns.
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# data wrangling
+import pandas as pd
+
+# instrumentation of pipeline stages (structured logs of time, rows and memory)
+from instrument import instrument, log_rows_dropped, emit
+
+# numeric columns of the cleaned listings (converted to int if valid)
+NUMERIC_COLS = ["rent_without_expenses", "square_meters", "rooms", "zip_code"]
+
+# plausible ranges (inclusive) of numeric columns and of the rent per square meter
+RANGES = {
+    "rent_without_expenses": (1000, 100000),
+    "square_meters": (5, 1000),
+    "rooms": (1, 20),
+    "rent_per_square_meter": (25, 1500),
+}
+
+# price ranges of project listings with several units (e.g. "11.500 - 18.000 kr./md." on site C, i.e. "11500 - 18000" after cleaning)
+PRICE_RANGE_PATTERN = r"^\s*\d+\s*-\s*\d+\s*$"
+
+@instrument
+def validate_listings(df:pd.DataFrame, zip_codes:pd.DataFrame):
+    '''
+    Function to check the types and values of cleaned listings and separate the rows failing any check.
+
+    Args:
+        df: cleaned listings (from the clean_site functions in clean_data.py or historical data)
+        zip_codes: dataframe with zip codes of the municipality
+
+    Returns:
+        valid: rows passing all checks, with NUMERIC_COLS converted to int
+        rejects: rows failing a check (as they were before validation), with a "reason" column listing the failed checks
+    '''
+    # parse numeric columns (unparseable values become NaN)
+    numbers = {col: pd.to_numeric(df[col], errors="coerce") for col in NUMERIC_COLS}
+    numbers["rent_per_square_meter"] = numbers["rent_without_expenses"] / numbers["square_meters"]
+
+    checks = {}
+
+    # rent given as a range is not the rent of one apartment
+    checks["rent is a price range"] = df["rent_without_expenses"].astype(str).str.match(PRICE_RANGE_PATTERN).to_numpy(dtype=bool)
+
+    # missing or unparseable numbers
+    for col in NUMERIC_COLS:
+        checks[f"{col} missing or not a number"] = numbers[col].isna().to_numpy()
+
+    # implausible values (only checked for parsed numbers)
+    for col, (low, high) in RANGES.items():
+        checks[f"{col} outside {low}-{high}"] = (numbers[col].notna() & ~numbers[col].between(low, high)).to_numpy()
+
+    # zip codes outside the municipality
+    checks["zip_code not in lookup"] = (numbers["zip_code"].notna() & ~numbers["zip_code"].isin(zip_codes["zip_code"])).to_numpy()
+
+    # combine checks, list failed checks per row
+    checks = pd.DataFrame(checks, index=df.index)
+    is_rejected = checks.any(axis=1)
+
+    rejects = df[is_rejected].copy()
+    rejects["reason"] = checks[is_rejected].dot(checks.columns + "; ").str.rstrip("; ")
+
+    # convert numeric columns of valid rows
+    valid = df[~is_rejected].copy()
+
+    for col in NUMERIC_COLS:
+        valid[col] = numbers[col][~is_rejected].astype(int)
+
+    log_rows_dropped("validate_listings", len(df), len(valid))
+    emit("validation", rows_rejected=len(rejects), checks_failed={name: int(n) for name, n in checks.sum().items() if n > 0})
+
+    return valid, rejects
@@ -0,0 +1,50 @@
+'''
+Tests of the near-duplicate detection in src/deduplicate.py.
+
+To run the tests, type:
+    python -m pytest tests
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+import sys
+
+# data wrangling
+import pandas as pd
+
+# custom modules from src
+sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
+from deduplicate import find_near_duplicates, collapse_near_duplicates
+
+def listings(websites:list, rents:list):
+    '''
+    Function to create listings which only differ in site and rent.
+    '''
+    return pd.DataFrame({
+        "website": websites,
+        "year": 2023,
+        "rental_type": "apartment",
+        "zip_code": 8000,
+        "street": "Nørregade",
+        "rooms": 2,
+        "square_meters": 70,
+        "rent_without_expenses": rents,
+    })
+
+def test_pairs_are_one_to_one_between_sites():
+    # one unit on site A and two distinct units within the rent tolerance of it on site B
+    df = listings(["Site A", "Site B", "Site B"], [10000, 9900, 10100])
+
+    pairs = find_near_duplicates(df)
+
+    # the site A listing is paired with only one of the site B listings
+    assert len(pairs) == 1
+    assert 0 in pairs.loc[0, ["first", "second"]].tolist()
+
+    # so only one site B listing is dropped
+    collapsed, _ = collapse_near_duplicates(df)
+
+    assert collapsed["website"].tolist() == ["Site A", "Site B"]
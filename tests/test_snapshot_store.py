@@ -0,0 +1,47 @@
+'''
+Tests of the snapshot store in src/snapshot_store.py.
+
+To run the tests, type:
+    python -m pytest tests
+
+by Anton Drasbæk Schiønning (@drasbaek) and Mina Almasi (@MinaAlmasi)
+Spatial Analytics, Cultural Data Science (F2023)
+'''
+
+# utils
+import pathlib
+import sys
+
+# data wrangling
+import pandas as pd
+
+# custom modules from src
+sys.path.append(str(pathlib.Path(__file__).parents[1] / "src"))
+from snapshot_store import append_snapshot, read_snapshots, deduplicate_listings
+
+def listing(rent:int):
+    '''
+    Function to create one cleaned listing with a given rent.
+    '''
+    return pd.DataFrame({
+        "website": ["Site A"],
+        "rental_type": ["apartment"],
+        "rent_without_expenses": [rent],
+        "square_meters": [70],
+        "zip_code": [8000],
+        "street": ["Vestergade"],
+        "area": ["Aarhus C"],
+        "rooms": [2],
+    })
+
+def test_repriced_listing_is_one_listing(tmp_path):
+    # same apartment seen in two weekly scrapes, repriced in between
+    append_snapshot(listing(10000), tmp_path, "2023-04-10", "A")
+    append_snapshot(listing(9500), tmp_path, "2023-04-17", "A")
+
+    listings = deduplicate_listings(read_snapshots(tmp_path))
+
+    # one row with the latest price, seen in both snapshots
+    assert len(listings) == 1
+    assert listings.loc[0, "n_snapshots"] == 2
+    assert listings.loc[0, "rent_without_expenses"] == 9500